@@ -0,0 +1,111 @@
+'''
+Runs WifiRadarServer on the host with a fake UART in both acquisition modes, with a network that blocks the event loop
+on every send (as a slow client or a congested WiFi link does on the ESP32), and compares:
+- acquisition: the longest time the UART was not read, the jitter of the frame timestamps, frames dropped by the UART
+  (its 256-byte receive buffer holds 8 frames) and frames evicted from the frame store before the client read them;
+- the frame store lock: how long it is held, by the acquisition thread and by the event loop;
+- delivery: frames written by the fake radar that the client did not receive.
+
+In the acquisition thread mode, a _thread reads the UART while the event loop only does networking. CPython releases
+the GIL while the event loop sleeps in a send, as MicroPython does while it waits for lwIP.
+
+python _try_dual_core.py --send-delay 0.2 --frame-rate 50 --duration 10
+'''
+import argparse, threading, time
+from _try_event_loop import percentile, LoadClient, Results
+import fakes
+import upython_sensor_server as uss
+
+
+class SlowSendServer(uss.WifiRadarServer):
+    # every send blocks the event loop for send_delay seconds
+    send_delay = 0.2
+
+    def flush_connection(self, connection):
+        time.sleep(self.send_delay)
+        return super().flush_connection(connection)
+
+
+class TimedLock():
+    # wraps the frame store lock and records how long it is held, by thread
+    def __init__(self, lock):
+        self.lock = lock
+        self.hold_times = {}
+        self.acquire_time = None
+
+    def __enter__(self):
+        self.lock.__enter__()
+        self.acquire_time = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        hold_time = time.perf_counter() - self.acquire_time
+        self.hold_times.setdefault(threading.current_thread().name, []).append(hold_time)
+        return self.lock.__exit__(*args)
+
+
+def run_mode(acquisition_thread, args):
+    fakes.FakeUART.instances.clear()
+    server = SlowSendServer(hostname='host_sim', port=0, poll_wait_time=0.05, queue_size=340,
+                            acquisition_thread=acquisition_thread)
+    server.frame_store_lock = TimedLock(server.frame_store_lock)
+    port = server.server_socket.getsockname()[1]
+    uart = fakes.FakeUART.instances[-1]
+    server.setup_event_loop()
+    server_running = True
+
+    def run_server():
+        while server_running:
+            server.run_event_loop_once()
+
+    server_thread = threading.Thread(target=run_server, name='event loop', daemon=True)
+    server_thread.start()
+    uart.start_radar(frame_rate=args.frame_rate)
+    results = Results()
+    client = LoadClient(port, True, args.interval, results)
+    client.thread.start()
+    time.sleep(args.duration)
+    uart.stop_radar()
+    time.sleep(2 * (args.interval + args.send_delay) + 0.5)
+    client.running = False
+    client.thread.join()
+    server_running = False
+    server_thread.join()
+    server.stop_acquisition_thread()
+
+    n_written = uart.frames_written + uart.frames_dropped
+    stats = server.get_acquisition_stats()
+    print(f'{"acquisition thread" if acquisition_thread else "single loop"}:')
+    print(f'  acquisition: {stats["polls"]} polls, max poll gap {stats["max_poll_gap_ms"]} ms, {stats["frames"]} frames, '
+          f'jitter {stats["jitter_ms"]:.2f} ms, max frame interval {stats["max_frame_interval_ms"]:.1f} ms')
+    print(f'  drops: {uart.frames_dropped} of {n_written} frames dropped by the UART, {stats["frames_missed"]} missed by the client '
+          f'({stats["evicted"]} evicted from the frame store), '
+          f'reader {stats["sensor"]}')
+    for name, hold_times in sorted(server.frame_store_lock.hold_times.items()):
+        thread_name = 'acquisition thread' if name != 'event loop' else name
+        print(f'  lock held by the {thread_name}: {len(hold_times)} times, p50 {percentile(hold_times, 50) * 1e6:.0f} us, '
+              f'p99 {percentile(hold_times, 99) * 1e6:.0f} us, max {max(hold_times) * 1e6:.0f} us')
+    print(f'  delivery: {len(results.frames)} frames received, {n_written - len(results.frames)} lost '
+          f'({1 - len(results.frames) / max(n_written, 1):.2%}), {len(results.response_latencies)} responses, '
+          f'{results.errors} errors')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--send-delay', type=float, default=0.2, help='seconds every send blocks the event loop')
+    parser.add_argument('--interval', type=float, default=0.2, help='seconds between the client\'s requests')
+    parser.add_argument('--frame-rate', type=float, default=50.0)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--mode', choices=('both', 'single', 'thread'), default='both')
+    args = parser.parse_args()
+
+    SlowSendServer.send_delay = args.send_delay
+    print(f'radar at {args.frame_rate} frames/s, sends block the event loop for {args.send_delay * 1000:.0f} ms')
+    if args.mode in ('both', 'single'):
+        run_mode(False, args)
+    if args.mode in ('both', 'thread'):
+        run_mode(True, args)
+
+
+if __name__ == '__main__':
+    main()
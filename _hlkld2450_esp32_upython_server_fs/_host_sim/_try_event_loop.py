@@ -0,0 +1,165 @@
+'''
+Runs WifiRadarServer on the host with a fake UART, under client load, and measures:
+- frame drop rate: frames written by the fake radar that no client received;
+- ingestion latency: from the radar writing a frame to the server timestamping it;
+- response latency: from sending a 'get' to receiving the whole response.
+
+python _try_event_loop.py --framed-clients 2 --legacy-clients 2 --duration 10
+'''
+import argparse, socket, struct, sys, threading, time
+import fakes
+fakes.install()
+import upython_sensor_server as uss
+
+# the server prints on every frame and request, keep the harness output readable
+uss.print = lambda *args, **kwargs: None
+
+
+def percentile(values, p):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p / 100 * len(values)))]
+
+
+def read_exactly(client_socket, n_bytes):
+    data = bytearray()
+    while len(data) < n_bytes:
+        chunk = client_socket.recv(n_bytes - len(data))
+        if not chunk:
+            raise ConnectionResetError('connection closed by server')
+        data.extend(chunk)
+    return bytes(data)
+
+
+def legacy_get_frames(payload):
+    # (timestamp, frame) tuples of a legacy 'get' payload
+    n = (len(payload) - 8) // 38
+    return [struct.unpack_from('d30s', payload, 38 * i) for i in range(n)]
+
+
+class LoadClient():
+    # polls the server with 'get', over a persistent framed connection or with one connection per request
+    def __init__(self, port, framed, interval, results):
+        self.port = port
+        self.framed = framed
+        self.interval = interval
+        self.results = results
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def get_framed(self, client_socket):
+        client_socket.sendall(struct.pack(uss.HEADER_FORMAT, uss.PROTOCOL_MAGIC, uss.PROTOCOL_VERSION, uss.MSG_GET, 0, 0, 0, 0))
+        magic, version, msg_type, flags, reserved, frame_count, payload_len = struct.unpack(
+            uss.HEADER_FORMAT, read_exactly(client_socket, uss.HEADER_SIZE))
+        return read_exactly(client_socket, payload_len)
+
+    def get_legacy(self):
+        with socket.create_connection(('127.0.0.1', self.port), timeout=5) as client_socket:
+            client_socket.sendall(b'get')
+            data = bytearray()
+            while True:
+                chunk = client_socket.recv(65536)
+                if not chunk:
+                    return bytes(data)
+                data.extend(chunk)
+
+    def run(self):
+        client_socket = None
+        while self.running:
+            t0 = time.perf_counter()
+            try:
+                if self.framed:
+                    if client_socket is None:
+                        client_socket = socket.create_connection(('127.0.0.1', self.port), timeout=5)
+                        client_socket.sendall(struct.pack(uss.HEADER_FORMAT, uss.PROTOCOL_MAGIC, uss.PROTOCOL_VERSION, uss.MSG_HELLO, 0, 0, 0, 0))
+                        read_exactly(client_socket, uss.HEADER_SIZE)
+                    payload = self.get_framed(client_socket)
+                else:
+                    payload = self.get_legacy()
+            except OSError:
+                self.results.record_error()
+                if client_socket is not None:
+                    client_socket.close()
+                    client_socket = None
+                time.sleep(self.interval)
+                continue
+            self.results.record_response(time.perf_counter() - t0, legacy_get_frames(payload))
+            time.sleep(self.interval)
+        if client_socket is not None:
+            client_socket.close()
+
+
+class Results():
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.response_latencies = []
+        self.frames = {}    # sequence number -> server timestamp
+        self.errors = 0
+
+    def record_response(self, latency, frames):
+        with self.lock:
+            self.response_latencies.append(latency)
+            for timestamp, frame in frames:
+                self.frames[fakes.frame_sequence(frame)] = timestamp
+
+    def record_error(self):
+        with self.lock:
+            self.errors += 1
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=0, help='0 for any free port')
+    parser.add_argument('--framed-clients', type=int, default=2)
+    parser.add_argument('--legacy-clients', type=int, default=1)
+    parser.add_argument('--interval', type=float, default=0.2, help='seconds between a client\'s requests')
+    parser.add_argument('--frame-rate', type=float, default=20.0)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--poll-wait-time', type=float, default=0.05)
+    args = parser.parse_args()
+
+    server = uss.WifiRadarServer(hostname='host_sim', port=args.port, poll_wait_time=args.poll_wait_time, queue_size=340)
+    port = server.server_socket.getsockname()[1]
+    uart = fakes.FakeUART.instances[-1]
+    server.setup_event_loop()
+    server_running = True
+
+    def run_server():
+        while server_running:
+            server.run_event_loop_once()
+
+    server_thread = threading.Thread(target=run_server, daemon=True)
+    server_thread.start()
+    uart.start_radar(frame_rate=args.frame_rate)
+
+    results = Results()
+    clients = [LoadClient(port, True, args.interval, results) for i in range(args.framed_clients)]
+    clients += [LoadClient(port, False, args.interval, results) for i in range(args.legacy_clients)]
+    for client in clients:
+        client.thread.start()
+    time.sleep(args.duration)
+    uart.stop_radar()
+    # let the clients collect the last frames
+    time.sleep(2 * args.interval + 0.2)
+    for client in clients:
+        client.running = False
+    for client in clients:
+        client.thread.join()
+    server_running = False
+    server_thread.join()
+
+    n_written = uart.frames_written + uart.frames_dropped
+    n_received = len(results.frames)
+    ingestion_latencies = [timestamp - uart.frame_write_times[sequence] for sequence, timestamp in results.frames.items()]
+    print(f'clients: {args.framed_clients} framed, {args.legacy_clients} legacy, one get every {args.interval} s each')
+    print(f'frames: {n_written} from the radar, {uart.frames_dropped} dropped by the UART, {n_received} received by clients, '
+          f'drop rate {1 - n_received / max(n_written, 1):.2%}')
+    print(f'ingestion latency: p50 {percentile(ingestion_latencies, 50) * 1000:.1f} ms, '
+          f'p99 {percentile(ingestion_latencies, 99) * 1000:.1f} ms, max {max(ingestion_latencies, default=float("nan")) * 1000:.1f} ms')
+    print(f'response latency: {len(results.response_latencies)} responses, p50 {percentile(results.response_latencies, 50) * 1000:.1f} ms, '
+          f'p99 {percentile(results.response_latencies, 99) * 1000:.1f} ms, errors {results.errors}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,195 @@
+'''
+Runs WifiRadarServer on the host with a fake UART and several clients reading the same sensor, and checks the fan-out:
+- every client receives every frame once, whatever the others read ('get' no longer takes frames from the others);
+- connections beyond max_connections are refused. The idle extra connections hold their slots until the server
+  closes them (REQUEST_TIMEOUT_MS), so close-delimited clients are refused now and then until then;
+- a slow client (small receive buffer, reading a few bytes at a time) cannot make the server hold more than
+  max_detached_bytes of copied responses: it is disconnected instead.
+
+Close-delimited clients connect from their own loopback address (127.0.0.10, 127.0.0.11...), since the server keeps
+their read positions by IP address.
+
+python _try_fan_out.py --framed-clients 3 --legacy-clients 2 --slow-clients 1 --extra-clients 2 --duration 10
+'''
+import argparse, socket, struct, threading, time
+from _try_event_loop import percentile, read_exactly, legacy_get_frames
+import fakes
+import upython_sensor_server as uss
+
+
+class SmallSendBufferServer(uss.WifiRadarServer):
+    # sockets with a send buffer as small as lwIP's on the ESP32, so that a response a slow client does not take
+    # stays in the server. A host's default send buffer would hold it whole
+    send_buffer_size = 2048
+
+    def accept_connections(self):
+        super().accept_connections()
+        for connection in self.connections.values():
+            connection.socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.send_buffer_size)
+
+
+class FanOutClient():
+    # polls the server with 'get' and records the sequence numbers of the frames received
+    def __init__(self, name, port, framed, interval, source_address=None, slow=False):
+        self.name = name
+        self.port = port
+        self.framed = framed
+        self.interval = interval
+        self.source_address = source_address
+        self.slow = slow
+        self.sequences = []
+        self.response_latencies = []
+        self.errors = 0
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def connect(self):
+        client_socket = socket.socket()
+        if self.slow:
+            # a small receive window: the server's sends stall as soon as a response does not fit
+            client_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1024)
+        if self.source_address is not None:
+            client_socket.bind((self.source_address, 0))
+        client_socket.settimeout(5)
+        client_socket.connect(('127.0.0.1', self.port))
+        return client_socket
+
+    def read_slowly(self, client_socket, n_bytes):
+        data = bytearray()
+        while len(data) < n_bytes:
+            chunk = client_socket.recv(min(64, n_bytes - len(data)))
+            if not chunk:
+                raise ConnectionResetError('connection closed by server')
+            data.extend(chunk)
+            time.sleep(0.01)
+        return bytes(data)
+
+    def get_framed(self, client_socket):
+        client_socket.sendall(struct.pack(uss.HEADER_FORMAT, uss.PROTOCOL_MAGIC, uss.PROTOCOL_VERSION, uss.MSG_GET, 0, 0, 0, 0))
+        header = read_exactly(client_socket, uss.HEADER_SIZE)
+        magic, version, msg_type, flags, reserved, frame_count, payload_len = struct.unpack(uss.HEADER_FORMAT, header)
+        if self.slow:
+            return self.read_slowly(client_socket, payload_len)
+        return read_exactly(client_socket, payload_len)
+
+    def get_legacy(self):
+        with self.connect() as client_socket:
+            client_socket.sendall(b'get')
+            data = bytearray()
+            while True:
+                chunk = client_socket.recv(65536)
+                if not chunk:
+                    return bytes(data)
+                data.extend(chunk)
+
+    def run(self):
+        client_socket = None
+        while self.running:
+            t0 = time.perf_counter()
+            try:
+                if self.framed:
+                    if client_socket is None:
+                        client_socket = self.connect()
+                        client_socket.sendall(struct.pack(uss.HEADER_FORMAT, uss.PROTOCOL_MAGIC, uss.PROTOCOL_VERSION, uss.MSG_HELLO, 0, 0, 0, 0))
+                        read_exactly(client_socket, uss.HEADER_SIZE)
+                    payload = self.get_framed(client_socket)
+                else:
+                    payload = self.get_legacy()
+            except OSError:
+                self.errors += 1
+                if client_socket is not None:
+                    client_socket.close()
+                    client_socket = None
+                time.sleep(self.interval)
+                continue
+            self.response_latencies.append(time.perf_counter() - t0)
+            self.sequences.extend(fakes.frame_sequence(frame) for timestamp, frame in legacy_get_frames(payload))
+            time.sleep(self.interval)
+        if client_socket is not None:
+            client_socket.close()
+
+    def summary(self):
+        received = set(self.sequences)
+        if received:
+            missing = len(set(range(min(received), max(received) + 1)) - received)
+        else:
+            missing = 0
+        return (f'{self.name}: {len(self.sequences)} frames, {missing} missing, {len(self.sequences) - len(received)} duplicates, '
+                f'{len(self.response_latencies)} responses (p50 {percentile(self.response_latencies, 50) * 1000:.1f} ms), '
+                f'{self.errors} errors')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--framed-clients', type=int, default=3)
+    parser.add_argument('--legacy-clients', type=int, default=2)
+    parser.add_argument('--slow-clients', type=int, default=1)
+    parser.add_argument('--extra-clients', type=int, default=2, help='persistent connections opened beyond max_connections')
+    parser.add_argument('--max-connections', type=int, default=None, help='the number of framed, legacy and slow clients by default')
+    parser.add_argument('--max-detached-bytes', type=int, default=uss.MAX_DETACHED_BYTES)
+    parser.add_argument('--queue-size', type=int, default=340)
+    parser.add_argument('--server-send-buffer', type=int, default=SmallSendBufferServer.send_buffer_size)
+    parser.add_argument('--interval', type=float, default=0.2, help='seconds between a client\'s requests')
+    parser.add_argument('--slow-interval', type=float, default=2.0, help='seconds between a slow client\'s requests')
+    parser.add_argument('--frame-rate', type=float, default=50.0)
+    parser.add_argument('--duration', type=float, default=10.0)
+    args = parser.parse_args()
+    if args.max_connections is None:
+        args.max_connections = args.framed_clients + args.legacy_clients + args.slow_clients
+
+    SmallSendBufferServer.send_buffer_size = args.server_send_buffer
+    server = SmallSendBufferServer(hostname='host_sim', port=0, poll_wait_time=0.02, queue_size=args.queue_size,
+                                 max_connections=args.max_connections, max_detached_bytes=args.max_detached_bytes)
+    port = server.server_socket.getsockname()[1]
+    uart = fakes.FakeUART.instances[-1]
+    server.setup_event_loop()
+    server_running = True
+    peaks = {'connections': 0, 'detached_bytes': 0}
+
+    def run_server():
+        while server_running:
+            server.run_event_loop_once()
+            peaks['connections'] = max(peaks['connections'], len(server.connections))
+            peaks['detached_bytes'] = max(peaks['detached_bytes'], server.detached_bytes)
+
+    server_thread = threading.Thread(target=run_server, daemon=True)
+    server_thread.start()
+    uart.start_radar(frame_rate=args.frame_rate)
+
+    clients = [FanOutClient(f'framed {i}', port, True, args.interval) for i in range(args.framed_clients)]
+    clients += [FanOutClient(f'legacy {i}', port, False, args.interval, source_address=f'127.0.0.{10 + i}')
+                for i in range(args.legacy_clients)]
+    clients += [FanOutClient(f'slow {i}', port, True, args.slow_interval, slow=True) for i in range(args.slow_clients)]
+    for client in clients:
+        client.thread.start()
+    time.sleep(0.5)
+    # idle persistent connections, to fill the connection slots
+    extra_sockets = []
+    for i in range(args.extra_clients):
+        try:
+            extra_sockets.append(socket.create_connection(('127.0.0.1', port), timeout=5))
+        except OSError:
+            pass
+    time.sleep(args.duration)
+    uart.stop_radar()
+    time.sleep(2 * args.interval + 0.2)
+    for client in clients:
+        client.running = False
+    for client in clients:
+        client.thread.join()
+    for extra_socket in extra_sockets:
+        extra_socket.close()
+    server_running = False
+    server_thread.join()
+
+    print(f'radar: {uart.frames_written} frames written, {uart.frames_dropped} dropped by the UART')
+    for client in clients:
+        print(client.summary())
+    print(f'server: max_connections {server.max_connections}, peak connections {peaks["connections"]}, '
+          f'{server.refused_connections} refused')
+    print(f'server: max_detached_bytes {server.max_detached_bytes}, peak detached bytes {peaks["detached_bytes"]}, '
+          f'{server.slow_clients_dropped} slow clients dropped')
+
+
+if __name__ == '__main__':
+    main()
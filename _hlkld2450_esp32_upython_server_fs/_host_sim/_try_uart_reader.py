@@ -0,0 +1,121 @@
+'''
+Benchmarks ld2450_radar.UARTFrameReader against the byte-at-a-time reader it replaced, on a fake UART:
+- throughput: frames parsed per second from a UART holding many frames;
+- resync: frames recovered from a stream with noise, truncated frames and corrupted headers/tails, fed in random
+  chunk sizes, checking that every intact frame comes out and nothing else does.
+
+python _try_uart_reader.py --frames 5000 --corruption-rate 0.1
+'''
+import argparse, random, time
+import fakes
+fakes.install()
+import ld2450_radar
+
+# bytes that never form part of a report header, so that noise cannot fake a frame
+NOISE_BYTES = bytes(b for b in range(256) if b != 0xAA)
+
+
+class ByteAtATimeReader():
+    # the reader before UARTFrameReader: uart.read(1) until the report tail
+    def __init__(self, uart):
+        self.uart = uart
+
+    def _read_until(self, terminator):
+        buffer = bytearray()
+        while True:
+            byte = self.uart.read(1)
+            if not byte:
+                break # Timeout or end of data
+            buffer.extend(byte)
+            if buffer.endswith(terminator):
+                break
+        return bytes(buffer)
+
+    def read_frames(self):
+        frames = []
+        while self.uart.any() >= 30:
+            frame = self._read_until(ld2450_radar.REPORT_TAIL)
+            if len(frame) == 30 and ld2450_radar.REPORT_HEADER in frame:
+                frames.append(frame)
+        return frames
+
+
+def benchmark_throughput(reader_class, n_frames, batch_size=100):
+    # feeds batches of frames, as few large writes since the socket pair behind the fake UART only holds so many,
+    # and times the reads only
+    uart = fakes.FakeUART(2, rxbuf=batch_size * 30)
+    reader = reader_class(uart)
+    frames = []
+    elapsed = 0.0
+    for first_sequence in range(0, n_frames, batch_size):
+        uart.feed(b''.join(fakes.make_frame(sequence) for sequence in range(first_sequence, min(first_sequence + batch_size, n_frames))))
+        t0 = time.perf_counter()
+        frames.extend(reader.read_frames())
+        elapsed += time.perf_counter() - t0
+    assert [fakes.frame_sequence(frame) for frame in frames] == list(range(n_frames))
+    return n_frames / elapsed
+
+
+def corrupted_stream(n_frames, corruption_rate, rng):
+    # returns the stream bytes and the sequence numbers of the frames left intact
+    stream = bytearray()
+    intact = []
+    for sequence in range(n_frames):
+        frame = bytearray(fakes.make_frame(sequence))
+        if rng.random() < corruption_rate:
+            kind = rng.choice(('noise', 'truncated', 'header', 'tail'))
+            if kind == 'noise':
+                # noise before an intact frame
+                stream.extend(rng.choice(NOISE_BYTES) for i in range(rng.randint(1, 40)))
+                intact.append(sequence)
+            elif kind == 'truncated':
+                frame = frame[:rng.randint(1, 29)]
+            elif kind == 'header':
+                frame[rng.randint(0, 3)] ^= 0x10
+            else:
+                frame[rng.randint(28, 29)] ^= 0x10
+        else:
+            intact.append(sequence)
+        stream.extend(frame)
+    return bytes(stream), intact
+
+
+def run_resync(n_frames, corruption_rate, seed):
+    rng = random.Random(seed)
+    stream, intact = corrupted_stream(n_frames, corruption_rate, rng)
+    uart = fakes.FakeUART(2, rxbuf=len(stream))
+    reader = ld2450_radar.UARTFrameReader(uart)
+    frames = []
+    position = 0
+    while position < len(stream):
+        # chunks of any size, so that frames are split across reads
+        chunk_size = rng.randint(1, 200)
+        uart.feed(stream[position:position + chunk_size])
+        position += chunk_size
+        frames.extend(reader.read_frames())
+    sequences = [fakes.frame_sequence(frame) for frame in frames]
+    return sequences, intact, reader.get_stats()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--frames', type=int, default=5000)
+    parser.add_argument('--corruption-rate', type=float, default=0.1)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    bulk_rate = benchmark_throughput(ld2450_radar.UARTFrameReader, args.frames)
+    byte_rate = benchmark_throughput(ByteAtATimeReader, args.frames)
+    print(f'throughput: bulk reader {bulk_rate:,.0f} frames/s, byte-at-a-time reader {byte_rate:,.0f} frames/s '
+          f'({bulk_rate / byte_rate:.1f}x)')
+
+    sequences, intact, stats = run_resync(args.frames, args.corruption_rate, args.seed)
+    missed = sorted(set(intact) - set(sequences))
+    unexpected = sorted(set(sequences) - set(intact))
+    print(f'resync: {len(intact)} intact frames in the stream, {len(sequences)} read, {len(missed)} missed, '
+          f'{len(unexpected)} corrupted frames read, in order: {sequences == sorted(sequences)}')
+    print(f'reader stats: {stats}')
+
+
+if __name__ == '__main__':
+    main()
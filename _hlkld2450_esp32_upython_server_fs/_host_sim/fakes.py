@@ -0,0 +1,181 @@
+'''
+Fake MicroPython modules for running the ESP32 server files under CPython, on a Linux host.
+Not meant to be copied to the ESP32.
+
+Call install() before importing upython_sensor_server or ld2450_radar.
+'''
+import fcntl, os, socket, struct, sys, termios, threading, time, types
+
+SERVER_FS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+UART_DEFAULT_RXBUF = 256    # bytes, the ESP32 UART driver's default receive buffer
+REPORT_HEADER = bytes.fromhex('AAFF0300')
+REPORT_TAIL = bytes.fromhex('55CC')
+
+
+class FakeWLAN():
+    def __init__(self, *args):
+        pass
+
+    def active(self, *args):
+        return True
+
+    def isconnected(self):
+        return True
+
+    def ifconfig(self):
+        return ('127.0.0.1', '255.0.0.0', '127.0.0.1', '127.0.0.1')
+
+    def config(self, *args, **kwargs):
+        pass
+
+
+def fake_connect_to_wifi(hostname='ESP32_server'):
+    return True, FakeWLAN()
+
+
+def fake_reset():
+    raise SystemExit('machine.reset()')
+
+
+class FakeUART():
+    '''
+    A machine.UART backed by a socket pair, so that it can be registered with select.poll() like the real one.
+    A radar thread (see start_radar()) writes frames into it at the sensor's frame rate. Bytes that do not fit in
+    the receive buffer are dropped, as the ESP32's UART driver drops them when they are not read in time.
+    '''
+    instances = []
+
+    def __init__(self, uart_id, tx=None, rx=None, rxbuf=UART_DEFAULT_RXBUF, **kwargs):
+        self.uart_id = uart_id
+        self.rxbuf = rxbuf
+        self._uart_end, self._radar_end = socket.socketpair()
+        self._uart_end.setblocking(False)
+        self.write_lock = threading.Lock()
+        # radar side counters
+        self.frames_written = 0
+        self.frames_dropped = 0
+        self.bytes_dropped = 0
+        self.frame_write_times = {}     # frame sequence number -> time.time() when it was written
+        self.radar_thread = None
+        self.radar_running = False
+        FakeUART.instances.append(self)
+
+    def init(self, baudrate=9600, bits=8, parity=None, stop=1, **kwargs):
+        self.baudrate = baudrate
+
+    def fileno(self):
+        return self._uart_end.fileno()
+
+    def any(self):
+        return struct.unpack('i', fcntl.ioctl(self._uart_end.fileno(), termios.FIONREAD, b'\0\0\0\0'))[0]
+
+    def read(self, nbytes=None):
+        # as the real UART with timeout=0: None if there is nothing to read
+        try:
+            data = self._uart_end.recv(nbytes if nbytes is not None else max(self.any(), 1))
+        except BlockingIOError:
+            return None
+        return data or None
+
+    def readinto(self, buf, nbytes=None):
+        try:
+            n = self._uart_end.recv_into(buf, nbytes or 0)
+        except BlockingIOError:
+            return None
+        return n or None
+
+    def write(self, buf):
+        return len(buf)
+
+    def feed(self, data):
+        '''
+        Radar side: writes bytes into the receive buffer, dropping them if the buffer is full.
+
+        Returns:
+        bool: True if the bytes were written.
+        '''
+        with self.write_lock:
+            if self.any() + len(data) > self.rxbuf:
+                self.bytes_dropped += len(data)
+                return False
+            self._radar_end.sendall(data)
+            return True
+
+    def start_radar(self, frame_rate=10.0, frame_source=None):
+        '''
+        Starts a thread writing one frame every 1 / frame_rate seconds.
+
+        Args:
+        frame_rate (float): frames per second.
+        frame_source (callable): sequence number -> frame bytes. make_frame() by default.
+        '''
+        frame_source = frame_source or make_frame
+        self.radar_running = True
+
+        def run():
+            next_time = time.monotonic()
+            sequence = 0
+            while self.radar_running:
+                frame = frame_source(sequence)
+                self.frame_write_times[sequence] = time.time()
+                if self.feed(frame):
+                    self.frames_written += 1
+                else:
+                    self.frames_dropped += 1
+                sequence += 1
+                next_time += 1 / frame_rate
+                time.sleep(max(0, next_time - time.monotonic()))
+
+        self.radar_thread = threading.Thread(target=run, daemon=True)
+        self.radar_thread.start()
+
+    def stop_radar(self):
+        self.radar_running = False
+        if self.radar_thread is not None:
+            self.radar_thread.join()
+
+
+def make_frame(sequence):
+    # an LD2450 report frame with one target whose x and y carry the sequence number, so that receivers can find gaps
+    target1 = struct.pack('<HHHH', sequence & 0x7FFF, (sequence >> 15) & 0x7FFF, 0, 360)
+    return REPORT_HEADER + target1 + bytes(16) + REPORT_TAIL
+
+
+def frame_sequence(frame):
+    # the sequence number of a make_frame() frame
+    x, y = struct.unpack('<HH', frame[4:8])
+    return x | (y << 15)
+
+
+def install():
+    '''
+    Installs the fake network, machine and wifi_utils modules and MicroPython's time functions,
+    and puts the server's files on the import path.
+    '''
+    time.sleep_ms = lambda ms: time.sleep(ms / 1000)
+    time.sleep_us = lambda us: time.sleep(us / 1000000)
+    time.ticks_ms = lambda: int(time.monotonic() * 1000)
+    time.ticks_us = lambda: int(time.monotonic() * 1000000)
+    time.ticks_diff = lambda a, b: a - b
+    time.ticks_add = lambda a, b: a + b
+
+    network = types.ModuleType('network')
+    network.STA_IF = 0
+    network.WLAN = FakeWLAN
+    network.hostname = lambda *args: None
+    sys.modules['network'] = network
+
+    machine = types.ModuleType('machine')
+    machine.UART = FakeUART
+    machine.reset = fake_reset
+    sys.modules['machine'] = machine
+
+    wifi_utils = types.ModuleType('wifi_utils')
+    wifi_login_at_startup = types.ModuleType('wifi_utils.wifi_login_at_startup')
+    wifi_login_at_startup.connect_to_wifi = fake_connect_to_wifi
+    wifi_utils.wifi_login_at_startup = wifi_login_at_startup
+    sys.modules['wifi_utils'] = wifi_utils
+    sys.modules['wifi_utils.wifi_login_at_startup'] = wifi_login_at_startup
+
+    if SERVER_FS_DIR not in sys.path:
+        sys.path.insert(0, SERVER_FS_DIR)
@@ -0,0 +1,274 @@
+import struct
+
+# The server's side of the wire protocol: message constants, request parsing, read positions and the 'get' payload
+# encodings. Imported by upython_sensor_server.py on the ESP32, and by the client's simulated_server.py on a host,
+# so that the simulated servers speak exactly what the ESP32 does.
+
+# framed protocol, used over persistent connections. Same constants as the client's wire_protocol.py.
+# every message is a 12-byte header followed by payload_len bytes of payload:
+#   magic (2s) version (B) message type (B) flags (B) reserved (B) frame count (H) payload length (I), little-endian
+PROTOCOL_MAGIC = b'LD'
+PROTOCOL_VERSION = 1
+HEADER_FORMAT = '<2sBBBBHI'
+HEADER_SIZE = 12
+MSG_HELLO = 0x01
+MSG_ECHO = 0x02     # the payload is a legacy request string
+MSG_CLEAR = 0x03
+MSG_GET = 0x04
+MSG_RESET = 0x05
+MSG_GET_SINCE = 0x06    # the payload is a boot id (I) and a sequence number (Q), see since_read_start()
+MSG_STATS = 0x07    # the response payload is the telemetry counters, see pack_stats_payload()
+MSG_ERROR = 0x7F
+RESPONSE_BIT = 0x80     # set in the message type of every response
+MAX_REQUEST_PAYLOAD = 1024
+# the legacy request string each message type is processed as (MSG_ECHO carries its own)
+MESSAGE_TYPE_COMMANDS = {MSG_CLEAR: 'clear', MSG_GET: 'get', MSG_RESET: 'reset', MSG_STATS: 'stats'}
+# header flags. In HELLO, the encodings the client accepts and the server agrees to; in a GET response, the payload's encoding
+FLAG_COMPACT = 0x01
+FLAG_SEQUENCE = 0x02    # HELLO only: the server answers MSG_GET_SINCE
+FLAG_STATS = 0x04   # HELLO only: the server answers MSG_STATS
+SUPPORTED_FLAGS = FLAG_COMPACT | FLAG_SEQUENCE | FLAG_STATS
+# 'get since' request payload and response prefix: boot id (I) sequence number (Q), answered with
+# boot id (I) sequence number of the first frame sent (Q) sequence number of the next frame to be stored (Q), then a 'get' payload
+SINCE_REQUEST_FORMAT = '<IQ'
+SINCE_RESPONSE_FORMAT = '<IQQ'
+# 'stats' response payload, counters since boot: boot id (I) uptime in ms (I) frames read (I) header resyncs of the
+# sensor reader (I) bytes skipped by the sensor reader (I) frames clients missed (I) poll timeouts (I) connections accepted (I) refused (I)
+# timed out (I) slow clients dropped (I) bytes sent (Q) wifi reconnects (H) free heap in bytes (I) longest main loop
+# iteration in ms (I), then the main loop time histogram: the number of bucket bounds (B), the bounds in ms (H each)
+# and one count per bucket (I each), the last bucket for iterations slower than every bound
+STATS_FORMAT = '<IIIIIIIIIIIQHII'
+
+# compact 'get' payload, see encode_frames_compact():
+# base timestamp (d) final timestamp (d) number of runs (H) number of escaped timestamps (H), then the escaped timestamps (d each),
+# the frame time deltas (H each), the run lengths (H each) and the 24 target bytes of each non-empty frame
+COMPACT_HEADER_FORMAT = '<ddHH'
+COMPACT_DELTA_ESCAPE = 0xFFFF   # the frame's timestamp is the next escaped timestamp
+REPORT_HEADER = bytes.fromhex('AAFF0300')
+REPORT_TAIL = bytes.fromhex('55CC')
+EMPTY_TARGETS = bytes(24)
+
+# what a request asks for, see parse_request() and parse_framed_request()
+REQUEST_HELLO = 'hello'
+REQUEST_ERROR = 'error'
+REQUEST_GET = 'get'
+REQUEST_GET_SINCE = 'get since'
+REQUEST_STATS = 'stats'
+REQUEST_COMMAND = 'command'     # any other request string: echoed in capitals, after 'clear' or before 'reset' takes effect
+
+
+class ClientCursor():
+    # a client's read position in the frame store for 'get' and 'clear'
+    def __init__(self, now):
+        self.next_sequence = None   # the sequence number of the next frame to send, None for the oldest frame held
+        self.frames_missed = 0  # frames overwritten before the client read them
+        self.last_seen_time = now
+
+
+def parse_get_since_request(input_data):
+    '''
+    Parses a text 'get since <sequence number> [<boot id>]' request.
+
+    Returns:
+    tuple: (boot id, or None if not given, sequence number), or None if input_data is not a 'get since' request.
+    '''
+    parts = input_data.split()
+    if len(parts) not in (3, 4) or parts[0] != 'get' or parts[1] != 'since':
+        return None
+    try:
+        sequence = int(parts[2])
+        boot_id = int(parts[3]) if len(parts) == 4 else None
+    except ValueError:
+        return None
+    return boot_id, sequence
+
+
+def parse_request(input_data):
+    '''
+    Parses a legacy request string.
+
+    Returns:
+    str: REQUEST_GET, REQUEST_GET_SINCE, REQUEST_STATS or REQUEST_COMMAND (the empty string, answered with 'IMA', included).
+    The argument: (boot id, sequence number) for REQUEST_GET_SINCE, input_data for REQUEST_COMMAND, None otherwise.
+    '''
+    if input_data == 'get':
+        return REQUEST_GET, None
+    get_since_request = parse_get_since_request(input_data)
+    if get_since_request is not None:
+        return REQUEST_GET_SINCE, get_since_request
+    if input_data == 'stats':
+        return REQUEST_STATS, None
+    return REQUEST_COMMAND, input_data
+
+
+def unpack_request_header(header):
+    # (version, message type, flags, payload length) of a framed request header, None if it is not one
+    magic, version, msg_type, flags, reserved, frame_count, payload_len = struct.unpack(HEADER_FORMAT, header)
+    if magic != PROTOCOL_MAGIC or payload_len > MAX_REQUEST_PAYLOAD:
+        return None
+    return version, msg_type, flags, payload_len
+
+
+def parse_framed_request(version, msg_type, payload):
+    '''
+    Parses a framed request, see unpack_request_header().
+
+    Returns:
+    str: what the request asks for, REQUEST_HELLO, REQUEST_ERROR or one of parse_request()'s. A MSG_ECHO, MSG_CLEAR,
+         MSG_RESET or MSG_STATS request is its legacy request string's.
+    The argument: the error message for REQUEST_ERROR, otherwise as in parse_request().
+    '''
+    if msg_type == MSG_HELLO:
+        return REQUEST_HELLO, None
+    if version != PROTOCOL_VERSION:
+        return REQUEST_ERROR, b'unsupported protocol version'
+    if msg_type == MSG_GET:
+        return REQUEST_GET, None
+    if msg_type == MSG_GET_SINCE and len(payload) == struct.calcsize(SINCE_REQUEST_FORMAT):
+        return REQUEST_GET_SINCE, struct.unpack(SINCE_REQUEST_FORMAT, payload)
+    if msg_type == MSG_ECHO or msg_type in MESSAGE_TYPE_COMMANDS:
+        input_data = bytes(payload).decode() if msg_type == MSG_ECHO else MESSAGE_TYPE_COMMANDS[msg_type]
+        return parse_request(input_data)
+    return REQUEST_ERROR, b'unknown message type'
+
+
+def negotiate_hello(version, flags):
+    # the version and flags of the HELLO response: the highest version both sides speak, the encodings both sides support
+    return min(version, PROTOCOL_VERSION), flags & SUPPORTED_FLAGS
+
+
+def pack_response_header(version, msg_type, flags, frame_count, payload_len):
+    return struct.pack(HEADER_FORMAT, PROTOCOL_MAGIC, version, msg_type | RESPONSE_BIT, flags, 0, frame_count, payload_len)
+
+
+def client_read_start(cursor, first_sequence, next_sequence):
+    '''
+    Finds where a 'get' on a client's cursor starts, given the frame store's (first_sequence(), next_sequence()),
+    and moves the cursor past the frames it sends.
+
+    Returns:
+    int: the sequence number of the first frame to send.
+    int: the frames the client missed, evicted before it read them (also added to cursor.frames_missed).
+    '''
+    sequence = first_sequence if cursor.next_sequence is None else min(cursor.next_sequence, next_sequence)
+    n_missed = 0
+    if sequence < first_sequence:
+        # the client did not keep up with the sensor
+        n_missed = first_sequence - sequence
+        cursor.frames_missed += n_missed
+        sequence = first_sequence
+    cursor.next_sequence = next_sequence
+    return sequence, n_missed
+
+
+def since_read_start(boot_id, sequence, server_boot_id, first_sequence, next_sequence):
+    '''
+    Finds where a 'get since' response starts. Frames already evicted are skipped: the client sees the gap between its
+    sequence number and the first one sent. A sequence number of another boot (boot_id is not this server's, and not
+    None for "this boot") is not valid here, the response then starts at the oldest frame held.
+
+    Returns:
+    int: the sequence number of the first frame to send.
+    int: the frames the client missed, evicted before it read them.
+    '''
+    if (boot_id is not None and boot_id != server_boot_id) or sequence > next_sequence:
+        return first_sequence, 0
+    if boot_id is not None and sequence < first_sequence:
+        # the client's cursor is in this boot, the frames up to the oldest one held were evicted before it read them
+        return first_sequence, first_sequence - sequence
+    return max(sequence, first_sequence), 0
+
+
+def since_response_prefix(boot_id, sequence, next_sequence):
+    return struct.pack(SINCE_RESPONSE_FORMAT, boot_id, sequence, next_sequence)
+
+
+def encode_frames(store, sequence, n_frames, serialization_timestamp, compact=False):
+    '''
+    Serializes n_frames frames of a FrameStore from sequence number sequence on, in the compact encoding if requested
+    and possible.
+
+    Returns:
+    list: the payload chunks. A legacy 'd30s' payload is not copied: it is one or two memoryviews of the frame store,
+          then the final serialization timestamp, see FrameStore.wire_slices().
+    int: FLAG_COMPACT if the payload is in the compact encoding, 0 if it is in the legacy encoding.
+    '''
+    if compact:
+        serialized_data = encode_frames_compact(store, sequence, n_frames, serialization_timestamp)
+        if serialized_data is not None:
+            return [serialized_data], FLAG_COMPACT
+    # legacy encoding: the frames as stored, then the final serialization timestamp
+    chunks = store.wire_slices(sequence, n_frames)
+    chunks.append(struct.pack('d', serialization_timestamp))
+    return chunks, 0
+
+
+def encode_frames_compact(store, sequence, n_frames, serialization_timestamp):
+    '''
+    Encodes n_frames frames of a FrameStore from sequence number sequence on without their constant header and tail, with 2-byte
+    millisecond time deltas, and with empty frames (no targets) reduced to their time delta. 2 bytes per empty
+    frame, 26 per other frame. A delta that does not fit (a gap of more than a minute, or the clock going back)
+    is sent as a full timestamp.
+
+    Returns:
+    bytearray: the payload, or None if a frame does not have the report header and tail in place.
+    '''
+    buffer = store.buffer
+    base_timestamp = store.timestamp(sequence) if n_frames else serialization_timestamp
+    deltas = bytearray(2 * n_frames)
+    escaped_timestamps = []
+    runs = []   # alternating run lengths of non-empty and empty frames, starting with non-empty
+    targets = bytearray()
+    # deltas are taken from the timestamp the client will reconstruct, so rounding errors do not add up
+    previous_timestamp = base_timestamp
+    run_is_empty = False
+    run_length = 0
+    for i in range(n_frames):
+        offset = store.offset(sequence + i)
+        timestamp = struct.unpack_from('<d', buffer, offset)[0]
+        # the frame follows its 8-byte timestamp, checked in place
+        if (buffer[offset + 8] != 0xAA or buffer[offset + 9] != 0xFF or buffer[offset + 10] != 0x03
+                or buffer[offset + 11] != 0x00 or buffer[offset + 36] != 0x55 or buffer[offset + 37] != 0xCC):
+            return None
+        delta = int(round((timestamp - previous_timestamp) * 1000))
+        if 0 <= delta < COMPACT_DELTA_ESCAPE:
+            previous_timestamp += delta / 1000
+        else:
+            delta = COMPACT_DELTA_ESCAPE
+            escaped_timestamps.append(timestamp)
+            previous_timestamp = timestamp
+        struct.pack_into('<H', deltas, 2 * i, delta)
+        target_bytes = store.view[offset + 12:offset + 36]
+        is_empty = bytes(target_bytes) == EMPTY_TARGETS
+        if is_empty != run_is_empty:
+            runs.append(run_length)
+            run_is_empty = is_empty
+            run_length = 0
+        run_length += 1
+        if not is_empty:
+            targets.extend(target_bytes)
+    runs.append(run_length)
+
+    serialized_data = bytearray(struct.pack(COMPACT_HEADER_FORMAT, base_timestamp, serialization_timestamp,
+                                            len(runs), len(escaped_timestamps)))
+    for timestamp in escaped_timestamps:
+        serialized_data.extend(struct.pack('<d', timestamp))
+    serialized_data.extend(deltas)
+    for run_length in runs:
+        serialized_data.extend(struct.pack('<H', run_length))
+    serialized_data.extend(targets)
+    return serialized_data
+
+
+def pack_stats_payload(counters, bucket_bounds_ms, histogram):
+    '''
+    Packs a 'stats' response payload, see STATS_FORMAT.
+
+    Args:
+    counters (list): the STATS_FORMAT counters, in order, wrapped around to their sizes.
+    bucket_bounds_ms (tuple): the upper bounds of the main loop time histogram's buckets.
+    histogram (list): the iterations per bucket, one more than there are bounds.
+    '''
+    n_buckets = len(bucket_bounds_ms)
+    histogram = [n_buckets] + list(bucket_bounds_ms) + [count & 0xFFFFFFFF for count in histogram]
+    return struct.pack(STATS_FORMAT, *counters) + struct.pack('<B' + 'H' * n_buckets + 'I' * (n_buckets + 1), *histogram)
@@ -0,0 +1,85 @@
+import struct
+
+FRAME_SIZE = 30     # an LD2450 report frame
+WIRE_FRAME_SIZE = 38    # a frame in a legacy 'get' payload: its timestamp (d) and the frame (30s)
+TIMESTAMP_FORMAT = '<d'
+
+
+class FrameStore():
+    '''
+    A fixed-size ring of timestamped frames, allocated once and stored in the legacy 'get' payload layout
+    ('d30s', 38 bytes each), so that a 'get' response is sent straight out of the ring without copying.
+    When the ring is full, a new frame overwrites the oldest one.
+
+    Frames are addressed by their sequence number: the number of frames stored before them since startup. Sequence
+    numbers never go back, whatever is discarded, and the frame with sequence number s is always in slot s % capacity,
+    so that a reader only needs (first_sequence(), next_sequence()) to find its frames.
+
+    The reserved oldest slots are never shown to readers: frames can be appended while a reader still uses the views
+    it got, without overwriting them, as long as fewer than reserved frames are appended meanwhile. This lets another
+    thread append while the event loop sends (see WifiSensorServer's acquisition thread).
+    '''
+    def __init__(self, capacity, reserved=0):
+        self.capacity = capacity
+        self.reserved = reserved
+        self.buffer = bytearray(capacity * WIRE_FRAME_SIZE)
+        self.view = memoryview(self.buffer)
+        self.count = 0  # frames held, reserved ones included
+        # counters
+        self.written = 0    # frames appended since startup
+        self.evicted = 0    # frames pushed out of the ring by newer ones, whether clients read them or not
+
+    def __len__(self):
+        # the number of frames readers can see
+        return min(self.count, self.capacity - self.reserved)
+
+    def append(self, timestamp, frame):
+        # copies the frame into the slot of its sequence number
+        if len(self) == self.capacity - self.reserved:
+            # the oldest frame readers can see goes
+            self.evicted += 1
+        self.count = min(self.count + 1, self.capacity)
+        offset = self.offset(self.written)
+        struct.pack_into(TIMESTAMP_FORMAT, self.buffer, offset, timestamp)
+        n_bytes = min(len(frame), FRAME_SIZE)
+        self.buffer[offset + 8:offset + 8 + n_bytes] = frame[:n_bytes]
+        if n_bytes < FRAME_SIZE:
+            # as struct's '30s', pad short frames with zeros
+            for i in range(offset + 8 + n_bytes, offset + WIRE_FRAME_SIZE):
+                self.buffer[i] = 0
+        self.written += 1
+
+    def first_sequence(self):
+        # the sequence number of the oldest frame readers can see, or of the next frame if there is none
+        return self.written - len(self)
+
+    def next_sequence(self):
+        # the sequence number the next frame will get
+        return self.written
+
+    def offset(self, sequence):
+        # the byte offset in buffer of the frame with the given sequence number, its timestamp first
+        return (sequence % self.capacity) * WIRE_FRAME_SIZE
+
+    def timestamp(self, sequence):
+        return struct.unpack_from(TIMESTAMP_FORMAT, self.buffer, self.offset(sequence))[0]
+
+    def wire_slices(self, sequence, n_frames):
+        '''
+        Returns the n_frames frames from sequence number sequence on in the wire layout, as one memoryview of the ring,
+        or two if they wrap around its end. The views stay valid until reserved more frames are appended.
+        '''
+        if n_frames <= 0:
+            return []
+        start = self.offset(sequence)
+        end = start + n_frames * WIRE_FRAME_SIZE
+        if end <= len(self.buffer):
+            return [self.view[start:end]]
+        return [self.view[start:], self.view[:end - len(self.buffer)]]
+
+    def discard(self, n_frames):
+        # removes the n_frames oldest frames readers can see. Their sequence numbers are not reused
+        self.count = len(self) - min(n_frames, len(self))
+
+    def clear(self):
+        self.discard(len(self))
@@ -1,9 +1,15 @@
 
-from machine import UART  # type: ignore
+try:
+    from machine import UART  # type: ignore
+except ImportError:
+    # CPython: pass a UART-like object to HLKLD2450Radar, see _host_sim/fakes.py
+    UART = None
 import time
 
 REPORT_HEADER = bytes.fromhex('AAFF0300')
 REPORT_TAIL = bytes.fromhex('55CC')
+FRAME_SIZE = 30
+UART_READ_BUFFER_SIZE = 1024   # a few frames more than the UART driver's receive buffer
 
 def timestamp_float():
     # time since epoch in seconds with microsecond precision, equivalent to CPython's time.time()
@@ -15,46 +21,151 @@ def timestamp_float():
 #     seconds = seconds + 946684800.0  # correction from ESP32 epoch to Unix epoch
     return seconds
 
+class UARTFrameReader():
+    '''
+    Reads report frames from a UART in bulk: every available byte goes into a preallocated buffer with a single
+    readinto() call, and complete frames are cut out of it. Bytes that are not part of a frame (line noise, a frame
+    cut short) are skipped until the next report header, so the reader resynchronizes by itself.
+
+    The buffer is linear rather than circular: leftover bytes of a partial frame are moved to its start when it
+    fills up, so that a frame is always contiguous in it.
+    '''
+    def __init__(self, uart, buffer_size=UART_READ_BUFFER_SIZE):
+        self.uart = uart
+        self.buffer = bytearray(buffer_size)
+        self.view = memoryview(self.buffer)
+        self.start = 0  # first byte not parsed yet
+        self.end = 0    # end of the bytes read
+        # counters, see get_stats()
+        self.frames = 0
+        self.skipped_bytes = 0
+        self.resyncs = 0
+        self.read_calls = 0
+        self.bytes_read = 0
+
+    def fill(self):
+        # moves the bytes available in the UART into the buffer, returns the number of bytes moved
+        n_available = self.uart.any()
+        if n_available == 0:
+            return 0
+        if self.end + n_available > len(self.buffer) and self.start > 0:
+            # make room: move the unparsed bytes to the start of the buffer
+            n_unparsed = self.end - self.start
+            self.buffer[:n_unparsed] = self.view[self.start:self.end]
+            self.start = 0
+            self.end = n_unparsed
+        n_to_read = min(n_available, len(self.buffer) - self.end)
+        if n_to_read == 0:
+            return 0
+        n_read = self.uart.readinto(self.view[self.end:self.end + n_to_read], n_to_read)
+        if not n_read:
+            return 0
+        self.read_calls += 1
+        self.bytes_read += n_read
+        self.end += n_read
+        return n_read
+
+    def _is_frame_at(self, i):
+        # compares the header and tail bytes in place, without slicing
+        b = self.buffer
+        return (b[i] == 0xAA and b[i + 1] == 0xFF and b[i + 2] == 0x03 and b[i + 3] == 0x00
+                and b[i + 28] == 0x55 and b[i + 29] == 0xCC)
+
+    def parse_frames(self, max_frames=None):
+        '''
+        Cuts the complete frames out of the bytes read so far.
+
+        Returns:
+        list: the frames, as bytes, oldest first
+        '''
+        frames = []
+        while self.end - self.start >= FRAME_SIZE and (max_frames is None or len(frames) < max_frames):
+            if self._is_frame_at(self.start):
+                frames.append(bytes(self.view[self.start:self.start + FRAME_SIZE]))
+                self.start += FRAME_SIZE
+                continue
+            # out of sync: skip to the next report header after this byte
+            self.resyncs += 1
+            header_index = bytes(self.view[self.start + 1:self.end]).find(REPORT_HEADER)
+            if header_index < 0:
+                # keep the last bytes, they may be the beginning of a header
+                skip = self.end - self.start - (len(REPORT_HEADER) - 1)
+            else:
+                skip = header_index + 1
+            self.skipped_bytes += skip
+            self.start += skip
+        if self.start == self.end:
+            self.start = 0
+            self.end = 0
+        self.frames += len(frames)
+        return frames
+
+    def read_frames(self, max_frames=None):
+        '''
+        Reads the bytes available in the UART, without waiting for more, and returns the complete frames.
+        Bytes of frames beyond max_frames stay buffered for the next call.
+        '''
+        frames = self.parse_frames(max_frames)
+        while max_frames is None or len(frames) < max_frames:
+            if not self.fill():
+                break
+            frames.extend(self.parse_frames(None if max_frames is None else max_frames - len(frames)))
+        return frames
+
+    def get_stats(self):
+        return {
+            'frames': self.frames,
+            'skipped_bytes': self.skipped_bytes,
+            'resyncs': self.resyncs,
+            'read_calls': self.read_calls,
+            'bytes_read': self.bytes_read,
+        }
+
+
 class HLKLD2450Radar():
-    def __init__(self, uart_rx_pin, uart_tx_pin):
+    def __init__(self, uart_rx_pin, uart_tx_pin, uart=None):
         '''
         Initialize the radar sensor with the given UART pins.
 
         Args:
         uart_rx_pin: int, the RX pin for the UART
         uart_tx_pin: int, the TX pin for the UART
+        uart: an already initialized UART-like object to use instead, e.g. a fake UART on a host
         '''
         self.uart_rx_pin = uart_rx_pin
         self.uart_tx_pin = uart_tx_pin
-        self.uart = UART(2, tx=self.uart_tx_pin, rx=self.uart_rx_pin)
-        self.uart.init(256000, bits=8, parity=None, stop=1)
-
-    def _read_until(self, terminator):
-        buffer = bytearray()
-        while True:
-            byte = self.uart.read(1)
-            if not byte:
-                break # Timeout or end of data
-            buffer.extend(byte)
-            if buffer.endswith(terminator):
-                break
-        return bytes(buffer)
+        if uart is None:
+            uart = UART(2, tx=self.uart_tx_pin, rx=self.uart_rx_pin)
+            uart.init(256000, bits=8, parity=None, stop=1)
+        self.uart = uart
+        self.frame_reader = UARTFrameReader(self.uart)
 
     def read_single_radar_data(self, timeout_ms=1000):
         '''
-        Reads without parsing a single 'row' of radar data.
+        Reads without parsing a single 'row' of radar data, waiting for it at most timeout_ms.
 
         Returns:
         radar_data: bytes, the radar data read
         '''
         # Calculate deadline for operation
         deadline = time.ticks_add(time.ticks_ms(), timeout_ms)
-        while self.uart.any() == 0:
+        while True:
+            frames = self.frame_reader.read_frames(max_frames=1)
+            if frames:
+                return frames[0]
             if time.ticks_diff(deadline, time.ticks_ms()) < 0:
                 print('uard read timed out')
                 return None
-        serial_port_line = self._read_until(REPORT_TAIL)
-        return serial_port_line
+            time.sleep_ms(1)
+
+    def read_available_sensor_data(self):
+        '''
+        Reads the frames already received by the UART, without waiting for more. Used by the server's event loop.
+
+        Returns:
+        list: the valid frames read, oldest first
+        '''
+        return self.frame_reader.read_frames()
 
     def read_single_sensor_data(self):
         single_data_row = self.read_single_radar_data()
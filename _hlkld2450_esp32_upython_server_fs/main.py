@@ -4,12 +4,14 @@ except ImportError:
     from server_hostname_cfg import server_hostname
 
 
-from upython_sensor_server import WifiRadarServer
+from upython_sensor_server import WifiRadarServer, LOG_WARNING
 wrs = WifiRadarServer(
     hostname=server_hostname,
     port=1704,
-    poll_wait_time=0,
+    poll_wait_time=0.05,  # seconds the event loop waits for the radar or a client before its housekeeping
     queue_size=340,  # about 30 seconds of buffer
+    acquisition_thread=False,  # True to read the radar in its own thread, see WifiSensorServer.run_acquisition_loop()
+    log_level=LOG_WARNING,  # LOG_DEBUG prints every request and frame, which slows the server down
     uart_rx_pin=16,
     uart_tx_pin=17
 )
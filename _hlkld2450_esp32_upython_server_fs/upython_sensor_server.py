@@ -1,10 +1,62 @@
-import usocket as socket  # type: ignore
+try:
+    import usocket as socket  # type: ignore
+    import uselect as select  # type: ignore
+    import uerrno as errno  # type: ignore
+except ImportError:
+    # CPython, for running the server on a host with fake network, machine and wifi_utils modules
+    import socket, select, errno
+try:
+    import _thread
+except ImportError:
+    # a port without threads: only the single loop acquisition mode
+    _thread = None
 import network  # type: ignore
 from wifi_utils import wifi_login_at_startup as wlas
 import time
 import machine  # type: ignore
-import collections
 import struct
+import sys
+import os
+import gc
+from frame_store import FrameStore
+# the wire protocol, shared with the client's simulated servers. The harnesses in _host_sim use its constants through this module
+from frame_protocol import (PROTOCOL_MAGIC, PROTOCOL_VERSION, HEADER_FORMAT, HEADER_SIZE, MSG_HELLO, MSG_GET,
+                            MSG_ERROR, FLAG_COMPACT, REQUEST_HELLO, REQUEST_ERROR, REQUEST_GET, REQUEST_GET_SINCE,
+                            REQUEST_COMMAND, ClientCursor, parse_get_since_request, unpack_request_header, parse_framed_request,
+                            negotiate_hello, pack_response_header, client_read_start, since_read_start,
+                            since_response_prefix, encode_frames, pack_stats_payload)
+
+LOOP_TIME_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200)
+
+PERSISTENT_IDLE_TIMEOUT_MS = 10000  # close a persistent connection after this long without requests
+
+# event loop, see start_server()
+MAX_CONNECTIONS = 4     # default max_connections: connections beyond this are closed as soon as they are accepted
+MAX_ADDRESS_CURSORS = 8     # read positions kept for close-delimited clients, see ClientCursor
+# default max_detached_bytes: at most this many bytes of responses copied out of the frame store for slow clients,
+# all connections together, see flush_connection()
+MAX_DETACHED_BYTES = 16384
+
+# acquisition thread, see run_acquisition_loop()
+ACQUISITION_RESERVED_FRAMES = 16    # frame store slots hidden from readers, so that the thread never overwrites frames being sent
+ACQUISITION_IDLE_SLEEP_MS = 2   # the thread's sleep when the sensor has nothing to read
+JITTER_SMOOTHING = 16   # the RFC 3550 interarrival jitter estimator's gain is 1 / JITTER_SMOOTHING
+
+# log levels, see WifiSensorServer(log_level=...). A message above the level is neither formatted nor printed, printing
+# over the REPL UART on every frame or request would slow the event loop down
+LOG_NONE = 0
+LOG_WARNING = 1     # clients refused or dropped, failed sends
+LOG_INFO = 2    # connections opened and closed
+LOG_DEBUG = 3   # every request and every frame read
+
+REQUEST_TIMEOUT_MS = 3000   # close a connection that sent nothing for this long after connecting, or that does not take its response
+WIFI_CHECK_INTERVAL_MS = 1000
+DEFAULT_POLL_WAIT_TIME = 0.05   # seconds, used for a poll_wait_time of 0 or less: poll(0) returns at once and the loop would spin
+RECEIVE_SIZE = 1024
+TCP_NODELAY = getattr(socket, 'TCP_NODELAY', None)    # not exposed by every MicroPython port
+# CPython's poll() reports file descriptors, MicroPython's reports the registered objects
+POLL_REPORTS_FILENO = sys.implementation.name != 'micropython'
+MEM_FREE = getattr(gc, 'mem_free', None)    # MicroPython only
 
 def timestamp_float():
     # time since epoch in seconds with microsecond precision, equivalent to CPython's time.time()
@@ -16,12 +68,106 @@ def timestamp_float():
 #     seconds = seconds + 946684800.0  # correction from ESP32 epoch to Unix epoch
     return seconds
 
+def new_boot_id():
+    # a random non-zero id, so that clients can tell that the server restarted and its sequence numbers started over
+    return struct.unpack('<I', os.urandom(4))[0] or 1
+
+def poll_key(stream):
+    # the key under which poll() reports events for stream
+    return stream.fileno() if POLL_REPORTS_FILENO else stream
+
+
+class NullLock():
+    # stands for the frame store lock when a single loop does everything
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+class AcquisitionStats():
+    # timing of the sensor reads, measured the same way in both acquisition modes, see get_acquisition_stats()
+    def __init__(self):
+        self.polls = 0
+        self.frames = 0
+        self.last_poll_time = None
+        self.max_poll_gap_ms = 0    # the longest time between two reads of the sensor
+        self.last_frame_timestamp = None
+        self.last_frame_interval = None
+        self.max_frame_interval_ms = 0.0
+        self.jitter_ms = 0.0    # how much the time between frame timestamps varies, smoothed as RFC 3550's interarrival jitter
+
+    def record_poll(self, now):
+        if self.last_poll_time is not None:
+            self.max_poll_gap_ms = max(self.max_poll_gap_ms, time.ticks_diff(now, self.last_poll_time))
+        self.last_poll_time = now
+        self.polls += 1
+
+    def record_frame(self, timestamp):
+        if self.last_frame_timestamp is not None:
+            interval = (timestamp - self.last_frame_timestamp) * 1000
+            self.max_frame_interval_ms = max(self.max_frame_interval_ms, interval)
+            if self.last_frame_interval is not None:
+                self.jitter_ms += (abs(interval - self.last_frame_interval) - self.jitter_ms) / JITTER_SMOOTHING
+            self.last_frame_interval = interval
+        self.last_frame_timestamp = timestamp
+        self.frames += 1
+
+class ClientConnection():
+    # the state of one client connection in the server's event loop
+    def __init__(self, client_socket, address, now):
+        self.socket = client_socket
+        self.address = address  # the client's IP address
+        self.cursor = None  # set when the protocol is known, see serve_connection()
+        self.detached_bytes = 0     # bytes of output copied out of the frame store
+        self.framed = None  # None until the first bytes arrive, then True for the framed protocol, False for the legacy one
+        self.receiving = True   # False once a legacy request was received: the connection closes after the response
+        self.input_buffer = b''
+        self.output_chunks = []     # memoryviews still to be sent, oldest first
+        self.output_borrowed = False    # True while output_chunks may point into the frame store, see flush_connection()
+        self.after_send = []    # request strings to call after_response() for once the output is sent
+        self.close_after_send = False
+        self.flags = 0  # negotiated in HELLO
+        self.last_activity_time = now
+
 class WifiSensorServer():
-    def __init__(self, hostname='ESP32_server', port=1704, poll_wait_time=0.05, queue_size=100, **sensor_addr_args):
+    def __init__(self, hostname='ESP32_server', port=1704, poll_wait_time=DEFAULT_POLL_WAIT_TIME, queue_size=100, max_connections=MAX_CONNECTIONS,
+                 max_detached_bytes=MAX_DETACHED_BYTES, acquisition_thread=False, log_level=LOG_WARNING, **sensor_addr_args):
+        self.log_level = log_level
+        self.wifi_reconnects = 0
         self.sensor_setup(**sensor_addr_args)
         self.server_setup(hostname, port, poll_wait_time)
-        # initialize empty queue
-        self.data_queue = collections.deque((), queue_size)   # TODO: move this functionality to the sensor object
+        # acquisition mode: the event loop reads the sensor between network events, or a thread reads it on its own
+        # schedule (see run_acquisition_loop()), appending to the frame store under frame_store_lock
+        self.acquisition_thread = acquisition_thread and _thread is not None
+        self.acquisition_running = False
+        self.acquisition_stats = AcquisitionStats()
+        self.frame_store_lock = _thread.allocate_lock() if self.acquisition_thread else NullLock()
+        # frames waiting for a 'get', in a ring allocated once
+        self.frame_store = FrameStore(queue_size, ACQUISITION_RESERVED_FRAMES if self.acquisition_thread else 0)   # TODO: move this functionality to the sensor object
+        # sequence numbers of the frame store start over at every boot
+        self.boot_id = new_boot_id()
+        # event loop state, see start_server()
+        self.poller = None
+        self.connections = {}   # poll key -> ClientConnection
+        self.last_wifi_check_time = 0
+        # several clients read the same frames, each from its own ClientCursor. Their number, and the memory a slow
+        # client can hold, are bounded: memory use does not depend on how many clients try to connect
+        self.max_connections = max_connections
+        self.address_cursors = {}   # IP address -> ClientCursor of close-delimited clients, which reconnect for every request
+        self.max_detached_bytes = max_detached_bytes
+        self.detached_bytes = 0
+        self.refused_connections = 0
+        self.slow_clients_dropped = 0
+        # telemetry counters, see pack_stats()
+        self.start_time = time.ticks_ms()
+        self.poll_timeouts = 0
+        self.frames_missed = 0  # frames evicted from the frame store before a client that wanted them read them
+        self.connections_accepted = 0
+        self.connections_timed_out = 0
+        self.bytes_sent = 0
+        self.loop_time_histogram = [0] * (len(LOOP_TIME_BUCKETS_MS) + 1)
+        self.max_loop_time_ms = 0
         
     def server_setup(self, hostname, port, poll_wait_time):
         # set up network connection
@@ -41,9 +187,15 @@ class WifiSensorServer():
         self.hostname = hostname
 
         # set up server socket
+        if poll_wait_time <= 0:
+            # the event loop waits on the sensor and the sockets, it must block for a while
+            print(f'poll_wait_time must be positive, using {DEFAULT_POLL_WAIT_TIME}')
+            poll_wait_time = DEFAULT_POLL_WAIT_TIME
         self.poll_wait_time = poll_wait_time
         self.addr = socket.getaddrinfo(self.server_ip, self.server_port)[0][-1]
         self.server_socket = socket.socket()
+        # rebinding right after a restart must not fail on the previous socket's lingering connections
+        self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.server_socket.bind(self.addr)
         self.server_socket.setblocking(True)
         self.server_socket.settimeout(self.poll_wait_time)
@@ -61,6 +213,7 @@ class WifiSensorServer():
     def reconnect(self):
         # waits for wifi connection, if not connected, restarts machine
         print('wifi not connected, checking again and trying to reconnect')
+        self.wifi_reconnects += 1
         # wait and check for wifi connection 5 times with wait time of 1 second
         for i in range(5):
             if self.wlan.isconnected():
@@ -71,158 +224,544 @@ class WifiSensorServer():
         # restart machine to rescan wireless networks and reconnect
         machine.reset()
 
-    def convert_queue_to_bytes(self):
-        # data_queue_bytes = b''
-        # while self.data_queue:
-        #     temp_data = self.data_queue.popleft()
-        #     # print(f'popped {repr(temp_data)}, queue length: {len(self.data_queue)}')
-        #     data_queue_bytes += temp_data
-
-        # Define the format string for a single tuple (timestamp, data)
-        # 'd' for double (float) and '30s' for 30-byte bytes
-        tuple_format = 'd30s'
-
-        # Define the format string for the entire deque + the final timestamp
-        # Assuming we have n elements in the deque
-        def get_format_string(n):
-            return f'{tuple_format * n}d'
-
-        # # Example deque of tuples
-        # data_deque = deque([
-        #     (1627889187.123, b'abcdefghijklmnopqrstuvwxyz1234'),
-        #     (1627889190.456, b'abcdefghijklmnopqrstuvwxyz5678')
-        # ])
-
-        # Serialize the deque
-        serialized_data = bytearray()
-
-        # Add each (timestamp, data) tuple to the serialized data
-        while self.data_queue:
-            timestamp, data = self.data_queue.popleft()
-            serialized_data.extend(struct.pack(tuple_format, timestamp, data))
-
-        # Add the final serialization timestamp
-        serialization_timestamp = timestamp_float()
-        # convert this timestamp to bytes
-        # float_bytes = struct.pack('f', my_float)
-        # serialization_timestamp_bytes = struct.pack('d', serialization_timestamp)
-        serialized_data.extend(struct.pack('d', serialization_timestamp))
-
-        # # Print the serialized binary data
-        # print(serialized_data)
-
-        # # Example of deserializing the data back
-        # # First, calculate the number of tuples
-        # n = len(data_deque)
-
-        # # Get the format string for deserialization
-        # format_string = get_format_string(n)
+    def convert_queue_to_bytes(self, compact=False):
+        # empties the frame store into a 'get' payload, see pop_get_payload()
+        chunks, flags, n_frames = self.pop_get_payload(compact)
+        return b''.join(chunks)
 
-        # # Deserialize the data
-        # deserialized_data = struct.unpack(format_string, serialized_data)
+    def pop_get_payload(self, compact=False):
+        '''
+        Takes every frame out of the frame store for a 'get' response, in the compact encoding if requested and possible.
 
-        # # Extract the tuples and the final timestamp
-        # deserialized_tuples = [
-        #     (deserialized_data[i*2], deserialized_data[i*2 + 1])
-        #     for i in range(n)
-        # ]
-        # final_timestamp = deserialized_data[-1]
+        Returns:
+        list: the payload chunks. A legacy 'd30s' payload is not copied: it is one or two memoryviews of the frame store,
+              then the final serialization timestamp. The views stay valid until the frame store's
+              reserved count of frames is stored (see FrameStore), until the next frame without an acquisition thread.
+        int: FLAG_COMPACT if the payload is in the compact encoding, 0 if it is in the legacy encoding.
+        int: the number of frames.
+        '''
+        with self.frame_store_lock:
+            sequence = self.frame_store.first_sequence()
+            n_frames = len(self.frame_store)
+            self.frame_store.discard(n_frames)
+        # the discarded frames stay in place until overwritten
+        chunks, flags = self.get_payload(sequence, n_frames, compact)
+        return chunks, flags, n_frames
+
+    def get_client_payload(self, cursor, compact=False):
+        '''
+        Returns the frames after a client's cursor for a 'get' response, and moves the cursor past them. The frames stay
+        in the frame store for the other clients. See pop_get_payload() for the return values.
+        '''
+        # only the sequence numbers are read under the lock, the frames are read and sent outside it
+        with self.frame_store_lock:
+            first_sequence = self.frame_store.first_sequence()
+            next_sequence = self.frame_store.next_sequence()
+        sequence, n_missed = client_read_start(cursor, first_sequence, next_sequence)
+        self.frames_missed += n_missed
+        n_frames = next_sequence - sequence
+        chunks, flags = self.get_payload(sequence, n_frames, compact)
+        return chunks, flags, n_frames
+
+    def get_address_cursor(self, address):
+        # the cursor of a close-delimited client, created if needed. The least recently seen cursor makes room when all are in use
+        now = time.ticks_ms()
+        cursor = self.address_cursors.get(address)
+        if cursor is None:
+            if len(self.address_cursors) >= MAX_ADDRESS_CURSORS:
+                oldest_address = None
+                for other_address, other_cursor in self.address_cursors.items():
+                    if oldest_address is None or time.ticks_diff(other_cursor.last_seen_time, self.address_cursors[oldest_address].last_seen_time) < 0:
+                        oldest_address = other_address
+                del self.address_cursors[oldest_address]
+            cursor = ClientCursor(now)
+            self.address_cursors[address] = cursor
+        cursor.last_seen_time = now
+        return cursor
+
+    def get_since_payload(self, boot_id, sequence, compact=False):
+        '''
+        Returns, without removing them, the frames from sequence number sequence on for a 'get since' response,
+        see frame_protocol.since_read_start() for where it starts.
 
-        # print(deserialized_tuples)
-        # print(final_timestamp)
-        return serialized_data
+        Returns:
+        list: the payload chunks, the SINCE_RESPONSE_FORMAT prefix first, then the chunks of get_payload().
+        int: the flags, as in get_payload().
+        int: the number of frames.
+        '''
+        with self.frame_store_lock:
+            first_sequence = self.frame_store.first_sequence()
+            next_sequence = self.frame_store.next_sequence()
+        sequence, n_missed = since_read_start(boot_id, sequence, self.boot_id, first_sequence, next_sequence)
+        self.frames_missed += n_missed
+        n_frames = next_sequence - sequence
+        chunks, flags = self.get_payload(sequence, n_frames, compact)
+        chunks.insert(0, since_response_prefix(self.boot_id, sequence, next_sequence))
+        return chunks, flags, n_frames
+
+    def get_payload(self, sequence, n_frames, compact=False):
+        '''
+        Serializes n_frames frames of the frame store from sequence number sequence on, in the compact encoding if
+        requested and possible.
 
+        Returns:
+        list: the payload chunks, see pop_get_payload().
+        int: FLAG_COMPACT if the payload is in the compact encoding, 0 if it is in the legacy encoding.
+        '''
+        return encode_frames(self.frame_store, sequence, n_frames, timestamp_float(), compact)
 
     def start_server(self):
-
-        # start server listening on the port
-        self.server_socket.listen(1)    # only one connection at a time
+        '''
+        Runs the server's event loop forever. Reading the sensor, accepting connections, receiving requests and sending
+        responses never wait for each other: sockets are non-blocking and a single select.poll() waits for any of them,
+        and for the sensor's stream if it has one (see get_sensor_stream()), for at most poll_wait_time.
+        '''
+        self.setup_event_loop()
         print('Server is started, listening on port', self.server_port)
         print('moving on to main loop')
-        # main loop: read sensor data, check wifi connection, and process client requests (or time out and continue, if no client request)
         while True:
-
-            # read sensor into queue
-            # single_data_row = self.read_single_sensor_data()
-            single_data_row = self.sensor.read_single_sensor_data()
-            if single_data_row is None:
-                print('sensor read failed')
-                continue
-            else:
-                self.data_queue.append((timestamp_float(), single_data_row))
-                print(f'queue length: {len(self.data_queue)}')
-
-            
-            # verify wifi connection
+            self.run_event_loop_once()
+
+    def setup_event_loop(self):
+        self.server_socket.listen(self.max_connections)
+        self.server_socket.setblocking(False)
+        self.poller = select.poll()
+        self.poller.register(self.server_socket, select.POLLIN)
+        if self.acquisition_thread:
+            self.start_acquisition_thread()
+        else:
+            sensor_stream = self.get_sensor_stream()
+            if sensor_stream is not None:
+                # wake up as soon as sensor data arrives. The data itself is read in ingest_sensor_data()
+                self.poller.register(sensor_stream, select.POLLIN)
+        self.last_wifi_check_time = time.ticks_ms()
+
+    def run_event_loop_once(self, timeout_ms=None):
+        # a single event loop iteration: wait for events, serve sockets, read the sensor, housekeeping
+        if timeout_ms is None:
+            timeout_ms = int(self.poll_wait_time * 1000)
+        server_key = poll_key(self.server_socket)
+        events = self.poller.poll(timeout_ms)
+        # the iteration is timed from here, the wait for events is not part of it
+        loop_start_time = time.ticks_us()
+        if not events and timeout_ms > 0:
+            # a timeout only if the poll waited for events
+            self.poll_timeouts += 1
+        for event in events:
+            key, event_mask = event[0], event[1]
+            if key == server_key:
+                self.accept_connections()
+            elif key in self.connections:
+                self.serve_connection(self.connections[key], event_mask)
+        if not self.acquisition_thread:
+            self.ingest_sensor_data()
+
+        now = time.ticks_ms()
+        # verify wifi connection
+        if time.ticks_diff(now, self.last_wifi_check_time) >= WIFI_CHECK_INTERVAL_MS:
+            self.last_wifi_check_time = now
             if not self.wlan.isconnected():
                 self.reconnect()
-            
-            # see if there's an incoming connection from a client
+        self.close_idle_connections(now)
+        self.record_loop_time(time.ticks_diff(time.ticks_us(), loop_start_time))
+
+    def record_loop_time(self, loop_time_us):
+        # counts an event loop iteration in the main loop time histogram
+        self.max_loop_time_ms = max(self.max_loop_time_ms, loop_time_us // 1000)
+        bucket = 0
+        for bound in LOOP_TIME_BUCKETS_MS:
+            if loop_time_us < bound * 1000:
+                break
+            bucket += 1
+        self.loop_time_histogram[bucket] += 1
+
+    def pack_stats(self):
+        '''
+        Packs the telemetry counters into a 'stats' response payload, see STATS_FORMAT.
+        Counters wrap around at 2**32 (bytes sent at 2**64, wifi reconnects at 2**16).
+        '''
+        sensor_stats = self.get_sensor_stats()
+        counters = [
+            self.boot_id,
+            time.ticks_diff(time.ticks_ms(), self.start_time),
+            self.acquisition_stats.frames,
+            sensor_stats.get('resyncs', 0),
+            sensor_stats.get('skipped_bytes', 0),
+            self.frames_missed,
+            self.poll_timeouts,
+            self.connections_accepted,
+            self.refused_connections,
+            self.connections_timed_out,
+            self.slow_clients_dropped,
+        ]
+        counters = [counter & 0xFFFFFFFF for counter in counters]
+        counters.append(self.bytes_sent & 0xFFFFFFFFFFFFFFFF)
+        counters.append(self.wifi_reconnects & 0xFFFF)
+        counters.append(MEM_FREE() if MEM_FREE is not None else 0)
+        counters.append(self.max_loop_time_ms & 0xFFFFFFFF)
+        return pack_stats_payload(counters, LOOP_TIME_BUCKETS_MS, self.loop_time_histogram)
+
+    def ingest_sensor_data(self):
+        # moves every row the sensor has ready into the queue, without waiting for more. Returns the number of rows
+        self.acquisition_stats.record_poll(time.ticks_ms())
+        rows = self.read_available_sensor_data()
+        if not rows:
+            return 0
+        # the rows are timestamped outside the lock, which is only held for the copies into the frame store
+        timestamps = []
+        for single_data_row in rows:
+            timestamp = timestamp_float()
+            self.acquisition_stats.record_frame(timestamp)
+            timestamps.append(timestamp)
+        with self.frame_store_lock:
+            for timestamp, single_data_row in zip(timestamps, rows):
+                self.frame_store.append(timestamp, single_data_row)
+        if self.log_level >= LOG_DEBUG:
+            print(f'queue length: {len(self.frame_store)}')
+        return len(rows)
+
+    def start_acquisition_thread(self):
+        self.acquisition_running = True
+        _thread.start_new_thread(self.run_acquisition_loop, ())
+
+    def stop_acquisition_thread(self):
+        # the thread ends after its current read
+        self.acquisition_running = False
+
+    def run_acquisition_loop(self):
+        '''
+        The acquisition thread: reads the sensor on its own schedule, so that a slow send in the event loop does not delay
+        it, and hands the rows over to the event loop through the frame store. The event loop then only does networking.
+        '''
+        while self.acquisition_running:
+            if not self.ingest_sensor_data():
+                time.sleep_ms(ACQUISITION_IDLE_SLEEP_MS)
+
+    def get_acquisition_stats(self):
+        '''
+        Returns the acquisition counters, to compare the single loop and the acquisition thread modes: polls, frames,
+        max_poll_gap_ms (the longest time the sensor was not read), max_frame_interval_ms and jitter_ms (of the frame
+        timestamps), frames_missed (frames evicted from the frame store before a client that wanted them read them),
+        evicted (every frame pushed out of the frame store, read or not) and sensor (the sensor's own counters, see
+        get_sensor_stats()).
+        '''
+        stats = self.acquisition_stats
+        return {
+            'acquisition_thread': self.acquisition_thread,
+            'polls': stats.polls,
+            'frames': stats.frames,
+            'max_poll_gap_ms': stats.max_poll_gap_ms,
+            'max_frame_interval_ms': stats.max_frame_interval_ms,
+            'jitter_ms': stats.jitter_ms,
+            'frames_missed': self.frames_missed,
+            'evicted': self.frame_store.evicted,
+            'sensor': self.get_sensor_stats(),
+        }
+
+    def accept_connections(self):
+        while True:
             try:
                 client_socket, client_address = self.server_socket.accept()
-            except Exception:
-                # if timed out, just continue: there is no client request
-                print('timed out, no client request')
+            except OSError:
+                # no more pending connections
+                return
+            if len(self.connections) >= self.max_connections:
+                if self.log_level >= LOG_WARNING:
+                    print('too many connections, refusing', client_address)
+                self.refused_connections += 1
+                client_socket.close()
                 continue
-
-            # if not timed out, process the client request
-            print("Accepted connection from", client_address)
-            input_data = client_socket.recv(1024)
-            if not input_data:
-                # print('got None input')
-                input_data = ''
+            if self.log_level >= LOG_INFO:
+                print("Accepted connection from", client_address)
+            self.connections_accepted += 1
+            client_socket.setblocking(False)
+            if TCP_NODELAY is not None:
+                # a response is sent as a header and a payload, Nagle's algorithm would hold the payload back for an ACK
+                client_socket.setsockopt(socket.IPPROTO_TCP, TCP_NODELAY, 1)
+            self.connections[poll_key(client_socket)] = ClientConnection(client_socket, client_address[0], time.ticks_ms())
+            self.poller.register(client_socket, select.POLLIN)
+
+    def serve_connection(self, connection, event_mask):
+        if event_mask & (select.POLLHUP | select.POLLERR):
+            self.close_connection(connection)
+            return
+        if event_mask & select.POLLOUT:
+            self.flush_connection(connection)
+            if connection.framed and connection.input_buffer and not connection.output_chunks:
+                # requests that arrived while the previous response was waiting
+                self.handle_persistent_requests(connection, b'')
+        if event_mask & select.POLLIN and connection.receiving:
+            try:
+                received_bytes = connection.socket.recv(RECEIVE_SIZE)
+            except OSError as e:
+                if e.args[0] != errno.EAGAIN:
+                    self.close_connection(connection)
+                return
+            if not received_bytes:
+                # client closed the connection
+                self.close_connection(connection)
+                return
+            connection.last_activity_time = time.ticks_ms()
+            if connection.framed is None:
+                # the first bytes decide the protocol: framed messages ask for a persistent connection
+                connection.framed = received_bytes[:2] == PROTOCOL_MAGIC
+                # a persistent connection keeps its own read position, a close-delimited client finds its own by address
+                connection.cursor = ClientCursor(connection.last_activity_time) if connection.framed else self.get_address_cursor(connection.address)
+            if connection.framed:
+                self.handle_persistent_requests(connection, received_bytes)
             else:
-                # print('got non-None input')
-                input_data = input_data.decode() # received string from client
+                self.handle_close_delimited_request(connection, received_bytes)
+
+    def handle_close_delimited_request(self, connection, received_bytes):
+        # the legacy protocol: the first bytes received are the whole request, the response ends when the connection closes
+        try:
+            input_data = received_bytes.decode() # received string from client
+        except UnicodeError:
+            if self.log_level >= LOG_WARNING:
+                print('undecodable request, closing connection')
+            self.close_connection(connection)
+            return
+        if self.log_level >= LOG_DEBUG:
             print(f'received input from client: {input_data}')
+        connection.receiving = False
+        connection.close_after_send = True
+        get_since_request = parse_get_since_request(input_data)
+        if input_data == 'get' or get_since_request is not None:
+            # sent straight out of the frame store
+            if get_since_request is None:
+                chunks, flags, n_frames = self.get_client_payload(connection.cursor)
+            else:
+                chunks, flags, n_frames = self.get_since_payload(*get_since_request)
+            self.send_response(connection, chunks, input_data, borrowed=True)
+        else:
+            self.send_response(connection, self.process_request(input_data, connection.cursor), input_data)
+
+    def send_response(self, connection, response, input_data=None, header=None, borrowed=False):
+        '''
+        Queues a response and sends as much of it as the socket takes right away, the rest is sent when the socket
+        becomes writable. after_response() runs for input_data once the whole response is sent.
 
-            # process the string and send a response
-            # if empty string, send IMA
-            if input_data == '':
+        Args:
+        response: bytes-like, or a list of bytes-like chunks sent one after the other.
+        borrowed: True if the chunks point into the frame store, see pop_get_payload().
+        '''
+        if header is not None:
+            connection.output_chunks.append(memoryview(header))
+        for chunk in (response if isinstance(response, list) else [response]):
+            if len(chunk):
+                connection.output_chunks.append(memoryview(chunk))
+        connection.output_borrowed = connection.output_borrowed or borrowed
+        connection.after_send.append(input_data)
+        self.flush_connection(connection)
+
+    def flush_connection(self, connection):
+        # sends queued output until done or until the socket would block. Handles short writes
+        while connection.output_chunks:
+            chunk = connection.output_chunks[0]
+            try:
+                n_sent = connection.socket.send(chunk)
+            except OSError as e:
+                if e.args[0] == errno.EAGAIN:
+                    break
+                if self.log_level >= LOG_WARNING:
+                    print('send failed')
+                self.close_connection(connection)
+                return
+            if n_sent:
+                self.bytes_sent += n_sent
+                # a slow client is only dropped when it stops taking data, see close_idle_connections()
+                connection.last_activity_time = time.ticks_ms()
+            if n_sent is None or n_sent < len(chunk):
+                connection.output_chunks[0] = chunk[n_sent or 0:]
+                break
+            connection.output_chunks.pop(0)
+        if connection.output_chunks:
+            if connection.output_borrowed:
+                # the frame store may overwrite these frames before the socket is writable again: copy what is left.
+                # Only a response that does not fit in the socket's send buffer pays for this copy. Slow client policy:
+                # the copies of all connections together stay under max_detached_bytes, a client whose response does not
+                # fit is disconnected. It reconnects and, with 'get since', reads the same frames again
+                n_pending = sum(len(chunk) for chunk in connection.output_chunks)
+                if self.detached_bytes + n_pending > self.max_detached_bytes:
+                    if self.log_level >= LOG_WARNING:
+                        print('slow client, closing connection')
+                    self.slow_clients_dropped += 1
+                    self.close_connection(connection)
+                    return
+                connection.output_chunks = [memoryview(bytes(chunk)) for chunk in connection.output_chunks]
+                connection.output_borrowed = False
+                connection.detached_bytes = n_pending
+                self.detached_bytes += n_pending
+            # wait until the socket is writable again. No new request is read meanwhile, so that responses do not pile up
+            self.poller.modify(connection.socket, select.POLLOUT)
+            return
+        connection.output_borrowed = False
+        self.release_detached_bytes(connection)
+        connection.last_activity_time = time.ticks_ms()
+        self.poller.modify(connection.socket, select.POLLIN if connection.receiving else 0)
+        after_send = connection.after_send
+        connection.after_send = []
+        for input_data in after_send:
+            if input_data is not None:
+                self.after_response(connection.socket, input_data)
+        if connection.close_after_send:
+            self.close_connection(connection)
+
+    def release_detached_bytes(self, connection):
+        self.detached_bytes -= connection.detached_bytes
+        connection.detached_bytes = 0
+
+    def close_connection(self, connection):
+        connection.receiving = False
+        connection.output_chunks = []
+        self.release_detached_bytes(connection)
+        key = poll_key(connection.socket)
+        if self.connections.pop(key, None) is None:
+            return
+        try:
+            self.poller.unregister(connection.socket)
+        except Exception:
+            pass
+        try:
+            connection.socket.close()
+        except Exception:
+            pass
+        if self.log_level >= LOG_INFO:
+            print('socket closed')
+
+    def close_idle_connections(self, now):
+        for connection in list(self.connections.values()):
+            idle_time = time.ticks_diff(now, connection.last_activity_time)
+            # a persistent client may wait between requests, anything else should be quick
+            if connection.framed and not connection.output_chunks:
+                timeout = PERSISTENT_IDLE_TIMEOUT_MS
+            else:
+                timeout = REQUEST_TIMEOUT_MS
+            if idle_time > timeout:
+                if self.log_level >= LOG_INFO:
+                    print('connection idle for too long')
+                self.connections_timed_out += 1
+                self.close_connection(connection)
+
+    def process_request(self, input_data, cursor=None):
+        '''
+        Process a single client request string and return the response bytes.
+        Shared by the close-delimited and the persistent connection protocols.
+        'get' and 'clear' apply to the client's cursor if given, otherwise to the frame store itself, for every client.
+        '''
+        # if empty string, send IMA
+        if input_data == '':
+            if self.log_level >= LOG_DEBUG:
                 print('got empty string, sending IMA')
-                # send an IMA
-                client_socket.send('IMA'.encode())
-            # if 'get', just send data
-            elif input_data == 'get':  # TODO: move this functionality to the sensor object
+            # send an IMA
+            return 'IMA'.encode()
+        # if 'get', just send data
+        elif input_data == 'get':  # TODO: move this functionality to the sensor object
+            if self.log_level >= LOG_DEBUG:
                 print('got get, sending data')
-                # convert the queue to a bytearray and send it
-                data_queue_bytes = self.convert_queue_to_bytes()
-                # data_queue_bytes = b''
-                # while self.data_queue:
-                #     temp_data = self.data_queue.popleft()
-                #     # print(f'popped {repr(temp_data)}, queue length: {len(self.data_queue)}')
-                #     data_queue_bytes += temp_data
-                client_socket.send(data_queue_bytes)
-#                 self.data_queue.clear()  # TODO: move this functionality to the sensor object
-
-                print('data sent')
-            else:
-                # send ECHO
+            # convert the queue to a bytearray and send it
+            if cursor is not None:
+                chunks, flags, n_frames = self.get_client_payload(cursor)
+                return b''.join(chunks)
+            return self.convert_queue_to_bytes()
+        elif parse_get_since_request(input_data) is not None:
+            if self.log_level >= LOG_DEBUG:
+                print('got get since, sending data')
+            chunks, flags, n_frames = self.get_since_payload(*parse_get_since_request(input_data))
+            return b''.join(chunks)
+        elif input_data == 'stats':
+            if self.log_level >= LOG_DEBUG:
+                print('got stats, sending counters')
+            return self.pack_stats()
+        else:
+            # send ECHO
+            if self.log_level >= LOG_DEBUG:
                 print('got nonempty, non-get. sending ECHO')
-                # echo all caps
-                client_socket.send(input_data.upper().encode())
-                print('ECHO sent')
-                # additionally, if 'clear', clear the queue
-                if input_data == 'clear':
+            # additionally, if 'clear', clear the queue
+            if input_data == 'clear':
+                if self.log_level >= LOG_DEBUG:
                     print('got clear, clearing queue')
-                    # clear queue
-                    while self.data_queue:   # TODO: move this functionality to the sensor object
-                        self.data_queue.popleft()
-                    print(f'queue length: {len(self.data_queue)}')
-                # if 'reset', reset the ESP32
-                elif input_data == 'reset':
-                    # close socket and reset machine
-                    print('got reset, resetting machine')
-                    time.sleep_ms(50)
-                    client_socket.close() 
-                    print('socket closed')
-                    time.sleep_ms(50)
-                    # reset machine
-                    machine.reset()
-                    time.sleep_ms(500)
-            time.sleep_ms(10)                
+                # clear queue
+                if cursor is not None:
+                    # only this client skips the frames held
+                    with self.frame_store_lock:
+                        cursor.next_sequence = self.frame_store.next_sequence()
+                else:
+                    with self.frame_store_lock:
+                        self.frame_store.clear()   # TODO: move this functionality to the sensor object
+                if self.log_level >= LOG_DEBUG:
+                    print(f'queue length: {len(self.frame_store)}')
+            # echo all caps
+            return input_data.upper().encode()
+
+    def after_response(self, client_socket, input_data):
+        # actions that must happen only after the response was sent
+        # if 'reset', reset the ESP32
+        if input_data == 'reset':
+            # close socket and reset machine
+            print('got reset, resetting machine')
+            time.sleep_ms(50)
             client_socket.close() 
             print('socket closed')
+            time.sleep_ms(50)
+            # reset machine
+            machine.reset()
+            time.sleep_ms(500)
+
+    def handle_persistent_requests(self, connection, received_bytes):
+        # handles every complete framed message received so far, in order. Pipelined requests are answered one after the other
+        connection.input_buffer += received_bytes
+        # one response at a time: the next request waits until the previous response is sent, see serve_connection()
+        while connection.receiving and not connection.output_chunks and len(connection.input_buffer) >= HEADER_SIZE:
+            request_header = unpack_request_header(connection.input_buffer[:HEADER_SIZE])
+            if request_header is None:
+                if self.log_level >= LOG_WARNING:
+                    print('bad framed request, closing connection')
+                self.close_connection(connection)
+                return
+            version, msg_type, flags, payload_len = request_header
+            if len(connection.input_buffer) < HEADER_SIZE + payload_len:
+                # wait for the rest of the payload
+                return
+            payload = connection.input_buffer[HEADER_SIZE:HEADER_SIZE + payload_len]
+            connection.input_buffer = connection.input_buffer[HEADER_SIZE + payload_len:]
+            self.handle_framed_request(connection, version, msg_type, flags, payload)
+
+    def handle_framed_request(self, connection, version, msg_type, flags, payload):
+        input_data = None
+        frame_count = 0
+        response_flags = 0
+        borrowed = False
+        request, argument = parse_framed_request(version, msg_type, payload)
+        if request == REQUEST_HELLO:
+            version, connection.flags = negotiate_hello(version, flags)
+            response_flags = connection.flags
+            response = b''
+        elif request == REQUEST_ERROR:
+            msg_type = MSG_ERROR
+            response = argument
+        elif request == REQUEST_GET:
+            input_data = 'get'
+            if self.log_level >= LOG_DEBUG:
+                print(f'received framed input from client: {input_data}')
+            # every frame after the connection's cursor goes into the response, in the negotiated encoding
+            response, response_flags, frame_count = self.get_client_payload(connection.cursor, connection.flags & FLAG_COMPACT)
+            borrowed = True
+        elif request == REQUEST_GET_SINCE:
+            boot_id, sequence = argument
+            input_data = 'get since'
+            if self.log_level >= LOG_DEBUG:
+                print(f'received framed input from client: get since {sequence}')
+            response, response_flags, frame_count = self.get_since_payload(boot_id, sequence, connection.flags & FLAG_COMPACT)
+            borrowed = True
+        else:
+            input_data = argument if request == REQUEST_COMMAND else 'stats'
+            if self.log_level >= LOG_DEBUG:
+                print(f'received framed input from client: {input_data}')
+            response = self.process_request(input_data, connection.cursor)
+        response_len = sum(len(chunk) for chunk in response) if isinstance(response, list) else len(response)
+        header = pack_response_header(version, msg_type, response_flags, frame_count, response_len)
+        self.send_response(connection, response, input_data, header, borrowed)
 
     def sensor_setup(self, **sensor_addr_args):
         '''
@@ -242,11 +781,41 @@ class WifiSensorServer():
         '''
         return timestamp_float(), b''
 
+    def read_available_sensor_data(self):
+        '''
+        Read every 'row' of sensor data that is ready, without waiting for more.
+        This method may be overridden by subclasses whose sensor does not have a read_available_sensor_data() method.
+
+        Returns:
+        list: the rows read, oldest first. Possibly empty
+        '''
+        return self.sensor.read_available_sensor_data()
+
+    def get_sensor_stream(self):
+        '''
+        Return a pollable stream that becomes readable when sensor data arrives (e.g. a UART), or None.
+        Without one, sensor data is read once per event loop iteration, at least every poll_wait_time.
+        '''
+        return None
+
+    def get_sensor_stats(self):
+        '''
+        Return the sensor's own counters (e.g. the bytes its reader skipped), as a dict.
+        This method may be overridden by subclasses.
+        '''
+        return {}
+
 class WifiRadarServer(WifiSensorServer):
     def sensor_setup(self, uart_rx_pin=17, uart_tx_pin=16):
         from ld2450_radar import HLKLD2450Radar
         self.sensor = HLKLD2450Radar(uart_rx_pin, uart_tx_pin)
 
+    def get_sensor_stream(self):
+        return self.sensor.uart
+
+    def get_sensor_stats(self):
+        return self.sensor.frame_reader.get_stats()
+
     # def read_single_sensor_data(self):
     #     single_data_row = self.sensor.read_single_radar_data()
     #     return timestamp_float(), single_data_row
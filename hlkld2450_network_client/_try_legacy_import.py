@@ -0,0 +1,113 @@
+'''
+Builds a synthetic legacy capture as _archive/radar_watcher/radar_watcher.py would have written it (what
+read_until(REPORT_TAIL) returned for every frame, each followed by b'\n'), from a noisy stream of SyntheticRadar frames,
+then imports it with legacy_import.py and checks the frames against the ones sent. Frames whose payload holds 0x0A or
+begins or ends with whitespace bytes are counted, since the line-based loader got those wrong.
+
+With --compare-lines N, the first N lines are also loaded the way _try_file.py does (line by line, strip(),
+serial_protocol.read_radar_data() and pd.concat per row), for timing.
+
+python _try_legacy_import.py --frames 1000000 --corruption-rate 0.01 --compare-lines 2000
+'''
+import argparse, contextlib, io, os, random, shutil, sys, tempfile, time
+import numpy as np
+import pandas as pd
+from legacy_import import import_legacy_capture, legacy_capture_to_df, convert_legacy_capture
+from radar_frames import REPORT_TAIL, TARGET_COLUMNS, decode_frames
+from radar_recording import RecordingReader
+from simulated_server import SyntheticRadar, random_trajectories
+
+
+def make_legacy_capture(n_frames, corruption_rate, noise_rate, seed):
+    # the capture, and the frames sent intact in order
+    rng = random.Random(seed)
+    radar = SyntheticRadar(random_trajectories(rng), corruption_rate=corruption_rate, seed=seed)
+    stream = bytearray()
+    intact_frames = []
+    for k in range(n_frames):
+        if rng.random() < noise_rate:
+            stream += bytes(rng.randrange(256) for i in range(rng.randint(1, 20)))
+        frame, corrupted = radar.make_frame(k)
+        if k % 50 == 0:
+            # a target word holding 0x0A and whitespace bytes, as real coordinates often do
+            frame = frame[:4] + bytes([0x0A, 0x20, 0x0D, 0x09]) + frame[8:]
+        stream += frame
+        if not corrupted:
+            intact_frames.append(frame)
+    # radar_watcher.py: read_until(REPORT_TAIL) lines, each written with a newline
+    capture = bytearray()
+    start = 0
+    while True:
+        end = stream.find(REPORT_TAIL, start)
+        if end < 0:
+            break
+        capture += stream[start:end + len(REPORT_TAIL)] + b'\n'
+        start = end + len(REPORT_TAIL)
+    return bytes(capture), intact_frames
+
+
+def load_like_try_file(capture, n_lines):
+    # _try_file.py's loader, on the first n_lines lines
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '_archive', 'radar_watcher'))
+    import serial_protocol
+    radar_data = pd.DataFrame(columns=['timestamp'] + TARGET_COLUMNS)
+    for counter, line in enumerate(capture.split(b'\n')[:n_lines]):
+        all_target_values = serial_protocol.read_radar_data(line.strip())
+        if all_target_values is None:
+            all_target_values = [0] * 12
+        new_row = pd.DataFrame([[counter * 0.09] + list(all_target_values)], columns=['timestamp'] + TARGET_COLUMNS)
+        radar_data = pd.concat([radar_data, new_row], ignore_index=True)
+    return radar_data
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--frames', type=int, default=200000)
+    parser.add_argument('--corruption-rate', type=float, default=0.01)
+    parser.add_argument('--noise-rate', type=float, default=0.01)
+    parser.add_argument('--compare-lines', type=int, default=0)
+    parser.add_argument('--path', default='/tmp/radar_data.bin')
+    parser.add_argument('--recording', default=None, help='an empty directory, a temporary one removed afterwards if not given')
+    args = parser.parse_args()
+
+    capture, intact_frames = make_legacy_capture(args.frames, args.corruption_rate, args.noise_rate, seed=0)
+    with open(args.path, 'wb') as f:
+        f.write(capture)
+    n_newline_frames = sum(frame.find(b'\n', 4, 28) >= 0 for frame in intact_frames)
+    print(f'capture: {len(capture) / 1e6:.1f} MB, {args.frames} frames sent, {len(intact_frames)} intact, '
+          f'{n_newline_frames} with 0x0A in their payload')
+
+    t0 = time.perf_counter()
+    batch, report = import_legacy_capture(capture)
+    import_time = time.perf_counter() - t0
+    print(f'import: {report} in {import_time * 1000:.1f} ms ({len(capture) / import_time / 1e6:.0f} MB/s)')
+    expected = decode_frames(b''.join(intact_frames))['targets']
+    assert np.array_equal(batch['targets'], expected), 'frames differ from the ones sent'
+    print('every intact frame was imported, in order, none other')
+
+    t0 = time.perf_counter()
+    df, report = legacy_capture_to_df(args.path)
+    print(f'DataFrame: {df.shape} in {(time.perf_counter() - t0) * 1000:.1f} ms')
+    # a recording is appended to, so each run converts into a fresh directory
+    recording = args.recording if args.recording is not None else tempfile.mkdtemp(prefix='radar_recording_legacy_')
+    report = convert_legacy_capture(args.path, recording, 'radar_watcher')
+    reader = RecordingReader(recording)
+    assert len(reader) == report['frames'], f'{len(reader)} records in {recording}, {report["frames"]} frames converted'
+    print(f'recording: {len(reader)} records in {recording}')
+    reader.close()
+    if args.recording is None:
+        shutil.rmtree(recording)
+
+    if args.compare_lines:
+        t0 = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            # read_radar_data() prints a line per corrupted line
+            old_df = load_like_try_file(capture, args.compare_lines)
+        old_time = time.perf_counter() - t0
+        old_valid = int((old_df[TARGET_COLUMNS] != 0).any(axis=1).sum())
+        print(f'_try_file.py loader: {args.compare_lines} lines in {old_time:.2f} s, {old_valid} rows with targets; '
+              f'the importer does {report["frames"]} frames in {import_time:.3f} s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+'''
+Checks that DataFrames returned by HLKLD2450RemoteSensor.get_long_queue_df() stay unchanged while later calls append,
+trim and compact the materializer's cached columns, on a sensor whose long queue is filled with synthetic frames (no
+server needed). Every DataFrame is also compared with a full conversion of the queue, and the call is timed.
+
+python _try_materializer.py --rows 100000 --batches 20000
+'''
+import argparse, random, time
+import numpy as np
+from hlkld2450 import HLKLD2450RemoteSensor
+from radar_frames import decode_frames
+from simulated_server import SyntheticRadar, random_trajectories
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=100000, help='the long queue\'s length')
+    parser.add_argument('--batches', type=int, default=20000, help='batches of 20 frames written')
+    parser.add_argument('--check-every', type=int, default=500, help='batches between two full checks')
+    args = parser.parse_args()
+
+    sensor = HLKLD2450RemoteSensor('localhost', 0, len_long_queue=args.rows)
+    radar = SyntheticRadar(random_trajectories(random.Random(0)), corruption_rate=0.02, seed=0)
+    # frames cut short are padded, as the server stores them
+    frames = b''.join(radar.make_frame(k)[0].ljust(30, b'\0') for k in range(5000))
+    template = decode_frames(frames)
+    template['valid'] = template['header_ok'] & template['tail_ok']
+    template['frames'] = np.frombuffer(frames, dtype=np.uint8).reshape(-1, 30)
+    batch_size = 20
+    n_written = 0
+    kept = []   # (DataFrame, its copy) returned earlier, checked after every later update
+    call_times = []
+    for i in range(args.batches):
+        k = n_written % len(template['valid'])
+        batch = {name: column[k:k + batch_size] for name, column in template.items()}
+        batch['timestamp'] = np.arange(n_written, n_written + len(batch['valid'])) * 0.1
+        with sensor.data_buffer_lock:
+            sensor.data_buffer.extend(batch)
+        n_written += len(batch['valid'])
+        t0 = time.perf_counter()
+        df = sensor.get_long_queue_df()
+        call_times.append(time.perf_counter() - t0)
+        if i % args.check_every == 0:
+            rows = sensor.get_long_queue_snapshot().read()[0]
+            expected = sensor.convert_batch_to_df(rows['timestamp'], rows['targets'], rows['valid'])
+            assert df.equals(expected[df.columns]), f'batch {i}: the DataFrame differs from a full conversion'
+            kept.append((df, df.copy()))
+            for earlier, saved in kept:
+                assert earlier.equals(saved), f'batch {i}: an earlier DataFrame was changed'
+    print(f'{n_written} frames written, the cache compacted about {n_written // max(args.rows // 2, 1)} times; '
+          f'{len(kept)} DataFrames kept unchanged, each equal to a full conversion')
+    print(f'get_long_queue_df(): median {np.median(call_times) * 1000:.3f} ms, p99 {np.percentile(call_times, 99) * 1000:.3f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+'''
+Exports a recording (see _try_recording.py, which writes one to /tmp/radar_recording) to Parquet with ParquetExporter,
+then checks the files: every valid record exported once, the column types, and time-range reads with a filter on
+timestamp, which only read the row groups whose statistics overlap the range. Reports the export speed, the files'
+size and the process's peak memory, which should not grow with the recording's size.
+
+With --live, a RadarFleet polling simulated servers exports through the sensors' batch listeners instead.
+
+python _try_recording.py --sensors 50 --hours 2 && python _try_parquet_export.py --recording /tmp/radar_recording
+python _try_parquet_export.py --live --sensors 20 --duration 10
+'''
+import argparse, os, resource, shutil, time
+import numpy as np
+import pyarrow.parquet as pq
+import pyarrow.dataset as ds
+from parquet_export import ParquetExporter
+from radar_recording import RecordingReader, decode_records
+
+
+def export_live(exporter, n_sensors, duration):
+    from radar_fleet import RadarFleet
+    from simulated_server import SimulatedServerFarm
+    farm = SimulatedServerFarm(n_sensors, frame_rate=10.0, corruption_rate=0.01, seed=0)
+    farm.start()
+    fleet = RadarFleet(max_workers=8, loop_hold_time=0.2)
+    for i, (host, port) in enumerate(farm.addresses()):
+        fleet.add_remote_sensor(host, port, name=f'sim{i}', len_long_queue=10000)
+    for name, sensor in fleet.sensors.items():
+        # the simulated servers share a hostname, the sensors' name: export them by their fleet names
+        sensor.add_batch_listener(lambda sensor_name, batch, first_sequence, name=name: exporter.export_batch(name, batch, first_sequence))
+    fleet.start()
+    time.sleep(duration)
+    fleet.stop()
+    farm.stop()
+    return sum(sensor.get_sequence_stats()['frames_received'] for sensor in fleet.sensors.values())
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--recording', default='/tmp/radar_recording')
+    parser.add_argument('--directory', default='/tmp/radar_parquet')
+    parser.add_argument('--row-group-rows', type=int, default=1 << 16)
+    parser.add_argument('--file-rows', type=int, default=1 << 20)
+    parser.add_argument('--raw-frames', action='store_true')
+    parser.add_argument('--live', action='store_true')
+    parser.add_argument('--sensors', type=int, default=20)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--queries', type=int, default=20)
+    args = parser.parse_args()
+
+    shutil.rmtree(args.directory, ignore_errors=True)
+    exporter = ParquetExporter(args.directory, row_group_rows=args.row_group_rows, file_rows=args.file_rows,
+                               include_raw_frames=args.raw_frames, max_row_group_delay=2)
+    exporter.start()
+    t0 = time.perf_counter()
+    if args.live:
+        n_records = export_live(exporter, args.sensors, args.duration)
+    else:
+        n_records = exporter.export_recording(args.recording)
+    exporter.stop()
+    export_time = time.perf_counter() - t0
+    export_peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1e3
+    stats = exporter.get_stats()
+    size = sum(pq.ParquetFile(path).metadata.serialized_size for path in exporter.files_written)
+    file_bytes = sum(os.path.getsize(path) for path in exporter.files_written)
+    print(f'exported {n_records} frames in {export_time:.2f} s ({n_records / export_time / 1e6:.2f} M/s): {stats}')
+    print(f'files: {file_bytes / 1e6:.1f} MB ({file_bytes / max(stats["rows_written"], 1):.1f} bytes per row), '
+          f'footers {size / 1e3:.0f} kB; peak RSS during the export {export_peak_rss:.0f} MB')
+
+    dataset = ds.dataset(exporter.files_written, format='parquet')
+    print(f'schema: {dataset.schema.remove_metadata()}'.replace('\n', ', '))
+    table = dataset.to_table(columns=['timestamp', 'sensor', 'target1_x'])
+    assert table.num_rows == stats['rows_written']
+    if not args.live:
+        # every valid record, once
+        reader = RecordingReader(args.recording)
+        records = reader.read()
+        decoded = decode_records(records)
+        expected = np.sort(records['timestamp'][decoded['valid']])
+        assert np.array_equal(np.sort(table['timestamp'].to_numpy()), expected)
+        reader.close()
+        print('every valid record of the recording was exported once')
+
+    # time-range reads: the row groups read are the ones whose statistics overlap the range
+    timestamps = table['timestamp'].to_numpy()
+    t_min, t_max = timestamps.min(), timestamps.max()
+    row_group_bounds = []
+    for path in exporter.files_written:
+        metadata = pq.ParquetFile(path).metadata
+        for i in range(metadata.num_row_groups):
+            statistics = metadata.row_group(i).column(0).statistics
+            row_group_bounds.append((statistics.min, statistics.max))
+    rng = np.random.default_rng(0)
+    for i in range(args.queries):
+        t_start = rng.uniform(t_min, t_max)
+        t_end = t_start + (t_max - t_min) * 0.01
+        t0 = time.perf_counter()
+        result = dataset.to_table(filter=(ds.field('timestamp') >= t_start) & (ds.field('timestamp') < t_end))
+        query_time = time.perf_counter() - t0
+        assert result.num_rows == int(((timestamps >= t_start) & (timestamps < t_end)).sum())
+        n_overlapping = sum(1 for low, high in row_group_bounds if high >= t_start and low < t_end)
+        if i < 3:
+            print(f'1% time range: {result.num_rows} rows in {query_time * 1000:.1f} ms, '
+                  f'{n_overlapping} of {len(row_group_bounds)} row groups overlap it')
+    print(f'{args.queries} time-range reads match')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+'''
+Checks HLKLD2450RemoteSensor.query() against filtering get_long_queue_df(), on a sensor whose long queue is filled
+with synthetic frames (no server needed): a wrapped ring of 100k rows, some frames corrupted. Then times both for
+the usual rules-engine windows, and runs queries while a writer thread keeps appending, as the sensor loop would.
+
+python _try_query.py --rows 100000 --frame-rate 10
+'''
+import argparse, threading, time
+import numpy as np
+from hlkld2450 import HLKLD2450RemoteSensor
+from radar_frames import TARGET_COLUMNS, decode_frames
+from simulated_server import SyntheticRadar, random_trajectories
+import random
+
+
+def make_batch(radar, first_frame, n_frames, frame_rate, start_time):
+    # frames cut short are padded, as the server stores them
+    frames = b''.join(radar.make_frame(k)[0].ljust(30, b'\0') for k in range(first_frame, first_frame + n_frames))
+    batch = decode_frames(frames)
+    batch['timestamp'] = start_time + np.arange(first_frame, first_frame + n_frames) / frame_rate
+    batch['valid'] = batch['header_ok'] & batch['tail_ok']
+    batch['frames'] = np.frombuffer(frames, dtype=np.uint8).reshape(n_frames, 30)
+    return batch
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=100000, help='the long queue\'s length')
+    parser.add_argument('--frame-rate', type=float, default=10.0)
+    parser.add_argument('--corruption-rate', type=float, default=0.02)
+    args = parser.parse_args()
+
+    sensor = HLKLD2450RemoteSensor('localhost', 0, len_long_queue=args.rows)
+    # one batch of frames, reused with new timestamps to fill the queue 2.5 times over
+    radar = SyntheticRadar(random_trajectories(random.Random(0)), frame_rate=args.frame_rate, corruption_rate=args.corruption_rate, seed=0)
+    batch_size = 20
+    template = make_batch(radar, 0, 5000, args.frame_rate, 0.0)
+    start_time = time.time() - int(2.5 * args.rows) / args.frame_rate
+    n_written = 0
+
+    def write(n_batches):
+        nonlocal n_written
+        for i in range(n_batches):
+            k = n_written % len(template['timestamp'])
+            batch = {name: column[k:k + batch_size] for name, column in template.items()}
+            batch['timestamp'] = start_time + np.arange(n_written, n_written + len(batch['timestamp'])) / args.frame_rate
+            with sensor.data_buffer_lock:
+                sensor.data_buffer.extend(batch)
+            n_written += len(batch['timestamp'])
+
+    write(int(2.5 * args.rows) // batch_size)
+    now = start_time + n_written / args.frame_rate
+    full_df = sensor.get_long_queue_df()
+    windows = {'last 5 s': (now - 5, None), 'last minute': (now - 60, None), 'an hour ago, 10 s': (now - 3610, now - 3600),
+               'before the queue': (start_time - 100, start_time), 'everything': (None, None)}
+    for name, (t_start, t_end) in windows.items():
+        for columns in (None, ['timestamp', 'target1_x', 'target1_distance_res']):
+            result = sensor.query(t_start, t_end, columns)
+            mask = np.ones(len(full_df), dtype=bool)
+            if t_start is not None:
+                mask &= full_df['timestamp'] >= t_start
+            if t_end is not None:
+                mask &= full_df['timestamp'] < t_end
+            expected = full_df[mask][columns if columns else TARGET_COLUMNS + ['timestamp']].reset_index(drop=True)
+            assert result.equals(expected), name
+        t0 = time.perf_counter()
+        for i in range(20):
+            sensor.query(t_start, t_end)
+        query_time = (time.perf_counter() - t0) / 20
+        t0 = time.perf_counter()
+        for i in range(5):
+            df = sensor.get_long_queue_df()
+            df[(df['timestamp'] >= (t_start or -np.inf)) & (df['timestamp'] < (t_end or np.inf))]
+        filter_time = (time.perf_counter() - t0) / 5
+        print(f'{name}: {len(result)} rows, query {query_time * 1000:.3f} ms, get_long_queue_df() and filter {filter_time * 1000:.2f} ms')
+    print('every query matches filtering get_long_queue_df()')
+
+    # queries while the queue wraps under them
+    running = True
+
+    def keep_writing():
+        while running:
+            write(50)
+
+    writer = threading.Thread(target=keep_writing)
+    writer.start()
+    n_queries = 0
+    end_time = time.monotonic() + 2
+    while time.monotonic() < end_time:
+        newest = start_time + n_written / args.frame_rate
+        result = sensor.query(newest - 30, newest - 10)
+        timestamps = result['timestamp'].to_numpy()
+        assert ((timestamps >= newest - 30) & (timestamps < newest - 10)).all() and (np.diff(timestamps) > 0).all()
+        n_queries += 1
+    running = False
+    writer.join()
+    print(f'{n_queries} queries during writes, all in range and in order; snapshot stats {sensor.data_buffer.get_snapshot_stats()}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+'''
+Writes a recording with RadarRecorder and reads it back with RecordingReader, then checks every time-range read
+against a brute-force filter of all the records and reports write, seek and scan speeds.
+
+By default, batches of synthetic frames from many sensors are recorded, interleaved as a fleet's would be (each
+sensor's batches arrive with their own delays, so timestamps are only roughly sorted). With --live, a RadarFleet
+polling simulated servers records through the sensors' batch listeners instead.
+
+Then a reader tails a second recording while it is written, refreshing after every batch, and the run checks that
+it sees every record and that the files and maps it holds open do not grow with the number of refreshes.
+
+python _try_recording.py --sensors 50 --hours 2 --directory /tmp/radar_recording
+python _try_recording.py --live --sensors 20 --duration 10 --directory /tmp/radar_recording_live
+'''
+import argparse, os, random, shutil, time
+import numpy as np
+from radar_recording import RadarRecorder, RecordingReader, RECORD_SIZE
+from simulated_server import SyntheticRadar, random_trajectories
+
+
+def record_synthetic(recorder, n_sensors, hours, frame_rate, batch_size, rng):
+    # every sensor's frames in batches of batch_size, each batch delivered after a random delay
+    radar = SyntheticRadar(random_trajectories(random.Random(0)), frame_rate=frame_rate)
+    frames = np.frombuffer(b''.join(radar.make_frame(k)[0] for k in range(batch_size)), dtype=np.uint8).reshape(batch_size, -1)
+    n_batches = int(hours * 3600 * frame_rate / batch_size)
+    deliveries = []
+    for sensor in range(n_sensors):
+        batch_starts = 1.7e9 + np.arange(n_batches) * batch_size / frame_rate + rng.uniform(0, 1)
+        deliveries.extend(zip(batch_starts + batch_size / frame_rate + rng.uniform(0, 0.5, n_batches), batch_starts, [sensor] * n_batches))
+    deliveries.sort()
+    offsets = np.arange(batch_size) / frame_rate
+    for delivery_time, batch_start, sensor in deliveries:
+        recorder.record_batch(f'sensor{sensor}', {'timestamp': batch_start + offsets, 'frames': frames}, first_sequence=0)
+    return len(deliveries) * batch_size
+
+
+def record_live(recorder, n_sensors, duration):
+    from radar_fleet import RadarFleet
+    from simulated_server import SimulatedServerFarm
+    farm = SimulatedServerFarm(n_sensors, frame_rate=10.0, seed=0)
+    farm.start()
+    fleet = RadarFleet(max_workers=8, loop_hold_time=0.2)
+    for i, (host, port) in enumerate(farm.addresses()):
+        fleet.add_remote_sensor(host, port, name=f'sim{i}', len_long_queue=10000)
+    for name, sensor in fleet.sensors.items():
+        # the simulated servers share a hostname, the sensors' name: record them by their fleet names
+        sensor.add_batch_listener(lambda sensor_name, batch, first_sequence, name=name: recorder.record_batch(name, batch, first_sequence))
+    fleet.start()
+    time.sleep(duration)
+    fleet.stop()
+    farm.stop()
+    return sum(sensor.get_sequence_stats()['frames_received'] for sensor in fleet.sensors.values())
+
+
+def count_open_mappings(directory):
+    # the process's open files and memory maps under directory
+    n_files = sum(1 for fd in os.listdir('/proc/self/fd') if os.path.realpath(f'/proc/self/fd/{fd}').startswith(directory))
+    with open('/proc/self/maps') as f:
+        n_maps = sum(1 for line in f if directory in line)
+    return n_files, n_maps
+
+
+def check_tailing(directory, n_batches, segment_records):
+    # a reader refreshed after every batch while a recorder writes small segments
+    shutil.rmtree(directory, ignore_errors=True)
+    recorder = RadarRecorder(directory, segment_records=segment_records, index_interval=64)
+    recorder.start()
+    radar = SyntheticRadar(random_trajectories(random.Random(0)))
+    frames = np.frombuffer(b''.join(radar.make_frame(k)[0] for k in range(20)), dtype=np.uint8).reshape(20, -1)
+    reader = RecordingReader(directory)
+    most_open = (0, 0)
+    for i in range(n_batches):
+        recorder.record_batch('tailed', {'timestamp': 1.7e9 + i + np.arange(20) / 20, 'frames': frames}, first_sequence=i * 20)
+        time.sleep(0.002)   # the writer thread's turn
+        reader.refresh()
+        len(reader.read(1.7e9 + i - 1))
+        most_open = max(most_open, count_open_mappings(os.path.realpath(directory)))
+    recorder.stop()
+    reader.refresh()
+    assert len(reader) == n_batches * 20, (len(reader), n_batches * 20)
+    n_segments = len(reader.segments)
+    reader.close()
+    assert count_open_mappings(os.path.realpath(directory)) == (0, 0), 'maps left open after close()'
+    print(f'tailing: {n_batches} refreshes over {n_segments} segments, at most {most_open[0]} files and {most_open[1]} '
+          f'maps open at once, none after close()')
+    assert most_open[1] <= 2 * n_segments, 'the maps replaced by refresh() were not closed'
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--directory', default='/tmp/radar_recording')
+    parser.add_argument('--sensors', type=int, default=50)
+    parser.add_argument('--hours', type=float, default=1.0, help='of synthetic frames per sensor')
+    parser.add_argument('--frame-rate', type=float, default=10.0)
+    parser.add_argument('--batch-size', type=int, default=20)
+    parser.add_argument('--segment-records', type=int, default=1 << 20)
+    parser.add_argument('--index-interval', type=int, default=1024)
+    parser.add_argument('--live', action='store_true')
+    parser.add_argument('--duration', type=float, default=10.0, help='of the live run')
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--tail-batches', type=int, default=500, help='batches recorded while a reader tails the recording')
+    args = parser.parse_args()
+
+    shutil.rmtree(args.directory, ignore_errors=True)
+    recorder = RadarRecorder(args.directory, segment_records=args.segment_records, index_interval=args.index_interval)
+    recorder.start()
+    t0 = time.perf_counter()
+    if args.live:
+        n_frames = record_live(recorder, args.sensors, args.duration)
+    else:
+        n_frames = record_synthetic(recorder, args.sensors, args.hours, args.frame_rate, args.batch_size, np.random.default_rng(1))
+    recorder.stop()
+    write_time = time.perf_counter() - t0
+    stats = recorder.get_stats()
+    print(f'recorded {n_frames} frames in {write_time:.2f} s: {stats}')
+
+    reader = RecordingReader(args.directory)
+    print(f'reader: {len(reader)} records in {len(reader.segments)} segments, {len(reader.sensor_names)} sensors')
+    all_records = reader.read()
+    assert len(all_records) == stats['records_written']
+    t0 = time.perf_counter()
+    n_scanned = sum(len(records) for records in reader.iter_records())
+    for records in reader.iter_records():
+        records['timestamp'].max()
+    scan_time = time.perf_counter() - t0
+    print(f'full scan: {n_scanned * RECORD_SIZE / scan_time / 1e9:.2f} GB/s ({n_scanned / scan_time / 1e6:.0f} M records/s)')
+
+    # time-range reads against a brute-force filter
+    rng = np.random.default_rng(2)
+    timestamps = all_records['timestamp']
+    t_min, t_max = timestamps.min(), timestamps.max()
+    read_times = []
+    for i in range(args.queries):
+        t_start = rng.uniform(t_min - 10, t_max)
+        t_end = t_start + rng.choice([0.5, 5, 60, 3600])
+        sensor = f'sensor{rng.integers(args.sensors)}' if not args.live and i % 2 else None
+        t0 = time.perf_counter()
+        records = reader.read(t_start, t_end, sensor)
+        read_times.append(time.perf_counter() - t0)
+        mask = (timestamps >= t_start) & (timestamps < t_end)
+        if sensor is not None:
+            mask &= all_records['sensor_id'] == reader.sensor_id(sensor)
+        assert np.array_equal(records, all_records[mask]), (t_start, t_end, sensor)
+    print(f'{args.queries} time-range reads match a brute-force filter, median {np.median(read_times) * 1000:.2f} ms '
+          f'(brute force over everything: {len(all_records) / 1e6:.1f} M records)')
+    reader.close()
+
+    check_tailing(args.directory + '_tail', args.tail_batches, segment_records=2000)
+
+
+if __name__ == '__main__':
+    main()
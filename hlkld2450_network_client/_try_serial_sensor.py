@@ -0,0 +1,99 @@
+'''
+Runs HLKLD2450SerialSensor on a pseudo-terminal pair, with no radar: a writer thread sends synthetic report frames
+(see simulated_server.SyntheticRadar) to the master side at frame_rate, some of them corrupted, and the sensor reads
+the slave side as it would a USB-UART adapter. Each frame carries its number in target 1's x, so that the run can
+report frames lost, the parser's resyncs, and the capture-to-queue latency: the time from a frame's last byte being
+written to its row being in the queues.
+
+python _try_serial_sensor.py --frame-rate 10 --corruption-rate 0.02 --duration 10
+'''
+import argparse, os, threading, time, tty
+import numpy as np
+from hlkld2450_serial import HLKLD2450SerialSensor
+from simulated_server import SyntheticRadar
+
+FRAME_NUMBER_MODULO = 30000     # frame numbers are sent in x, up to 0x7FFF
+
+
+def frame_number_trajectory(frame_rate):
+    # a target whose x is the frame number
+    def position(t):
+        return (round(t * frame_rate) % FRAME_NUMBER_MODULO, 1000)
+    return position
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--frame-rate', type=float, default=10.0)
+    parser.add_argument('--corruption-rate', type=float, default=0.02)
+    parser.add_argument('--noise-rate', type=float, default=0.01, help='probability of a few garbage bytes between frames')
+    parser.add_argument('--baudrate', type=int, default=256000)
+    parser.add_argument('--duration', type=float, default=10.0)
+    args = parser.parse_args()
+
+    master, slave = os.openpty()
+    tty.setraw(master)
+    sensor = HLKLD2450SerialSensor(os.ttyname(slave), baudrate=args.baudrate, len_long_queue=100000)
+    radar = SyntheticRadar([frame_number_trajectory(args.frame_rate)], frame_rate=args.frame_rate,
+                           corruption_rate=args.corruption_rate, seed=0)
+    write_times = {}
+    corrupted_frames = set()
+    running = True
+
+    def write_frames():
+        rng = np.random.default_rng(0)
+        start_time = time.monotonic()
+        k = 0
+        while running:
+            time.sleep(max(0.0, start_time + k / args.frame_rate - time.monotonic()))
+            frame, corrupted = radar.make_frame(k)
+            if rng.random() < args.noise_rate:
+                os.write(master, rng.integers(0, 256, rng.integers(1, 40), dtype=np.uint8).tobytes())
+            os.write(master, frame)
+            write_times[k % FRAME_NUMBER_MODULO] = time.time()
+            if corrupted:
+                corrupted_frames.add(k % FRAME_NUMBER_MODULO)
+            k += 1
+
+    sensor.run_remote_sensor_thread()
+    time.sleep(0.5)     # the port is open and cleared before the first frame
+    writer_thread = threading.Thread(target=write_frames, daemon=True)
+    writer_thread.start()
+
+    # watch the queue for new rows, to time when each frame got there
+    queued_times = {}
+    next_row = 0
+    end_time = time.monotonic() + args.duration
+    while time.monotonic() < end_time:
+        rows, first_row = sensor.data_buffer.snapshot(start_row=next_row).read()
+        now = time.time()
+        for x, valid in zip(rows['targets'][:, 0], rows['valid']):
+            if valid:
+                queued_times[int(x) & 0x7FFF] = now
+        next_row = first_row + len(rows['valid'])
+        time.sleep(0.0002)
+    running = False
+    writer_thread.join()
+    time.sleep(0.2)
+    fps = sensor.get_fps()
+    serial_stats = sensor.get_serial_stats()
+    sensor.stop_running()
+    os.close(master)
+    os.close(slave)
+
+    rows, first_row = sensor.get_long_queue_snapshot().read()
+    frame_numbers = (rows['targets'][:, 0] & 0x7FFF)[rows['valid']]
+    timestamp_errors = [rows['timestamp'][i] - write_times[int(x) & 0x7FFF] for i, x in enumerate(rows['targets'][:, 0]) if rows['valid'][i]]
+    latencies = np.array([queued_times[k] - write_times[k] for k in queued_times if k in write_times])
+    n_intact = len(write_times) - len(corrupted_frames)
+    print(f'frames: {len(write_times)} written, {len(corrupted_frames)} corrupted, {len(frame_numbers)} valid in the queue, '
+          f'{n_intact - len(set(frame_numbers.tolist()) - corrupted_frames)} intact ones lost, fps {fps}')
+    print(f'parser: {serial_stats}')
+    if len(latencies):
+        print(f'capture to queue: p50 {np.percentile(latencies, 50) * 1000:.2f} ms, p99 {np.percentile(latencies, 99) * 1000:.2f} ms, '
+              f'max {latencies.max() * 1000:.2f} ms (queue watched every 0.2 ms)')
+        print(f'timestamp - write time: mean {np.mean(timestamp_errors) * 1000:.2f} ms, max {np.max(timestamp_errors) * 1000:.2f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+'''
+Load-tests the client against a farm of simulated sensor servers (see simulated_server.py), with no hardware:
+a RadarFleet polls every server, and the run reports throughput, frame loss, poll lag and the process's CPU use.
+
+python _try_server_farm.py --servers 200 --workers 16 --duration 20
+python _try_server_farm.py --servers 200 --base-port 17000 --farm-only     # servers only, for clients in another process
+'''
+import argparse, time
+from radar_fleet import RadarFleet
+from simulated_server import SimulatedServerFarm
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--servers', type=int, default=100)
+    parser.add_argument('--base-port', type=int, default=0, help='0 for free ports')
+    parser.add_argument('--frame-rate', type=float, default=10.0)
+    parser.add_argument('--corruption-rate', type=float, default=0.01)
+    parser.add_argument('--clock-drift-ppm', type=float, default=50.0)
+    parser.add_argument('--network-delay', type=float, default=0.005, help='seconds added to every response')
+    parser.add_argument('--network-jitter', type=float, default=0.005)
+    parser.add_argument('--workers', type=int, default=16)
+    parser.add_argument('--loop-hold-time', type=float, default=0.5)
+    parser.add_argument('--close-delimited', action='store_true', help='one connection per request instead of persistent connections')
+    parser.add_argument('--legacy-encoding', action='store_true', help='do not ask for compact payloads')
+    parser.add_argument('--duration', type=float, default=20.0)
+    parser.add_argument('--farm-only', action='store_true')
+    args = parser.parse_args()
+
+    farm = SimulatedServerFarm(args.servers, base_port=args.base_port, frame_rate=args.frame_rate,
+                               corruption_rate=args.corruption_rate, clock_drift_ppm=args.clock_drift_ppm,
+                               network_delay=args.network_delay, network_jitter=args.network_jitter, seed=0)
+    ports = farm.start()
+    print(f'{len(ports)} simulated servers on ports {ports[0]}..{ports[-1]}')
+    if args.farm_only:
+        try:
+            while True:
+                time.sleep(10)
+                print(farm.get_stats())
+        except KeyboardInterrupt:
+            farm.stop()
+        return
+
+    fleet = RadarFleet(max_workers=args.workers, loop_hold_time=args.loop_hold_time)
+    for i, (host, port) in enumerate(farm.addresses()):
+        fleet.add_remote_sensor(host, port, name=f'sim{i}', persistent_connection=not args.close_delimited,
+                                compact_encoding=not args.legacy_encoding, len_long_queue=10000)
+    cpu_time, wall_time = time.process_time(), time.monotonic()
+    fleet.start()
+    time.sleep(args.duration)
+    fleet_stats = fleet.get_stats()
+    fleet.stop()
+    cpu_time, wall_time = time.process_time() - cpu_time, time.monotonic() - wall_time
+    farm_stats = farm.get_stats()
+    farm.stop()
+
+    sensors = list(fleet.sensors.values())
+    sequence_stats = [sensor.get_sequence_stats() for sensor in sensors]
+    n_received = sum(stats['frames_received'] for stats in sequence_stats)
+    n_lost = sum(stats['frames_lost'] for stats in sequence_stats)
+    n_invalid = 0
+    for sensor in sensors:
+        rows, first_row = sensor.get_long_queue_snapshot().read()
+        n_invalid += int((~rows['valid']).sum())
+    print(f'fleet: {fleet_stats["n_connected"]}/{fleet_stats["n_sensors"]} connected, {fleet_stats["polls_per_second"]:.0f} polls/s, '
+          f'{fleet_stats["frames_per_second"]:.0f} frames/s, poll lag mean {(fleet_stats["mean_lag"] or 0) * 1000:.1f} ms '
+          f'max {fleet_stats["max_lag"] * 1000:.1f} ms')
+    print(f'frames: {farm_stats["frames_stored"]} stored by the servers, {farm_stats["corrupted_frames"]} corrupted, '
+          f'{n_received} received, {n_lost} lost, {n_invalid} invalid')
+    print(f'servers: {farm_stats["requests"]} requests, {farm_stats["connections_accepted"]} connections, '
+          f'{farm_stats["bytes_sent"] / 1e6:.1f} MB sent')
+    print(f'cpu: {cpu_time:.1f} s in {wall_time:.1f} s ({cpu_time / wall_time:.0%} of a core, servers and clients together)')
+
+
+if __name__ == '__main__':
+    main()
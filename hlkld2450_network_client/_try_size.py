@@ -31,3 +31,10 @@ def parse_queue_element(time_and_data_tuple):
     return parsed_dict
 
 
+# compare with the columnar ring buffer that replaced the deque of tuples
+from hlkld2450 import get_total_size
+from radar_ring_buffer import RadarRingBuffer
+print(f'deque of tuples: {get_total_size(long_queue) / 1e6:.1f} MB')
+for store_raw_frames in (True, False):
+    ring_buffer = RadarRingBuffer(1000000, store_raw_frames=store_raw_frames)
+    print(f'ring buffer, store_raw_frames={store_raw_frames}: {ring_buffer.nbytes() / 1e6:.1f} MB')
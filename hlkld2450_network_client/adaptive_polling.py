@@ -0,0 +1,75 @@
+SERVER_DEFAULT_QUEUE_SIZE = 340    # queue_size in the server's main.py
+
+
+class AdaptivePollScheduler():
+    '''
+    Picks the time until a sensor's next 'get' from the measured frame rate and the size of the last batch,
+    so that the server's queue fills up to about target_fill of its size between polls. This is the fewest
+    transactions per second that keeps a safety margin against overflowing the server's queue.
+
+    A batch as large as the server's queue means frames were probably dropped: the next poll comes after
+    min_interval and the overflow is counted. max_interval bounds how stale the client's data can get.
+    '''
+    def __init__(self, server_queue_size=SERVER_DEFAULT_QUEUE_SIZE, target_fill=0.5, min_interval=0.1,
+                 max_interval=5.0, initial_interval=0.5, smoothing=0.3):
+        self.server_queue_size = server_queue_size
+        self.target_fill = target_fill
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.initial_interval = initial_interval
+        self.smoothing = smoothing  # weight of the newest rate measurement
+        self.overflows = 0
+        self.transactions = 0
+        self.reset()
+
+    def reset(self):
+        # called when the sensor (re)connects. Reading resumes at the cursor, so the first batch holds every frame
+        # queued while disconnected: no rate is measured across the gap, the measurement starts over from that batch
+        self._rate = None
+        self._last_receive_timestamp = None
+        self.last_interval = self.initial_interval
+
+    def next_interval(self, last_batch_size, receive_timestamp, fps=None):
+        '''
+        Returns the time to wait before the next poll.
+
+        Args:
+        last_batch_size (int): the number of frames in the batch just received.
+        receive_timestamp (float): when the batch was received.
+        fps (float): the sensor's measured frame rate, if known (HLKLD2450RemoteSensor.get_fps()).
+
+        Returns:
+        float: the time until the next poll, in seconds.
+        '''
+        self.transactions += 1
+        # the frame rate seen by this batch alone, it reacts faster than fps after a change
+        batch_rate = None
+        if self._last_receive_timestamp is not None and receive_timestamp > self._last_receive_timestamp:
+            batch_rate = last_batch_size / (receive_timestamp - self._last_receive_timestamp)
+        self._last_receive_timestamp = receive_timestamp
+        rate = max(r for r in (fps, batch_rate, 0.0) if r is not None)
+        if self._rate is None:
+            self._rate = rate
+        else:
+            self._rate += self.smoothing * (rate - self._rate)
+        # a rising rate is followed immediately, a falling one is smoothed
+        self._rate = max(self._rate, rate)
+
+        if last_batch_size >= self.server_queue_size:
+            self.overflows += 1
+            interval = self.min_interval
+        elif self._rate > 0:
+            interval = self.target_fill * self.server_queue_size / self._rate
+        else:
+            # no frames yet, poll at the initial rate until there is a measurement
+            interval = self.initial_interval
+        self.last_interval = min(max(interval, self.min_interval), self.max_interval)
+        return self.last_interval
+
+    def get_stats(self):
+        return {
+            'transactions': self.transactions,
+            'overflows': self.overflows,
+            'frame_rate': self._rate,
+            'last_interval': self.last_interval,
+        }
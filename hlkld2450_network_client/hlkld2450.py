@@ -3,9 +3,37 @@ from threading import Lock, Thread
 from collections import deque
 from serial_protocol.serial_protocol import read_radar_data
 import sys
+import numpy as np
 import pandas as pd
+try:
+    from hlkld2450_network_client.radar_frames import FRAME_SIZE, TARGET_COLUMNS, DISTANCE_RES_FIELD_INDICES, decode_frames, widen_targets
+    from hlkld2450_network_client.radar_ring_buffer import InstrumentedLock, RadarRingBuffer
+    from hlkld2450_network_client.radar_materializer import IncrementalDataFrameMaterializer
+    from hlkld2450_network_client.hostname_resolver import get_default_resolver
+    from hlkld2450_network_client.sequence_cursor import SequenceCursor
+    from hlkld2450_network_client.wire_protocol import (
+        HEADER_SIZE, MSG_HELLO, MSG_ERROR, RESPONSE_BIT, FLAG_COMPACT, FLAG_SEQUENCE, FLAG_STATS, STATS_REQUEST,
+        WireProtocolError, pack_header, pack_request, is_echo, check_response_header, decode_get_response,
+        decode_get_since_response, decode_stats_response
+    )
+except ImportError:
+    from radar_frames import FRAME_SIZE, TARGET_COLUMNS, DISTANCE_RES_FIELD_INDICES, decode_frames, widen_targets
+    from radar_ring_buffer import InstrumentedLock, RadarRingBuffer
+    from radar_materializer import IncrementalDataFrameMaterializer
+    from hostname_resolver import get_default_resolver
+    from sequence_cursor import SequenceCursor
+    from wire_protocol import (
+        HEADER_SIZE, MSG_HELLO, MSG_ERROR, RESPONSE_BIT, FLAG_COMPACT, FLAG_SEQUENCE, FLAG_STATS, STATS_REQUEST,
+        WireProtocolError, pack_header, pack_request, is_echo, check_response_header, decode_get_response,
+        decode_get_since_response, decode_stats_response
+    )
 
 SOCKET_DEFAULT_TIMEOUT = 3
+STATS_DEFAULT_INTERVAL = 10     # seconds between two polls of the server's telemetry counters
+
+# receive buffers: a 'get' of a full 340-frame server queue is 340*38+8 bytes
+RECEIVE_BUFFER_INITIAL_SIZE = 16384
+RECEIVE_BUFFER_SMALL_SIZE = 1024    # for non-zero-copy transactions (echo, clear)
 
 def get_total_size(obj, seen=None):
     """Recursively finds the total size of an object, including its nested elements."""
@@ -29,9 +57,32 @@ def get_total_size(obj, seen=None):
 
 
 class WifiClient():
-    def __init__(self, hostname:str, port:int, socket_timeout=SOCKET_DEFAULT_TIMEOUT):
+    def __init__(self, hostname:str, port:int, socket_timeout=SOCKET_DEFAULT_TIMEOUT, persistent=False, resolver=None, compact_encoding=False):
         self.server_hostname = hostname
         self.server_port = port
+        # hostname lookups go through a cache shared by all clients, so that reconnects reuse a known IP immediately
+        self.resolver = resolver if resolver is not None else get_default_resolver()
+        # persistent connection mode: one long-lived socket speaking the framed protocol, see wire_protocol.py.
+        # falls back to the connect-per-request (close-delimited) protocol if the server does not support it
+        self.persistent = persistent
+        self._persistent_socket = None
+        self._persistent_supported = None   # None until the first handshake with the server
+        self._persistent_header_buffer = bytearray(HEADER_SIZE)
+        # ask for compact 'get' payloads when opening the persistent connection. The flags and frame count of the last
+        # response tell the reader which encoding it is in (see wire_protocol.decode_get_response())
+        self.compact_encoding = compact_encoding
+        self.negotiated_flags = 0
+        self.last_response_flags = 0
+        self.last_response_frame_count = None
+        self.persistent_socket_lock = Lock()
+        # reusable receive buffer for zero-copy transactions, and receive counters
+        self._receive_buffer = bytearray(RECEIVE_BUFFER_INITIAL_SIZE)
+        self._receive_view = memoryview(self._receive_buffer)
+        self.transaction_stats_lock = Lock()
+        with self.transaction_stats_lock:
+            self.last_transaction_stats = self._new_transaction_stats()
+            self.total_transaction_stats = self._new_transaction_stats()
+            self.total_transaction_stats['transactions'] = 0
         # create locks for server status, server IP, and last alive time
         self.server_status_lock = Lock()
         self.server_ip_lock = Lock()
@@ -49,6 +100,12 @@ class WifiClient():
     def init_client(self, check_online=False) -> tuple[bool, str]:
         # puts the client in a "ready for transaction" state
 
+        # a reconnect cycle starts from scratch: drop the persistent connection and re-negotiate it
+        if self.persistent:
+            with self.persistent_socket_lock:
+                self._close_persistent_socket()
+                self._persistent_supported = None
+
         # attempt to get the server's IP address
         ip = self._get_ip_address(self.server_hostname)
         if ip is not None:
@@ -142,31 +199,262 @@ class WifiClient():
     #         return time.time() - lat < timeout
 
     def _get_ip_address(self, hostname):
-        try:
-            ip = socket.gethostbyname(hostname)
-            with self.server_ip_lock:
-                self.server_ip = ip
-            # self._online()
-            return ip
-        except socket.gaierror:
+        # returns the cached IP if there is one, see hostname_resolver.HostnameResolverCache
+        ip = self.resolver.resolve(hostname)
+        if ip is None:
             # print("Invalid hostname. Please check the hostname and try again.")
             # self._offline()
             return None
+        with self.server_ip_lock:
+            self.server_ip = ip
+        # self._online()
+        return ip
 
     def _wait(self):
         time.sleep(0.01)
 
-    def transact_with_server(self, client_message:str, timeout=None):
+    def transact_with_server(self, client_message:str, timeout=None, zero_copy=False):
         '''
         Takes a string argument and sends it to the server, returning the server's response as bytes.
+        Uses the persistent connection if enabled and supported by the server, otherwise connects per request.
 
         Args:
         client_message (str): The message to be sent to the server.
         timeout (float): The timeout for the socket operations.
+        zero_copy (bool): If True, the response is a memoryview into the client's reusable receive buffer.
+            It is only valid until the next zero-copy transaction, so only one consumer thread should use this.
+
+        Returns:
+        bool: True if the transaction succeeded, False otherwise.
+        bytes or memoryview: The response from the server.
+        float: The time the response was received.
+        '''
+        if self.persistent and self._persistent_supported is not False:
+            with self.persistent_socket_lock:
+                supported, success, data, receive_timestamp = self._transact_persistent(client_message, timeout, zero_copy)
+            if supported:
+                return success, data, receive_timestamp
+        return self._transact_close_delimited(client_message, timeout, zero_copy)
+
+    def _new_transaction_stats(self):
+        return {'bytes_received': 0, 'recv_calls': 0, 'copies': 0, 'bytes_copied': 0}
+
+    def _record_transaction_stats(self, stats):
+        with self.transaction_stats_lock:
+            self.last_transaction_stats = stats
+            for key, value in stats.items():
+                self.total_transaction_stats[key] += value
+            self.total_transaction_stats['transactions'] += 1
+
+    def get_transaction_stats(self):
+        '''
+        Returns the receive counters of the last transaction and the totals since the client was created.
+
+        Returns:
+        dict: counters of the last transaction: bytes_received, recv_calls (recv syscalls), copies (buffer copies) and bytes_copied.
+        dict: the same counters summed over all transactions, plus the number of transactions.
+        '''
+        with self.transaction_stats_lock:
+            return dict(self.last_transaction_stats), dict(self.total_transaction_stats)
+
+    def _get_receive_view(self, size, zero_copy):
+        # a writable buffer of at least size bytes: the reusable client buffer for zero-copy transactions, a fresh one otherwise
+        if not zero_copy:
+            return memoryview(bytearray(size))
+        if len(self._receive_buffer) < size:
+            self._receive_buffer = bytearray(size)
+            self._receive_view = memoryview(self._receive_buffer)
+        return self._receive_view
+
+    def _recv_exactly_into(self, client_socket, view, n_bytes, stats):
+        # fills view[:n_bytes], returns the number of bytes received (fewer only if the server closed the connection)
+        n_received = 0
+        while n_received < n_bytes:
+            n = client_socket.recv_into(view[n_received:n_bytes])
+            stats['recv_calls'] += 1
+            if n == 0:
+                break
+            n_received += n
+        stats['bytes_received'] += n_received
+        return n_received
+
+    def _recv_until_closed_into(self, client_socket, zero_copy, stats):
+        # receives until the server closes the connection, growing the buffer when full. Returns the buffer and the number of bytes received
+        view = self._get_receive_view(RECEIVE_BUFFER_INITIAL_SIZE if zero_copy else RECEIVE_BUFFER_SMALL_SIZE, zero_copy)
+        n_received = 0
+        while True:
+            if n_received == len(view):
+                # keep what was received so far. A zero-copy buffer keeps its new size, so this happens once per client
+                grown_view = memoryview(bytearray(2 * len(view)))
+                grown_view[:n_received] = view[:n_received]
+                stats['copies'] += 1
+                stats['bytes_copied'] += n_received
+                view = grown_view
+                if zero_copy:
+                    self._receive_buffer = view.obj
+                    self._receive_view = view
+            n = client_socket.recv_into(view[n_received:])
+            stats['recv_calls'] += 1
+            if n == 0:
+                break
+            n_received += n
+        stats['bytes_received'] += n_received
+        return view, n_received
+
+    def _response_from_view(self, view, n_bytes, zero_copy, stats):
+        if zero_copy:
+            return view[:n_bytes]
+        stats['copies'] += 1
+        stats['bytes_copied'] += n_bytes
+        return bytes(view[:n_bytes])
+
+    def _open_persistent_socket(self, timeout):
+        # connects and performs the HELLO handshake. Returns the socket, or None if the server only speaks the close-delimited protocol
+        client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            client_socket.settimeout(timeout)
+            client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            client_socket.connect((self.server_ip, self.server_port))
+            client_socket.sendall(pack_header(MSG_HELLO, flags=FLAG_SEQUENCE | FLAG_STATS | (FLAG_COMPACT if self.compact_encoding else 0)))
+            # an old server echoes the request upper-cased and closes the socket. The echo has no RESPONSE_BIT, so it never passes as a reply
+            reply_view = memoryview(bytearray(HEADER_SIZE))
+            n_received = self._recv_exactly_into(client_socket, reply_view, HEADER_SIZE, self._new_transaction_stats())
+            try:
+                supported = False
+                if n_received == HEADER_SIZE:
+                    payload_len, msg_type, flags, frame_count = check_response_header(reply_view, MSG_HELLO)
+                    supported = payload_len == 0 and msg_type == MSG_HELLO | RESPONSE_BIT
+            except WireProtocolError:
+                pass
+        except Exception:
+            client_socket.close()
+            raise
+        if not supported:
+            client_socket.close()
+            return None
+        self.negotiated_flags = flags
+        return client_socket
+
+    def _ensure_persistent_socket(self, timeout):
+        # returns the persistent socket, opening it if needed, or None if the server does not support it. Must be called with persistent_socket_lock held
+        if self._persistent_socket is None:
+            client_socket = self._open_persistent_socket(timeout)
+            if client_socket is None:
+                self._persistent_supported = False
+                return None
+            self._persistent_supported = True
+            self._persistent_socket = client_socket
+        self._persistent_socket.settimeout(timeout)
+        return self._persistent_socket
+
+    def _receive_framed_response(self, client_socket, request_type, zero_copy, stats):
+        # receives one response: the header first, then exactly payload_len bytes into a buffer of the right size
+        header_view = memoryview(self._persistent_header_buffer)
+        if self._recv_exactly_into(client_socket, header_view, HEADER_SIZE, stats) < HEADER_SIZE:
+            raise ConnectionResetError('connection closed by server')
+        payload_len, msg_type, flags, frame_count = check_response_header(header_view, request_type)
+        view = self._get_receive_view(payload_len, zero_copy)
+        if self._recv_exactly_into(client_socket, view, payload_len, stats) < payload_len:
+            raise ConnectionResetError('connection closed by server')
+        if msg_type == MSG_ERROR | RESPONSE_BIT:
+            raise WireProtocolError(f'server error: {bytes(view[:payload_len]).decode()}')
+        self.last_response_flags = flags
+        self.last_response_frame_count = frame_count
+        return self._response_from_view(view, payload_len, zero_copy, stats)
+
+    def _transact_persistent(self, client_message:str, timeout=None, zero_copy=False):
+        '''
+        Performs a transaction over the persistent connection, opening it first if needed.
+        Requests and responses are framed messages, see wire_protocol.py.
+        Must be called with persistent_socket_lock held.
 
         Returns:
-        bytes: The response from the server.
+        bool: False if the server does not support persistent connections, True otherwise.
+        bool, bytes, float: as in transact_with_server.
         '''
+        if timeout is None:
+            timeout = self._socket_timeout
+        try:
+            client_socket = self._ensure_persistent_socket(timeout)
+            if client_socket is None:
+                return False, False, None, None
+            request, request_type = pack_request(client_message, self.negotiated_flags)
+            client_socket.sendall(request)
+            stats = self._new_transaction_stats()
+            data = self._receive_framed_response(client_socket, request_type, zero_copy, stats)
+            self._record_transaction_stats(stats)
+        except Exception as e:
+            # the connection is in an unknown state, drop it and reconnect on the next transaction
+            if not isinstance(e, (socket.timeout, ConnectionError)):
+                print(f'An unusual exception occurred: {e}')
+            self._close_persistent_socket()
+            return True, False, None, None
+        self._alive()
+        return True, True, data, time.time()
+
+    def pipeline_with_server(self, client_messages, timeout=None):
+        '''
+        Sends several requests at once and then receives their responses, saving a round trip per request.
+        Needs the persistent connection, otherwise the requests are sent one at a time with transact_with_server().
+
+        Args:
+        client_messages (list): the messages to be sent to the server, in order.
+        timeout (float): The timeout for the socket operations.
+
+        Returns:
+        list: a (success, response, receive timestamp) tuple per message, as returned by transact_with_server().
+        '''
+        if timeout is None:
+            timeout = self._socket_timeout
+        if self.persistent and self._persistent_supported is not False:
+            with self.persistent_socket_lock:
+                results = self._pipeline_persistent(client_messages, timeout)
+            if results is not None:
+                return results
+        return [self.transact_with_server(client_message, timeout) for client_message in client_messages]
+
+    def _pipeline_persistent(self, client_messages, timeout):
+        # returns None if the server does not support persistent connections. Must be called with persistent_socket_lock held
+        results = []
+        try:
+            client_socket = self._ensure_persistent_socket(timeout)
+            if client_socket is None:
+                return None
+            requests = [pack_request(client_message, self.negotiated_flags) for client_message in client_messages]
+            client_socket.sendall(b''.join(request for request, request_type in requests))
+            for request, request_type in requests:
+                stats = self._new_transaction_stats()
+                data = self._receive_framed_response(client_socket, request_type, False, stats)
+                self._record_transaction_stats(stats)
+                results.append((True, data, time.time()))
+        except Exception as e:
+            if not isinstance(e, (socket.timeout, ConnectionError)):
+                print(f'An unusual exception occurred: {e}')
+            self._close_persistent_socket()
+            # the requests without a response failed
+            results.extend((False, None, None) for i in range(len(client_messages) - len(results)))
+            return results
+        self._alive()
+        return results
+
+    def _close_persistent_socket(self):
+        if self._persistent_socket is not None:
+            try:
+                self._persistent_socket.close()
+            except Exception:
+                pass
+            self._persistent_socket = None
+            self.negotiated_flags = 0
+
+    def close(self):
+        '''
+        Closes the persistent connection, if open. The next transaction reconnects.
+        '''
+        with self.persistent_socket_lock:
+            self._close_persistent_socket()
+
+    def _transact_close_delimited(self, client_message:str, timeout=None, zero_copy=False):
+        # the original protocol: one connection per request, the response ends when the server closes the socket
         # TODO add try-except and a retry loop with increasing waits until an exception is raised
         # TODO put the socket into an attribute and reuse it
         success = False
@@ -189,14 +477,13 @@ class WifiClient():
                 # print(f'sent message: {client_message}')
                 self._wait()
 
-                data = b""
-                while True:
-                    packet = client_socket.recv(256)  # TODO change to 32768 for normal use
-                    if not packet: 
-                        break
-                    data += packet
-                    # print(f'got packet: {repr(packet)}')
-                    self._wait()
+                stats = self._new_transaction_stats()
+                view, n_received = self._recv_until_closed_into(client_socket, zero_copy, stats)
+                data = self._response_from_view(view, n_received, zero_copy, stats)
+                self._record_transaction_stats(stats)
+                # close-delimited responses are always in the legacy encoding
+                self.last_response_flags = 0
+                self.last_response_frame_count = None
                 # print(f'got raw data: {repr(data)}')
                 self._alive()
                 # self._online()
@@ -233,88 +520,84 @@ class WifiClient():
             return self.server_ip
     
 
-class HLKLD2450RemoteSensor():
-    # includes a wifi client within it
-    def __init__(self, hostname:str, port:int, len_short_queue=330, len_long_queue=100000, socket_timeout=SOCKET_DEFAULT_TIMEOUT):
+class RadarSensorBase():
+    '''
+    What the sensors share, whatever loop reads their frames: the data buffer with its queues, snapshots and DataFrames,
+    the sequence cursor, the batch listeners, the FPS and the server's telemetry counters.
+
+    Subclasses create the client in _create_client() and run the loop that reads from it: HLKLD2450RemoteSensor and
+    hlkld2450_serial.HLKLD2450SerialSensor with blocking calls (see SensorThreadMixin),
+    hlkld2450_async.AsyncHLKLD2450RemoteSensor in an asyncio event loop.
+    '''
+    def __init__(self, hostname:str, port:int, len_short_queue=330, len_long_queue=100000, socket_timeout=SOCKET_DEFAULT_TIMEOUT, persistent_connection=True, store_raw_frames=True, poll_scheduler=None, compact_encoding=True, stats_interval=STATS_DEFAULT_INTERVAL):
         self.name = hostname
-        self.client = WifiClient(hostname, port, socket_timeout)
-        self.thread = None
-        # set up queues for data
-        self.short_data_queue = deque(maxlen=len_short_queue)
-        self.long_data_queue = deque(maxlen=len_long_queue)
-        # set up locks for queues
-        self.short_queue_lock = Lock()
-        self.long_queue_lock = Lock()
+        # compact_encoding only applies to persistent connections, and only if the server supports it
+        self.client = self._create_client(hostname, port, socket_timeout, persistent_connection, compact_encoding)
+        # set up the data buffer: the long queue is a columnar ring buffer, the short queue is a window on its last rows
+        self.data_buffer = RadarRingBuffer(len_long_queue, store_raw_frames=store_raw_frames)
+        self.len_short_queue = len_short_queue
+        self._short_queue_first_row = 0    # clear_short_queue() moves the short window's start without touching the long queue
+        # set up a lock for the data buffer. Only writers take it, readers go through lock-free snapshots
+        self.data_buffer_lock = InstrumentedLock()
+        # called with every batch once it is in the data buffer, see add_batch_listener()
+        self.batch_listeners = []
+        # get_long_queue_df() only converts the rows added since its previous call
+        self.long_queue_materializer = IncrementalDataFrameMaterializer(len_long_queue)
         # set up running flag and lock
         self.running = False
         self.running_lock = Lock()
+        # frames are read with 'get since' the cursor, so that none is lost across reconnects, see sequence_cursor.py.
+        # Servers without sequence numbers are read as before, with 'clear' after connecting and then 'get'
+        self.cursor = SequenceCursor()
+        self._sequence_supported = None     # None until the first read after connecting
+        self._last_read_sequenced = False   # True if the last read_data() response is a 'get since' response
+        # an adaptive_polling.AdaptivePollScheduler replaces the fixed loop_hold_time between reads, if given
+        self.poll_scheduler = poll_scheduler
+        # the server's telemetry counters, polled with 'stats' every stats_interval seconds (never if None), see get_server_stats()
+        self.stats_interval = stats_interval
+        self._stats_supported = None    # None until the first poll after connecting
+        self._last_stats_poll_time = None
+        self._server_stats = None
+        self.server_stats_lock = Lock()
         # set up an fps attribute and lock
         self._fps = None
         self.fps_lock = Lock()
+        self._fps_timestamp_queue = deque(maxlen=10)
+        self._fps_n_put_in_queues_queue = deque(maxlen=10)
         # print('created client')
         # set global socket timeout
         # socket.setdefaulttimeout(3)  # TODO change to about 10 for normal use
 
 
 
-    def run_remote_sensor(self, loop_hold_time=0.5):
-        # set running flag to True
+    def is_running(self):
         with self.running_lock:
-            self.running = True
-        # connect and clear buffer loop
-        # print(f'starting the connection and update loop')
-        while True:
-            # check if running flag is False
-            with self.running_lock:
-                if not self.running:
-                    break
-            # connect and update
-            success, error_msg = self.connect_and_update()
-            if not success:
-                # failed to connect, can't go into the read data loop, so sleep for a bit and try again
-                # print(f'Failed to connect and update')
-                time.sleep(1)
-                continue
-            # clear the remote sensor's buffer
-            self.clear_remote_buffer()
-            # set up fps calculation
-            _fps_timestamp_queue = deque(maxlen=10)
-            _fps_n_put_in_queues_queue = deque(maxlen=10)
+            return self.running
+
+    def _next_poll_interval(self, loop_hold_time, n_put_in_queues, receive_timestamp):
+        # the fixed loop_hold_time, unless there is a poll scheduler
+        if self.poll_scheduler is None:
+            return loop_hold_time
+        return self.poll_scheduler.next_interval(n_put_in_queues, receive_timestamp, fps=self.get_fps(do_not_round=True))
+
+    def _reset_fps(self):
+        # called whenever a new read data loop starts
+        self._fps_timestamp_queue = deque(maxlen=10)
+        self._fps_n_put_in_queues_queue = deque(maxlen=10)
+        with self.fps_lock:
+            self._fps = None
+
+    def _update_fps(self, receive_timestamp, n_put_in_queues):
+        # update fps queues
+        self._fps_timestamp_queue.append(receive_timestamp)
+        self._fps_n_put_in_queues_queue.append(n_put_in_queues)
+        # calculate fps
+        if len(self._fps_timestamp_queue) >= 2:
+            # calculate instantaneous fps
+            total_n_put_in_queues = sum(self._fps_n_put_in_queues_queue)
+            total_time = self._fps_timestamp_queue[-1] - self._fps_timestamp_queue[0]
             with self.fps_lock:
-                self._fps = None
-            # read data loop
-            # print(f'starting the read data loop')
-            while True:
-                # check if running flag is False
-                with self.running_lock:
-                    if not self.running:
-                        break
-                # read data
-                # print('reading data...')
-                success, data, receive_timestamp = self.read_data()
-                # print(f'success: {success}, data: {data[0:4] if data is not None else None}, receive_timestamp: {receive_timestamp}')
-                if not success:
-                    # break out of the read data loop back into the connect and update loop
-                    # print('Failed to read data, breaking out of read data loop') # this is often the case when the server is online but is still initializing
-                    with self.fps_lock:
-                        self._fps = None
-                    time.sleep(1)
-                    break
-                
-                # put data into queues
-                n_put_in_queues = self.put_data_into_queues(data, receive_timestamp)
-                # update fps queues
-                _fps_timestamp_queue.append(receive_timestamp)
-                _fps_n_put_in_queues_queue.append(n_put_in_queues)
-                # calculate fps
-                if len(_fps_timestamp_queue) >= 2:
-                    # calculate instantaneous fps
-                    total_n_put_in_queues = sum(_fps_n_put_in_queues_queue)
-                    total_time = _fps_timestamp_queue[-1] - _fps_timestamp_queue[0]
-                    with self.fps_lock:
-                        self._fps = 1.0*total_n_put_in_queues / total_time
-                # sleep for a bit
-                time.sleep(loop_hold_time)
+                self._fps = 1.0*total_n_put_in_queues / total_time
 
     def get_fps(self, do_not_round=False):
         with self.fps_lock:
@@ -324,179 +607,254 @@ class HLKLD2450RemoteSensor():
                 return round(temp_fps, 3)
         return temp_fps
 
-    def connect_and_update(self):
-        success, error_msg = self.client.init_client(check_online=True)
-        return success, error_msg
+    def put_data_into_queues(self, data, receive_timestamp, flags=0, frame_count=None, sequenced=False):
+        # decode outside the lock, then append the whole batch with bulk array copies.
+        # flags and frame_count come from the response header, see wire_protocol.decode_get_response().
+        # A 'get since' response (sequenced) moves the cursor once its frames are stored
+        if sequenced:
+            (batch, final_timestamp), (boot_id, first_sequence, next_sequence) = decode_get_since_response(data, receive_timestamp, flags, frame_count)
+        else:
+            batch, final_timestamp = decode_get_response(data, receive_timestamp, flags, frame_count)
+        batch['valid'] = batch['header_ok'] & batch['tail_ok']
+        with self.data_buffer_lock:
+            n_put_in_queues = self.data_buffer.extend(batch)
+        if sequenced:
+            self.cursor.advance(boot_id, first_sequence, len(batch['timestamp']))
+        if self.batch_listeners:
+            self._notify_batch_listeners(batch, first_sequence if sequenced else None)
+        return n_put_in_queues
 
-    def clear_remote_buffer(self):
-        success, data, receive_timestamp = self.client.transact_with_server('clear')
-        try:
-            success = success and data.decode() == 'CLEAR'
-        except Exception as e:
-            # print(f'Exception occurred in clear_remote_buffer(): {e}')
-            success = False
+    def add_batch_listener(self, listener):
+        '''
+        Registers a function to call from the sensor loop with every batch of frames, once it is in the queues,
+        e.g. radar_recording.RadarRecorder.record_batch(). It should return quickly and must not raise.
+
+        Args:
+        listener (callable): called as listener(name, batch, first_sequence). batch is the column name -> array dict
+            put into the data buffer, 'frames' holding the raw frames whatever store_raw_frames; its arrays may be views
+            into the receive buffer, only valid during the call. first_sequence is the server's sequence number of
+            the batch's first frame, None if the server does not number its frames.
+        '''
+        self.batch_listeners.append(listener)
+
+    def remove_batch_listener(self, listener):
+        self.batch_listeners.remove(listener)
+
+    def _notify_batch_listeners(self, batch, first_sequence):
+        for listener in self.batch_listeners:
+            listener(self.name, batch, first_sequence)
+
+    def get_sequence_stats(self):
+        '''
+        Returns the cursor position and loss counters, see SequenceCursor.get_stats(), and whether the server has sequence
+        numbers (None until the first read). Without them, lost frames cannot be counted.
+        '''
+        stats = self.cursor.get_stats()
+        stats['sequence_supported'] = self._sequence_supported
+        return stats
+
+    def _server_stats_due(self, now):
+        if self.stats_interval is None or self._stats_supported is False:
+            return False
+        return self._last_stats_poll_time is None or now - self._last_stats_poll_time >= self.stats_interval
+
+    def _store_server_stats(self, success, response, receive_timestamp):
+        self._last_stats_poll_time = time.time()
         if not success:
-            # print('Failed to clear remote buffer')
             return False
+        if is_echo(STATS_REQUEST, response):
+            # a server without telemetry: stop asking until the next connection
+            self._stats_supported = False
+            return False
+        try:
+            stats = decode_stats_response(response)
+        except WireProtocolError:
+            return False
+        self._stats_supported = True
+        stats['receive_timestamp'] = receive_timestamp
+        with self.server_stats_lock:
+            self._server_stats = stats
         return True
-        
-    def read_data(self):
-        success, response, receive_timestamp = self.client.transact_with_server('get')
-        if not success:
-            return False, None, None
-        return True, response, receive_timestamp
 
-    def put_data_into_queues(self, data, receive_timestamp):
-        n_put_in_queues = 0
-        data_deque, final_timestamp = self.deserialize_data(data, receive_timestamp)
-        with self.short_queue_lock:
-            # self.short_data_queue.extend(data_deque)
-            for data_time_tuple in data_deque:
-                self.short_data_queue.append(data_time_tuple)
-                n_put_in_queues += 1
-        with self.long_queue_lock:
-            # self.long_data_queue.extend(data_deque)
-            for data_time_tuple in data_deque:
-                self.long_data_queue.append(data_time_tuple)
-                # print(f'data tuple appended to long queue: {data_time_tuple}, size: {self.long_data_queue.__sizeof__()} bytes')
-        # print(f'data put into queues. len(short): {len(self.short_data_queue)}, len(long): {len(self.long_data_queue)}')
-        return n_put_in_queues
+    def get_server_stats(self):
+        '''
+        Returns the server's telemetry counters from the last 'stats' poll, see wire_protocol.decode_stats_response(), with
+        the time they were received (receive_timestamp). None if the server did not answer a poll yet, or has no telemetry.
+        '''
+        with self.server_stats_lock:
+            return dict(self._server_stats) if self._server_stats is not None else None
 
     # TODO pass all the 'alive' functionality to the sensor object...?
 
+    def _short_queue_start_row(self):
+        return max(self._short_queue_first_row, self.data_buffer.total_written - self.len_short_queue)
+
+    def get_short_queue_snapshot(self):
+        '''
+        Returns a read-only snapshot of the short queue, taken without blocking the sensor loop and without copying.
+        See radar_ring_buffer.RadarRingSnapshot.
+        '''
+        return self.data_buffer.snapshot(start_row=self._short_queue_start_row())
+
+    def get_long_queue_snapshot(self):
+        '''
+        Returns a read-only snapshot of the long queue, taken without blocking the sensor loop and without copying.
+        See radar_ring_buffer.RadarRingSnapshot.
+        '''
+        return self.data_buffer.snapshot()
+
+    def _read_rows(self, short):
+        snapshot = self.get_short_queue_snapshot() if short else self.get_long_queue_snapshot()
+        rows, start_row = snapshot.read()
+        return rows
+
+    def _rows_to_queue(self, rows):
+        # the original (timestamp, frame bytes) deque, rebuilt from the raw frame column
+        if 'frames' not in rows:
+            return None
+        frames_bytes = rows['frames'].tobytes()
+        return deque(
+            (timestamp, frames_bytes[i * FRAME_SIZE:(i + 1) * FRAME_SIZE])
+            for i, timestamp in enumerate(rows['timestamp'].tolist())
+        )
+
     def get_short_queue(self):
-        with self.short_queue_lock:
-            return self.short_data_queue.copy()
+        # returns None if the sensor does not store raw frames
+        return self._rows_to_queue(self._read_rows(short=True))
         
     def get_long_queue(self):
-        with self.long_queue_lock:
-            return self.long_data_queue.copy()
+        # returns None if the sensor does not store raw frames
+        return self._rows_to_queue(self._read_rows(short=False))
         
     def get_short_queue_df(self):
-        short_queue = self.get_short_queue()
-        if short_queue is None:
-            return None
-        # initialize an empty dataframe
-        # df = pd.DataFrame()
-        # iterate through the short queue and append each element to the dataframe
-        # len_short_queue = self.get_short_queue_length()
-        # t0 = time.time()
-        # for data_time_tuple in short_queue:
-        #     parsed_dict = self.parse_radar_data(data_queue_element=data_time_tuple)
-        #     if parsed_dict is None:
-        #         continue
-        #     df = df.append(parsed_dict, ignore_index=True)
-        df = self.convert_queue_to_df(short_queue)
-        return df
+        rows = self._read_rows(short=True)
+        return self.convert_batch_to_df(rows['timestamp'], rows['targets'], rows['valid'])
     
     def get_long_queue_df(self):
-        long_queue = self.get_long_queue()
-        if long_queue is None:
-            return None
-        # initialize an empty dataframe
-        # df = pd.DataFrame()
-        # iterate through the long queue and append each element to the dataframe
-        # len_long_queue = self.get_long_queue_length()
-        # t0 = time.time()
-        # for data_time_tuple in long_queue:
-        #     parsed_dict = self.parse_radar_data(data_queue_element=data_time_tuple)
-        #     if parsed_dict is None:
-        #         continue
-        #     df = df.append(parsed_dict, ignore_index=True)
-        df = self.convert_queue_to_df(long_queue)
-        return df
+        # only the rows written since the previous call are copied out of the buffer and converted
+        materializer = self.long_queue_materializer
+        with materializer.lock:
+            snapshot = self.data_buffer.snapshot(start_row=materializer.next_row)
+            new_rows, start_row = snapshot.read()
+            materializer.update(new_rows, start_row, self.data_buffer.oldest_row())
+            return materializer.to_df()
     
+    def query(self, t_start=None, t_end=None, columns=None):
+        '''
+        Returns the frames of the long queue with t_start <= timestamp < t_end, as get_long_queue_df() does for the
+        whole queue. The rows are found with binary searches on the timestamps and only they are copied and converted,
+        so the cost grows with the result, not with the queue. E.g. the last 5 seconds: query(time.time() - 5).
+
+        Args:
+        t_start, t_end (float): the time range, in time.time() seconds. Either None for no bound.
+        columns (list): the columns to return, among TARGET_COLUMNS and 'timestamp'. All by default.
+
+        Returns:
+        pd.DataFrame: the frames, without the corrupted ones.
+        '''
+        if columns is None:
+            columns = TARGET_COLUMNS + ['timestamp']
+        unknown_columns = [column_name for column_name in columns if column_name != 'timestamp' and column_name not in TARGET_COLUMNS]
+        if unknown_columns:
+            raise ValueError(f'unknown columns {unknown_columns}')
+        # only the columns needed are copied out of the buffer
+        column_names = ['valid', 'timestamp'] if 'timestamp' in columns else ['valid']
+        if any(column_name != 'timestamp' for column_name in columns):
+            column_names.append('targets')
+        rows, start_row = self.get_long_queue_snapshot().time_range(t_start, t_end).read(column_names)
+        valid = rows['valid']
+        df_columns = {}
+        for column_name in columns:
+            if column_name == 'timestamp':
+                df_columns[column_name] = rows['timestamp'][valid]
+                continue
+            # int64 columns, as convert_batch_to_df(), the distance resolution read as unsigned
+            i = TARGET_COLUMNS.index(column_name)
+            target_column = rows['targets'][valid, i]
+            if i in DISTANCE_RES_FIELD_INDICES:
+                target_column = target_column.view(np.uint16)
+            df_columns[column_name] = target_column.astype(np.int64)
+        return pd.DataFrame(df_columns, columns=columns)
+
     def convert_queue_to_df(self, queue):
         if queue is None:
             return None
-        # initialize an empty dataframe
-        df = pd.DataFrame()
-        # iterate through the queue and append each element to the dataframe
-        len_queue = len(queue)
-        t0 = time.time()
+        # decode all frames in one vectorized pass instead of calling read_radar_data() per frame
+        frames_bytes = b''.join([radar_data for timestamp, radar_data in queue])
+        if len(frames_bytes) != FRAME_SIZE * len(queue):
+            # some element is not a 30-byte frame, these can only be parsed one by one
+            return self._convert_queue_to_df_per_frame(queue)
+        timestamps = np.fromiter((timestamp for timestamp, radar_data in queue), dtype=np.float64, count=len(queue))
+        decoded_frames = decode_frames(frames_bytes)
+        return self.convert_batch_to_df(timestamps, decoded_frames['targets'], decoded_frames['header_ok'] & decoded_frames['tail_ok'])
+
+    def convert_batch_to_df(self, timestamps, targets, valid):
+        '''
+        Builds a DataFrame with the same columns as convert_queue_to_df() from decoded columns,
+        dropping the frames with a corrupted header or tail.
+
+        Args:
+        timestamps (np.ndarray): float64 timestamps.
+        targets (np.ndarray): int16 target matrix of shape (n, 12), as decoded by radar_frames.decode_targets().
+        valid (np.ndarray): bool array, False for frames with a corrupted header or tail.
+        '''
+        # int64 columns, as when the DataFrame was built from Python ints
+        df = pd.DataFrame(widen_targets(targets[valid]), columns=TARGET_COLUMNS)
+        df['timestamp'] = timestamps[valid]
+        return df
+
+    def _convert_queue_to_df_per_frame(self, queue):
+        # the original per-frame parser, for queues that contain frames of unexpected length
         list_of_tuples = []
         for data_time_tuple in queue:
-            #####
-            # parsed_dict = self.parse_radar_data(data_queue_element=data_time_tuple)
-            # if parsed_dict is None:
-            #     continue
-            # df = pd.concat([df, pd.DataFrame([parsed_dict])], ignore_index=True)
-            #####
             parsed_tuple = self.parse_radar_data(data_queue_element=data_time_tuple)
             if parsed_tuple is None:
                 continue
             list_of_tuples.append(parsed_tuple)
-        df = pd.DataFrame(
-            list_of_tuples,
-            columns = [
-                'target1_x',
-                'target1_y',
-                'target1_speed',
-                'target1_distance_res',
-                'target2_x',
-                'target2_y',
-                'target2_speed',
-                'target2_distance_res',
-                'target3_x',
-                'target3_y',
-                'target3_speed',
-                'target3_distance_res',
-                'timestamp'
-                ]
-            )
-
-        # try:
-        #     print(f'parsing short queue took {time.time() - t0} seconds for {len_queue} elements, avg time per element: {(time.time() - t0) / len_queue} seconds')
-        # except Exception:
-        #     pass
-
-        return df
+        return pd.DataFrame(list_of_tuples, columns=TARGET_COLUMNS + ['timestamp'])
 
 
 
     def get_short_queue_length(self):
-        with self.short_queue_lock:
-            return len(self.short_data_queue)
+        return len(self.get_short_queue_snapshot())
         
     def get_long_queue_length(self):
-        with self.long_queue_lock:
-            return len(self.long_data_queue)
+        return len(self.get_long_queue_snapshot())
+
+    def get_contention_stats(self):
+        '''
+        Returns reader/writer contention metrics for the data buffer: the writers' lock counters
+        (acquisitions, contended acquisitions, total and max wait time in seconds) and the snapshot read counters.
+        With lock-free readers, contended acquisitions only come from clear_*_queue() calls.
+        '''
+        stats = self.data_buffer_lock.get_stats()
+        stats.update(self.data_buffer.get_snapshot_stats())
+        return stats
+
+    def get_resolver_stats(self):
+        '''
+        Returns the hostname cache counters and lookup latency of the sensor's client, see HostnameResolverCache.get_stats().
+        The cache is shared, so the counters cover every client using the same resolver.
+        '''
+        return self.client.resolver.get_stats()
         
     def clear_short_queue(self):
-        with self.short_queue_lock:
-            self.short_data_queue.clear()
+        with self.data_buffer_lock:
+            self._short_queue_first_row = self.data_buffer.total_written
 
     def clear_long_queue(self):
-        with self.long_queue_lock:
-            self.long_data_queue.clear()
+        with self.data_buffer_lock:
+            self.data_buffer.clear()
 
     def clear_all_queues(self):
         self.clear_short_queue()
         self.clear_long_queue()
 
     def stop_running(self):
-        # stops the run whether it is threaded or not
+        # the loop stops at its next is_running() check
         with self.running_lock:
             self.running = False
-        if self.thread is not None:
-            try:
-                if self.thread.is_alive():
-                    self.thread.join()
-                    self.thread = None
-            except Exception as e:
-                print(f'problem accessing the thread to stop it, error: {e}')
-
-    def run_remote_sensor_thread(self, force_restart=False, loop_hold_time=0.5, daemon=True):
-        # check if thread is already running
-        if self.thread is not None:
-            if self.thread.is_alive():
-                if force_restart:
-                    self.stop_thread()
-                else:
-                    return
-        # else, start the thread
-        self.thread = Thread(target=self.run_remote_sensor, args=(loop_hold_time,), daemon=daemon)
-        self.thread.start()
+        self.client.close()
 
     def parse_radar_data(self, data_queue_element=None, radar_data=None, radar_timestamp=None):
         '''
@@ -543,44 +901,152 @@ class HLKLD2450RemoteSensor():
 
                 
     # Function to deserialize the data
-    def deserialize_data(self, serialized_data, receive_timestamp):
-        # Define the format string for a single tuple (timestamp, data)
-        tuple_format = 'd30s'
-        # Calculate the number of elements in the deque
-        # Each element is 38 bytes long (8 bytes for double + 30 bytes for string)
-        element_size = struct.calcsize(tuple_format)
-        # print(f'element_size: {element_size}')
-        total_size = len(serialized_data)
-        # print(f'total_size: {total_size}')
-        
-        # Subtract the size of the final timestamp (8 bytes for double)
-        n = (total_size - struct.calcsize('d')) // element_size
-        # print(f'n: {n}')
-        # print(f"another calculation: {1.0*(total_size - struct.calcsize('d')) / element_size}")
-        
-        # Define the format string for the entire deque + the final timestamp
-        format_string = f'={tuple_format * n}d'
-        # print(f'format_string: {format_string}, len(format_string): {struct.calcsize(format_string)}')
-        
-        # Unpack the data
-        # print(f'len(data): {len(serialized_data)}, len(format_string): {struct.calcsize(format_string)}')
-        unpacked_data = struct.unpack(format_string, serialized_data)
-        
-        # # Extract the deque elements and the final timestamp
-        # data_deque = deque()
-        
-        final_timestamp = unpacked_data[-1] # timestamp from the server marking end of transmission
+    def deserialize_data(self, serialized_data, receive_timestamp, flags=0, frame_count=None):
+        # serialized_data may be bytes or a memoryview, in the legacy or the compact encoding. The frames are copied out into bytes
+        batch, final_timestamp = decode_get_response(serialized_data, receive_timestamp, flags, frame_count)
+        frames_bytes = batch['frames'].tobytes()
+        data_and_timestamps_list = [
+            (timestamp, frames_bytes[i * FRAME_SIZE:(i + 1) * FRAME_SIZE])
+            for i, timestamp in enumerate(batch['timestamp'].tolist())
+        ]
+        return data_and_timestamps_list, final_timestamp
 
-        timestamp_additive_offset = receive_timestamp - final_timestamp # offset to add to each timestamp to get the correct time
 
-        data_and_timestamps_list = []
-        for i in range(n):
-            timestamp = unpacked_data[i * 2] + timestamp_additive_offset
-            data = unpacked_data[i * 2 + 1].rstrip(b'\x00')  # Remove any padding null bytes
-            # data_deque.append((timestamp, data))
-            data_and_timestamps_list.append((timestamp, data))
+class SensorThreadMixin():
+    '''
+    The blocking loop of a RadarSensorBase subclass: poll_once() steps, run in a thread of the sensor's own (see
+    run_remote_sensor_thread()) or one at a time by a caller such as RadarFleet. The subclass implements poll_once().
+    '''
+    thread = None
+    _connected = False  # poll_once() state: False until connected
 
-        
-        
-        # return data_deque, final_timestamp + timestamp_additive_offset
-        return data_and_timestamps_list, final_timestamp + timestamp_additive_offset
+    def run_remote_sensor(self, loop_hold_time=0.5):
+        # set running flag to True
+        with self.running_lock:
+            self.running = True
+        # connect and clear buffer, then read data until a read fails, then connect again (see poll_once)
+        self._connected = False
+        while self.is_running():
+            wait_time = self.poll_once(loop_hold_time)
+            # sleep for a bit
+            time.sleep(wait_time)
+
+    def connect_and_update(self):
+        success, error_msg = self.client.init_client(check_online=True)
+        return success, error_msg
+
+    def stop_running(self):
+        # stops the run whether it is threaded or not
+        with self.running_lock:
+            self.running = False
+        if self.thread is not None:
+            try:
+                if self.thread.is_alive():
+                    self.thread.join()
+                    self.thread = None
+            except Exception as e:
+                print(f'problem accessing the thread to stop it, error: {e}')
+        self.client.close()
+
+    def run_remote_sensor_thread(self, force_restart=False, loop_hold_time=0.5, daemon=True):
+        # check if thread is already running
+        if self.thread is not None:
+            if self.thread.is_alive():
+                if force_restart:
+                    self.stop_running()
+                else:
+                    return
+        # else, start the thread
+        self.thread = Thread(target=self.run_remote_sensor, args=(loop_hold_time,), daemon=daemon)
+        self.thread.start()
+
+
+class HLKLD2450RemoteSensor(SensorThreadMixin, RadarSensorBase):
+    # polls the server with blocking calls, in its own thread (see run_remote_sensor_thread()) or one poll_once() at a time
+    def _create_client(self, hostname, port, socket_timeout, persistent_connection, compact_encoding):
+        # subclasses may use another client with the same interface
+        return WifiClient(hostname, port, socket_timeout, persistent=persistent_connection, compact_encoding=compact_encoding)
+
+    def poll_once(self, loop_hold_time=0.5):
+        '''
+        Performs a single step of the sensor loop, without sleeping: if not connected, connect; if connected, read data
+        into the queues. Used by run_remote_sensor() and by RadarFleet.
+
+        Args:
+        loop_hold_time (float): the time to wait between reads.
+
+        Returns:
+        float: the time to wait before the next step, in seconds.
+        '''
+        if not self._connected:
+            # connect and update
+            success, error_msg = self.connect_and_update()
+            if not success:
+                # failed to connect, can't go into the read data loop, so wait for a bit and try again
+                return 1
+            # the remote sensor's buffer is not cleared: reading resumes at the cursor. The server may have changed
+            self._sequence_supported = None
+            self._stats_supported = None
+            # set up fps calculation
+            self._reset_fps()
+            if self.poll_scheduler is not None:
+                self.poll_scheduler.reset()
+            self._connected = True
+            return 0
+        # read data
+        success, data, receive_timestamp = self.read_data()
+        if not success:
+            # back to the connect and update step. This is often the case when the server is online but is still initializing
+            with self.fps_lock:
+                self._fps = None
+            self._connected = False
+            return 1
+        # put data into queues
+        n_put_in_queues = self.put_data_into_queues(data, receive_timestamp, self.client.last_response_flags, self.client.last_response_frame_count, self._last_read_sequenced)
+        # update fps
+        self._update_fps(receive_timestamp, n_put_in_queues)
+        if self._server_stats_due(receive_timestamp):
+            self.poll_server_stats()
+        return self._next_poll_interval(loop_hold_time, n_put_in_queues, receive_timestamp)
+
+    def clear_remote_buffer(self):
+        success, data, receive_timestamp = self.client.transact_with_server('clear')
+        try:
+            success = success and data.decode() == 'CLEAR'
+        except Exception as e:
+            # print(f'Exception occurred in clear_remote_buffer(): {e}')
+            success = False
+        if not success:
+            # print('Failed to clear remote buffer')
+            return False
+        return True
+
+    def read_data(self):
+        # the response is a view into the client's receive buffer, consumed by put_data_into_queues() before the next read
+        if self._sequence_supported is not False:
+            request = self.cursor.get_request()
+            success, response, receive_timestamp = self.client.transact_with_server(request, zero_copy=True)
+            if not success:
+                return False, None, None
+            if not is_echo(request, response):
+                self._sequence_supported = True
+                self._last_read_sequenced = True
+                return True, response, receive_timestamp
+            # the server does not have sequence numbers: read it the original way
+            self._sequence_supported = False
+            self.clear_remote_buffer()
+        self._last_read_sequenced = False
+        success, response, receive_timestamp = self.client.transact_with_server('get', zero_copy=True)
+        if not success:
+            return False, None, None
+        return True, response, receive_timestamp
+
+    def poll_server_stats(self):
+        '''
+        Asks the server for its telemetry counters, see get_server_stats(). Called by the sensor loop every stats_interval.
+
+        Returns:
+        bool: True if the server answered with its counters.
+        '''
+        success, response, receive_timestamp = self.client.transact_with_server(STATS_REQUEST)
+        return self._store_server_stats(success, response, receive_timestamp)
@@ -0,0 +1,294 @@
+import asyncio, socket, time
+try:
+    from hlkld2450_network_client.hlkld2450 import RadarSensorBase, SOCKET_DEFAULT_TIMEOUT
+    from hlkld2450_network_client.hostname_resolver import get_default_resolver
+    from hlkld2450_network_client.wire_protocol import (
+        HEADER_SIZE, MSG_HELLO, MSG_ERROR, RESPONSE_BIT, FLAG_COMPACT, FLAG_SEQUENCE, FLAG_STATS, STATS_REQUEST,
+        WireProtocolError, pack_header, pack_request, is_echo, check_response_header
+    )
+except ImportError:
+    from hlkld2450 import RadarSensorBase, SOCKET_DEFAULT_TIMEOUT
+    from hostname_resolver import get_default_resolver
+    from wire_protocol import (
+        HEADER_SIZE, MSG_HELLO, MSG_ERROR, RESPONSE_BIT, FLAG_COMPACT, FLAG_SEQUENCE, FLAG_STATS, STATS_REQUEST,
+        WireProtocolError, pack_header, pack_request, is_echo, check_response_header
+    )
+
+
+class AsyncWifiClient():
+    '''
+    An asyncio version of WifiClient, with the same 'echo'/'clear'/'get' semantics and the same
+    persistent and close-delimited protocols. Hostname lookup, connect, and every read and write
+    have their own timeout, so no call blocks the event loop.
+    Must be used from a single event loop.
+    '''
+    def __init__(self, hostname:str, port:int, socket_timeout=SOCKET_DEFAULT_TIMEOUT, persistent=False, resolver=None, compact_encoding=False):
+        self.server_hostname = hostname
+        self.server_port = port
+        # the same process-wide lookup cache as WifiClient, filled by non-blocking lookups
+        self.resolver = resolver if resolver is not None else get_default_resolver()
+        self._refresh_task = None
+        self.server_ip = None
+        self.last_alive_time = None
+        self._socket_timeout = socket_timeout
+        self.persistent = persistent
+        self._persistent_supported = None   # None until the first handshake with the server
+        self._reader = None
+        self._writer = None
+        self._persistent_lock = asyncio.Lock()
+        # see WifiClient
+        self.compact_encoding = compact_encoding
+        self.negotiated_flags = 0
+        self.last_response_flags = 0
+        self.last_response_frame_count = None
+
+    async def init_client(self, check_online=False) -> tuple[bool, str]:
+        # puts the client in a "ready for transaction" state, as WifiClient.init_client()
+        if self.persistent:
+            await self.aclose()
+            self._persistent_supported = None
+        ip = await self._get_ip_address(self.server_hostname)
+        if ip is None:
+            return False, 'hostname not found in network'
+        if check_online:
+            is_online = await self.check_if_online()
+            if not is_online:
+                return False, 'Server not online'
+        return True, ''
+
+    async def _get_ip_address(self, hostname):
+        # a cached IP is used immediately, a stale one is refreshed in a background task
+        found, ip, fresh = self.resolver.peek(hostname)
+        if found:
+            if not fresh and (self._refresh_task is None or self._refresh_task.done()):
+                self._refresh_task = asyncio.create_task(self._lookup(hostname))
+        else:
+            ip = await self._lookup(hostname)
+        if ip is not None:
+            self.server_ip = ip
+        return ip
+
+    async def _lookup(self, hostname):
+        # non-blocking lookup, runs in the event loop's default executor. The result goes into the shared cache
+        loop = asyncio.get_running_loop()
+        t0 = time.monotonic()
+        try:
+            addresses = await asyncio.wait_for(
+                loop.getaddrinfo(hostname, self.server_port, family=socket.AF_INET, type=socket.SOCK_STREAM),
+                self._socket_timeout,
+            )
+            ip = addresses[0][4][0]
+        except (OSError, asyncio.TimeoutError):
+            ip = None
+        self.resolver.record_lookup(hostname, ip, time.monotonic() - t0)
+        return ip
+
+    def _alive(self):
+        self.last_alive_time = time.time()
+
+    async def check_if_online(self):
+        '''
+        Actively checks if the server is online by sending 'echo', and returns the result.
+        '''
+        success, data, receive_timestamp = await self.transact_with_server('echo')
+        return success and data == b'ECHO'
+
+    def time_since_last_alive(self, do_not_round=False):
+        '''
+        Returns the time since the server was last known to be alive, in seconds, or None if it never was.
+        '''
+        lat = self.last_alive_time
+        if lat is None:
+            return None
+        if not do_not_round:
+            return round(time.time() - lat, 3)
+        return time.time() - lat
+
+    def get_ip(self):
+        return self.server_ip
+
+    async def transact_with_server(self, client_message:str, timeout=None):
+        '''
+        Sends a string to the server and returns its response, as WifiClient.transact_with_server().
+
+        Args:
+        client_message (str): The message to be sent to the server.
+        timeout (float): The timeout for each socket operation.
+
+        Returns:
+        bool: True if the transaction succeeded, False otherwise.
+        bytes: The response from the server.
+        float: The time the response was received.
+        '''
+        if timeout is None:
+            timeout = self._socket_timeout
+        if self.persistent and self._persistent_supported is not False:
+            async with self._persistent_lock:
+                supported, success, data, receive_timestamp = await self._transact_persistent(client_message, timeout)
+            if supported:
+                return success, data, receive_timestamp
+        return await self._transact_close_delimited(client_message, timeout)
+
+    async def _open_persistent_connection(self, timeout):
+        # connects and performs the HELLO handshake. Returns False if the server only speaks the close-delimited protocol
+        self._reader, self._writer = await asyncio.wait_for(
+            asyncio.open_connection(self.server_ip, self.server_port), timeout
+        )
+        self._writer.write(pack_header(MSG_HELLO, flags=FLAG_SEQUENCE | FLAG_STATS | (FLAG_COMPACT if self.compact_encoding else 0)))
+        await asyncio.wait_for(self._writer.drain(), timeout)
+        try:
+            reply = await asyncio.wait_for(self._reader.readexactly(HEADER_SIZE), timeout)
+            payload_len, msg_type, flags, frame_count = check_response_header(reply, MSG_HELLO)
+            supported = payload_len == 0 and msg_type == MSG_HELLO | RESPONSE_BIT
+        except (asyncio.IncompleteReadError, WireProtocolError):
+            supported = False
+        if not supported:
+            await self.aclose()
+            return False
+        self.negotiated_flags = flags
+        return True
+
+    async def _transact_persistent(self, client_message:str, timeout):
+        # see WifiClient._transact_persistent(). Must be called with _persistent_lock held
+        try:
+            if self._writer is None:
+                if not await self._open_persistent_connection(timeout):
+                    self._persistent_supported = False
+                    return False, False, None, None
+                self._persistent_supported = True
+            request, request_type = pack_request(client_message, self.negotiated_flags)
+            self._writer.write(request)
+            await asyncio.wait_for(self._writer.drain(), timeout)
+            header = await asyncio.wait_for(self._reader.readexactly(HEADER_SIZE), timeout)
+            payload_len, msg_type, flags, frame_count = check_response_header(header, request_type)
+            data = await asyncio.wait_for(self._reader.readexactly(payload_len), timeout)
+            if msg_type == MSG_ERROR | RESPONSE_BIT:
+                raise WireProtocolError(f'server error: {data.decode()}')
+            self.last_response_flags = flags
+            self.last_response_frame_count = frame_count
+        except Exception as e:
+            # the connection is in an unknown state, drop it and reconnect on the next transaction
+            if not isinstance(e, (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError)):
+                print(f'An unusual exception occurred: {e}')
+            await self.aclose()
+            return True, False, None, None
+        self._alive()
+        return True, True, data, time.time()
+
+    async def _transact_close_delimited(self, client_message:str, timeout):
+        # the original protocol: one connection per request, the response ends when the server closes the connection
+        writer = None
+        try:
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(self.server_ip, self.server_port), timeout)
+            writer.write(client_message.encode())
+            await asyncio.wait_for(writer.drain(), timeout)
+            data = await asyncio.wait_for(reader.read(), timeout)
+        except Exception as e:
+            if not isinstance(e, (asyncio.TimeoutError, ConnectionError)):
+                print(f'An unusual exception occurred: {e}')
+            return False, None, None
+        finally:
+            if writer is not None:
+                await self._close_writer(writer)
+        self.last_response_flags = 0
+        self.last_response_frame_count = None
+        self._alive()
+        return True, data, time.time()
+
+    def close(self):
+        '''
+        Closes the persistent connection, if open, without waiting for it to be closed: for synchronous callers such as
+        stop_running(). Coroutines use aclose(). The next transaction reconnects.
+        '''
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = None
+        self._writer = None
+        self.negotiated_flags = 0
+
+    async def aclose(self):
+        '''
+        Closes the persistent connection, if open, and waits until it is closed. The next transaction reconnects.
+        '''
+        writer = self._writer
+        self.close()
+        if writer is not None:
+            await self._close_writer(writer)
+
+    async def _close_writer(self, writer):
+        # a connection that failed may fail again while closing, it is gone either way
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except Exception:
+            pass
+
+
+class AsyncHLKLD2450RemoteSensor(RadarSensorBase):
+    '''
+    An HLKLD2450RemoteSensor polled from an asyncio event loop instead of its own thread, so that many sensors
+    can share one loop. The data buffer, DataFrame, snapshot and FPS methods are RadarSensorBase's, as for
+    HLKLD2450RemoteSensor; the blocking loop and its thread are not there.
+
+    Start polling with asyncio.create_task(sensor.run_remote_sensor()), stop it with stop_running().
+    '''
+    def _create_client(self, hostname, port, socket_timeout, persistent_connection, compact_encoding):
+        return AsyncWifiClient(hostname, port, socket_timeout, persistent=persistent_connection, compact_encoding=compact_encoding)
+
+    async def run_remote_sensor(self, loop_hold_time=0.5):
+        # the same connect / read data loops as HLKLD2450RemoteSensor.poll_once()
+        with self.running_lock:
+            self.running = True
+        while self.is_running():
+            success, error_msg = await self.connect_and_update()
+            if not success:
+                await asyncio.sleep(1)
+                continue
+            self._sequence_supported = None
+            self._stats_supported = None
+            self._reset_fps()
+            if self.poll_scheduler is not None:
+                self.poll_scheduler.reset()
+            while self.is_running():
+                success, data, receive_timestamp = await self.read_data()
+                if not success:
+                    with self.fps_lock:
+                        self._fps = None
+                    await asyncio.sleep(1)
+                    break
+                n_put_in_queues = self.put_data_into_queues(data, receive_timestamp, self.client.last_response_flags, self.client.last_response_frame_count, self._last_read_sequenced)
+                self._update_fps(receive_timestamp, n_put_in_queues)
+                if self._server_stats_due(receive_timestamp):
+                    await self.poll_server_stats()
+                await asyncio.sleep(self._next_poll_interval(loop_hold_time, n_put_in_queues, receive_timestamp))
+
+    async def connect_and_update(self):
+        return await self.client.init_client(check_online=True)
+
+    async def poll_server_stats(self):
+        # see HLKLD2450RemoteSensor.poll_server_stats()
+        success, response, receive_timestamp = await self.client.transact_with_server(STATS_REQUEST)
+        return self._store_server_stats(success, response, receive_timestamp)
+
+    async def clear_remote_buffer(self):
+        success, data, receive_timestamp = await self.client.transact_with_server('clear')
+        return success and data == b'CLEAR'
+
+    async def read_data(self):
+        # 'get since' the cursor, or 'clear' once and 'get' if the server does not have sequence numbers, as HLKLD2450RemoteSensor.read_data()
+        if self._sequence_supported is not False:
+            request = self.cursor.get_request()
+            success, response, receive_timestamp = await self.client.transact_with_server(request)
+            if not success:
+                return False, None, None
+            if not is_echo(request, response):
+                self._sequence_supported = True
+                self._last_read_sequenced = True
+                return True, response, receive_timestamp
+            self._sequence_supported = False
+            await self.clear_remote_buffer()
+        self._last_read_sequenced = False
+        success, response, receive_timestamp = await self.client.transact_with_server('get')
+        if not success:
+            return False, None, None
+        return True, response, receive_timestamp
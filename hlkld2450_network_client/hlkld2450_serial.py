@@ -0,0 +1,251 @@
+import time
+from threading import Lock
+import numpy as np
+try:
+    import serial
+except ImportError:
+    # pyserial is only needed for HLKLD2450SerialSensor
+    serial = None
+try:
+    from hlkld2450_network_client.hlkld2450 import RadarSensorBase, SensorThreadMixin
+    from hlkld2450_network_client.radar_frames import REPORT_HEADER, REPORT_TAIL, FRAME_SIZE, decode_frames
+except ImportError:
+    from hlkld2450 import RadarSensorBase, SensorThreadMixin
+    from radar_frames import REPORT_HEADER, REPORT_TAIL, FRAME_SIZE, decode_frames
+
+SERIAL_DEFAULT_BAUDRATE = 256000    # the LD2450's factory setting
+SERIAL_READ_TIMEOUT = 0.05  # seconds a read waits for its first byte: how often the reader thread checks that it should stop
+SERIAL_BITS_PER_BYTE = 10   # 8N1: a start bit, 8 data bits and a stop bit
+
+
+class SerialFrameParser():
+    '''
+    Cuts LD2450 report frames out of a serial byte stream, as the server's ld2450_radar.UARTFrameReader does:
+    bytes that are not part of a frame (line noise, a frame cut short) are skipped until the next report header.
+    '''
+    def __init__(self):
+        self.buffer = bytearray()
+        # counters, see get_stats()
+        self.frames = 0
+        self.skipped_bytes = 0
+        self.resyncs = 0
+
+    def reset(self):
+        # drops the bytes of a partial frame
+        self.buffer = bytearray()
+
+    def feed(self, data):
+        '''
+        Adds the bytes received and cuts out the complete frames.
+
+        Returns:
+        list: the frames, as bytes, oldest first.
+        list: for each frame, the number of bytes received after its last byte, in this data and the leftover of earlier data.
+        '''
+        buffer = self.buffer
+        buffer.extend(data)
+        frames = []
+        frame_ends = []
+        start = 0
+        while len(buffer) - start >= FRAME_SIZE:
+            if buffer.startswith(REPORT_HEADER, start) and buffer.startswith(REPORT_TAIL, start + FRAME_SIZE - len(REPORT_TAIL)):
+                frames.append(bytes(buffer[start:start + FRAME_SIZE]))
+                start += FRAME_SIZE
+                frame_ends.append(start)
+                continue
+            # out of sync: skip to the next report header after this byte
+            self.resyncs += 1
+            header_index = buffer.find(REPORT_HEADER, start + 1)
+            if header_index < 0:
+                # keep the last bytes, they may be the beginning of a header
+                header_index = max(start + 1, len(buffer) - (len(REPORT_HEADER) - 1))
+            self.skipped_bytes += header_index - start
+            start = header_index
+        n_bytes = len(buffer)
+        del buffer[:start]
+        self.frames += len(frames)
+        return frames, [n_bytes - frame_end for frame_end in frame_ends]
+
+    def get_stats(self):
+        return {
+            'frames': self.frames,
+            'skipped_bytes': self.skipped_bytes,
+            'resyncs': self.resyncs,
+        }
+
+
+class SerialRadarClient():
+    '''
+    Reads report frames from an LD2450 on a serial port, in bulk: a read waits for the first byte (at most read_timeout),
+    then takes every byte already received in one call. Stands in for WifiClient in HLKLD2450SerialSensor.
+    '''
+    def __init__(self, serial_port, baudrate=SERIAL_DEFAULT_BAUDRATE, read_timeout=SERIAL_READ_TIMEOUT):
+        self.serial_port = serial_port
+        self.baudrate = baudrate
+        self.read_timeout = read_timeout
+        self.serial = None
+        self.parser = SerialFrameParser()
+        self.last_alive_time_lock = Lock()
+        with self.last_alive_time_lock:
+            self.last_alive_time = None
+        # counters, see get_stats()
+        self.read_calls = 0
+        self.bytes_read = 0
+
+    def init_client(self, check_online=False) -> tuple[bool, str]:
+        # (re)opens the serial port. check_online is accepted for WifiClient compatibility: an open port is online
+        self.close()
+        try:
+            self.serial = serial.Serial(self.serial_port, self.baudrate, timeout=self.read_timeout)
+        except (serial.SerialException, OSError) as e:
+            return False, f'could not open {self.serial_port}: {e}'
+        # bytes received before the port was opened would be timestamped when read, long after they arrived
+        self.clear_input()
+        return True, ''
+
+    def read_frames(self):
+        '''
+        Waits for bytes at most read_timeout, then reads every byte received and cuts out the complete frames.
+        A frame is timestamped when its last byte arrived: the read time, minus the time the bytes after it took on the line.
+
+        Returns:
+        bool: False if the port failed (e.g. the adapter was unplugged) and was closed.
+        list: the frames, as bytes, oldest first. Empty if nothing complete arrived.
+        list: the frames' timestamps.
+        '''
+        try:
+            data = self.serial.read(1)
+            if data:
+                n_waiting = self.serial.in_waiting
+                if n_waiting:
+                    data += self.serial.read(n_waiting)
+        except (serial.SerialException, OSError, TypeError, AttributeError):
+            # pyserial raises TypeError or AttributeError when the port is closed under it
+            self.close()
+            return False, None, None
+        read_time = time.time()
+        if not data:
+            return True, [], []
+        self.read_calls += 1
+        self.bytes_read += len(data)
+        self._alive()
+        frames, bytes_after = self.parser.feed(data)
+        byte_time = SERIAL_BITS_PER_BYTE / self.baudrate
+        return True, frames, [read_time - n_bytes * byte_time for n_bytes in bytes_after]
+
+    def clear_input(self):
+        # drops the bytes received but not read yet
+        if self.serial is not None:
+            self.serial.reset_input_buffer()
+        self.parser.reset()
+
+    def _alive(self):
+        with self.last_alive_time_lock:
+            self.last_alive_time = time.time()
+
+    def time_since_last_alive(self, do_not_round=False):
+        with self.last_alive_time_lock:
+            last_alive_time = self.last_alive_time
+        if last_alive_time is None:
+            return None
+        time_since = time.time() - last_alive_time
+        return time_since if do_not_round else round(time_since, 3)
+
+    def close(self):
+        if self.serial is not None:
+            try:
+                self.serial.close()
+            except Exception:
+                pass
+            self.serial = None
+
+    def get_stats(self):
+        # the parser's counters, and the number of reads and bytes read
+        stats = self.parser.get_stats()
+        stats['read_calls'] = self.read_calls
+        stats['bytes_read'] = self.bytes_read
+        return stats
+
+
+class HLKLD2450SerialSensor(SensorThreadMixin, RadarSensorBase):
+    '''
+    An LD2450 wired to this host (e.g. through a USB-UART adapter), with the same queues, DataFrames, snapshots and FPS
+    as HLKLD2450RemoteSensor, and no ESP32 or WiFi in between.
+
+    Start reading with run_remote_sensor_thread() and stop with stop_running(), as a remote sensor. The reader waits for
+    bytes instead of sleeping between polls, so frames are in the queues about as soon as their last byte arrived.
+    If the port fails, it is reopened every second. Needs pyserial.
+    '''
+    def __init__(self, serial_port, baudrate=SERIAL_DEFAULT_BAUDRATE, len_short_queue=330, len_long_queue=100000, store_raw_frames=True, read_timeout=SERIAL_READ_TIMEOUT):
+        if serial is None:
+            raise ImportError('HLKLD2450SerialSensor needs pyserial (pip install pyserial)')
+        self.read_timeout = read_timeout
+        # the sensor is named after its serial port. There is no server to ask for stats
+        super().__init__(serial_port, baudrate, len_short_queue, len_long_queue, store_raw_frames=store_raw_frames, stats_interval=None)
+
+    def _create_client(self, hostname, port, socket_timeout, persistent_connection, compact_encoding):
+        # hostname and port are the serial port and the baudrate
+        return SerialRadarClient(hostname, port, self.read_timeout)
+
+    def poll_once(self, loop_hold_time=0.5):
+        '''
+        Performs a single step of the reader loop: if the port is not open, open it; if it is, wait for frames (at most
+        read_timeout) and put them into the queues. Used by run_remote_sensor() and by RadarFleet.
+
+        Args:
+        loop_hold_time (float): not used, reads wait for data instead.
+
+        Returns:
+        float: the time to wait before the next step, in seconds.
+        '''
+        if not self._connected:
+            success, error_msg = self.connect_and_update()
+            if not success:
+                return 1
+            self._reset_fps()
+            self._connected = True
+            return 0
+        success, frames, timestamps = self.read_frames()
+        if not success:
+            with self.fps_lock:
+                self._fps = None
+            self._connected = False
+            return 1
+        if frames:
+            n_put_in_queues = self.put_frames_into_queues(frames, timestamps)
+            self._update_fps(timestamps[-1], n_put_in_queues)
+        return 0
+
+    def read_frames(self):
+        # see SerialRadarClient.read_frames()
+        return self.client.read_frames()
+
+    def put_frames_into_queues(self, frames, timestamps):
+        # decodes the frames in one pass, then appends them to the data buffer as a batch
+        raw_frames = b''.join(frames)
+        batch = decode_frames(raw_frames)
+        batch['timestamp'] = np.asarray(timestamps, dtype=np.float64)
+        batch['frames'] = np.frombuffer(raw_frames, dtype=np.uint8).reshape(len(frames), FRAME_SIZE)
+        batch['valid'] = batch['header_ok'] & batch['tail_ok']
+        with self.data_buffer_lock:
+            n_put_in_queues = self.data_buffer.extend(batch)
+        if self.batch_listeners:
+            # frames read from a serial port are not numbered
+            self._notify_batch_listeners(batch, None)
+        return n_put_in_queues
+
+    def clear_input(self):
+        # drops the bytes waiting in the serial port
+        self.client.clear_input()
+        return True
+
+    def get_serial_stats(self):
+        '''
+        Returns the serial reader's counters: frames, skipped_bytes and resyncs (times the parser lost the frame boundaries),
+        read_calls and bytes_read.
+        '''
+        return self.client.get_stats()
+
+    def get_resolver_stats(self):
+        # no hostname to resolve
+        return {}
@@ -0,0 +1,140 @@
+import socket, time
+from threading import Lock, Thread
+
+RESOLVER_DEFAULT_TTL = 300          # seconds a resolved address is fresh
+RESOLVER_DEFAULT_NEGATIVE_TTL = 30  # seconds a failed lookup is remembered
+
+
+class HostnameResolverCache():
+    '''
+    A cache of hostname lookups, shared by all the clients in a process (see get_default_resolver()).
+
+    Lookups of names like 'LD2450_server_0' can go through mDNS/NetBIOS and block for seconds, so:
+    - a fresh address is returned immediately;
+    - a stale address is also returned immediately, and refreshed in a background thread;
+    - a failed lookup is remembered for negative_ttl seconds, and retried in the background after that;
+    - a refresh that fails keeps the last known address, it is only retried after negative_ttl.
+    Only the very first lookup of a hostname blocks the caller.
+    '''
+    def __init__(self, ttl=RESOLVER_DEFAULT_TTL, negative_ttl=RESOLVER_DEFAULT_NEGATIVE_TTL, lookup=socket.gethostbyname):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._lookup = lookup
+        self._entries = {}  # hostname -> [ip or None, expiry time]
+        self._refreshing = set()    # hostnames with a background refresh in flight
+        self.lock = Lock()
+        # metrics, see get_stats()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.lookups = 0
+        self.failed_lookups = 0
+        self.total_lookup_time = 0.0
+        self.max_lookup_time = 0.0
+        self.last_lookup_time = None
+
+    def resolve(self, hostname):
+        '''
+        Returns the IP address of hostname, or None if it could not be resolved.
+        Blocks only if the hostname was never looked up before.
+        '''
+        found, ip, fresh = self.peek(hostname)
+        if found:
+            if not fresh:
+                self.refresh_in_background(hostname)
+            return ip
+        return self._lookup_and_record(hostname)
+
+    def peek(self, hostname):
+        '''
+        Looks the hostname up in the cache only, and counts a hit or a miss.
+
+        Returns:
+        bool: True if the hostname is in the cache.
+        str: the cached IP address, None for a cached failure.
+        bool: True if the entry has not expired.
+        '''
+        with self.lock:
+            entry = self._entries.get(hostname)
+            if entry is None:
+                self.misses += 1
+                return False, None, False
+            ip, expiry_time = entry
+            fresh = time.monotonic() < expiry_time
+            if fresh:
+                self.hits += 1
+            else:
+                self.stale_hits += 1
+            return True, ip, fresh
+
+    def record_lookup(self, hostname, ip, lookup_time):
+        '''
+        Stores the result of a lookup done elsewhere (e.g. by an asyncio client), with its latency in seconds.
+        A failed lookup (ip is None) does not replace a known address.
+        '''
+        now = time.monotonic()
+        with self.lock:
+            self.lookups += 1
+            self.total_lookup_time += lookup_time
+            self.max_lookup_time = max(self.max_lookup_time, lookup_time)
+            self.last_lookup_time = lookup_time
+            if ip is None:
+                self.failed_lookups += 1
+                entry = self._entries.get(hostname)
+                known_ip = entry[0] if entry is not None else None
+                self._entries[hostname] = [known_ip, now + self.negative_ttl]
+            else:
+                self._entries[hostname] = [ip, now + self.ttl]
+
+    def _lookup_and_record(self, hostname):
+        t0 = time.monotonic()
+        try:
+            ip = self._lookup(hostname)
+        except OSError:
+            ip = None
+        self.record_lookup(hostname, ip, time.monotonic() - t0)
+        return ip
+
+    def refresh_in_background(self, hostname):
+        # starts a background lookup of hostname, unless one is already in flight
+        with self.lock:
+            if hostname in self._refreshing:
+                return
+            self._refreshing.add(hostname)
+        Thread(target=self._refresh, args=(hostname,), daemon=True).start()
+
+    def _refresh(self, hostname):
+        try:
+            self._lookup_and_record(hostname)
+        finally:
+            with self.lock:
+                self._refreshing.discard(hostname)
+
+    def invalidate(self, hostname):
+        # forgets hostname, the next resolve() blocks on a new lookup
+        with self.lock:
+            self._entries.pop(hostname, None)
+
+    def get_stats(self):
+        '''
+        Returns the cache counters and the lookup latency in seconds (last, mean and max over all lookups).
+        '''
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'stale_hits': self.stale_hits,
+                'misses': self.misses,
+                'lookups': self.lookups,
+                'failed_lookups': self.failed_lookups,
+                'last_lookup_time': self.last_lookup_time,
+                'mean_lookup_time': self.total_lookup_time / self.lookups if self.lookups else None,
+                'max_lookup_time': self.max_lookup_time,
+                'refreshes_in_flight': len(self._refreshing),
+            }
+
+
+_default_resolver = HostnameResolverCache()
+
+def get_default_resolver():
+    # the resolver shared by all clients in the process
+    return _default_resolver
@@ -0,0 +1,152 @@
+import os
+import numpy as np
+import pandas as pd
+try:
+    from hlkld2450_network_client.radar_frames import REPORT_HEADER, REPORT_TAIL, FRAME_SIZE, TARGET_COLUMNS, decode_frames, widen_targets
+    from hlkld2450_network_client.radar_recording import RadarRecorder
+except ImportError:
+    from radar_frames import REPORT_HEADER, REPORT_TAIL, FRAME_SIZE, TARGET_COLUMNS, decode_frames, widen_targets
+    from radar_recording import RadarRecorder
+
+# _archive/radar_watcher/radar_watcher.py captures: what read_until(REPORT_TAIL) returned for every frame, each followed
+# by b'\n'. The line may start with bytes left over before the header, and frames may hold 0x0A or whitespace bytes
+# themselves, so the file is scanned for frames rather than split into lines. There are no timestamps: frames are
+# assumed to come every LEGACY_FRAME_PERIOD seconds (_try_file.py used 0.09)
+LEGACY_FRAME_PERIOD = 0.1
+
+
+def scan_legacy_capture(data):
+    '''
+    Finds the report frames in a legacy capture in one vectorized pass: every header followed 26 bytes later by a tail.
+
+    Args:
+    data (bytes-like): the capture's contents.
+
+    Returns:
+    np.ndarray: the frames' start offsets in data, in order.
+    np.ndarray: the start offsets of the corrupted or partial frames: headers with no tail where it should be.
+    '''
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    n = len(buffer)
+    if n < len(REPORT_HEADER):
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    # the offsets of the header's first byte, then of the whole header: a pass over the capture, then over few offsets
+    headers = np.flatnonzero(buffer[:n - len(REPORT_HEADER) + 1] == REPORT_HEADER[0])
+    for i in range(1, len(REPORT_HEADER)):
+        headers = headers[buffer[headers + i] == REPORT_HEADER[i]]
+    complete = headers[headers + FRAME_SIZE <= n]
+    tail_offset = FRAME_SIZE - len(REPORT_TAIL)
+    has_tail = (buffer[complete + tail_offset] == REPORT_TAIL[0]) & (buffer[complete + tail_offset + 1] == REPORT_TAIL[1])
+    starts = complete[has_tail]
+    # a header inside a frame is part of its payload, not another frame (rare, so the loop only runs over overlaps)
+    if len(starts) > 1 and (np.diff(starts) < FRAME_SIZE).any():
+        kept = [starts[0]]
+        for start in starts[1:].tolist():
+            if start >= kept[-1] + FRAME_SIZE:
+                kept.append(start)
+        starts = np.array(kept, dtype=np.int64)
+    # the other headers are corrupted or partial frames, unless inside a frame
+    is_start = np.zeros(len(headers), dtype=bool)
+    is_start[np.searchsorted(headers, starts)] = True
+    corrupted = headers[~is_start]
+    if len(starts) and len(corrupted):
+        frame_index = np.searchsorted(starts, corrupted, side='right') - 1
+        inside_frame = (frame_index >= 0) & (corrupted < starts[np.maximum(frame_index, 0)] + FRAME_SIZE)
+        corrupted = corrupted[~inside_frame]
+    return starts.astype(np.int64), corrupted.astype(np.int64)
+
+
+def import_legacy_capture(data, start_time=0.0, frame_period=LEGACY_FRAME_PERIOD):
+    '''
+    Decodes a legacy capture, see scan_legacy_capture(). The k-th frame slot (frames and corrupted frames counted alike,
+    so that a corrupted frame leaves a gap) is timestamped start_time + k * frame_period.
+
+    Args:
+    data (bytes-like): the capture's contents.
+    start_time (float): the timestamp of the first frame.
+    frame_period (float): the time between two frames.
+
+    Returns:
+    dict: 'timestamp', 'targets' (int16 array of shape (n, 12)), 'valid' and 'frames' (uint8 array of shape (n, 30)),
+        as the sensors' batches. Every frame is valid, the corrupted ones are left out.
+    dict: the import report: 'frames', 'corrupted_frames' (headers with no tail where it should be, a frame cut short
+        at the end of the file included), 'skipped_bytes' (bytes outside frames, the newlines after them excluded)
+        and 'duration' (seconds covered by the frame slots).
+    '''
+    starts, corrupted = scan_legacy_capture(data)
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    # copies the frames out of a zero-copy view of every 30-byte window of the capture
+    if len(buffer) >= FRAME_SIZE:
+        frames = np.lib.stride_tricks.sliding_window_view(buffer, FRAME_SIZE)[starts]
+    else:
+        frames = np.zeros((0, FRAME_SIZE), dtype=np.uint8)
+    batch = decode_frames(frames.reshape(-1))
+    slots = np.searchsorted(np.sort(np.concatenate((starts, corrupted))), starts)
+    batch['timestamp'] = start_time + slots * frame_period
+    batch['valid'] = batch['header_ok'] & batch['tail_ok']
+    batch['frames'] = frames
+    frame_ends = starts + FRAME_SIZE
+    n_newlines = int((buffer[frame_ends[frame_ends < len(buffer)]] == ord('\n')).sum())
+    report = {
+        'frames': len(starts),
+        'corrupted_frames': len(corrupted),
+        'skipped_bytes': len(buffer) - len(starts) * FRAME_SIZE - n_newlines,
+        'duration': (len(starts) + len(corrupted)) * frame_period,
+    }
+    return batch, report
+
+
+def load_legacy_capture(path, start_time=None, frame_period=LEGACY_FRAME_PERIOD):
+    '''
+    Reads and decodes a legacy capture file, see import_legacy_capture().
+
+    Args:
+    path (str): the capture file, e.g. radar_data.bin.
+    start_time (float): the timestamp of the first frame. None to count back from the file's modification time,
+        since radar_watcher.py wrote the file once the capture was over.
+    frame_period (float): the time between two frames.
+    '''
+    data = np.fromfile(path, dtype=np.uint8)
+    if start_time is not None:
+        return import_legacy_capture(data, start_time, frame_period)
+    batch, report = import_legacy_capture(data, 0.0, frame_period)
+    batch['timestamp'] += os.path.getmtime(path) - report['duration']
+    return batch, report
+
+
+def legacy_capture_to_df(path, start_time=0.0, frame_period=LEGACY_FRAME_PERIOD):
+    '''
+    Loads a legacy capture into a DataFrame with the same columns as HLKLD2450RemoteSensor.get_long_queue_df().
+    start_time defaults to 0, as _try_file.py's timestamps; None counts back from the file's modification time.
+
+    Returns:
+    pd.DataFrame: the frames.
+    dict: the import report, see import_legacy_capture().
+    '''
+    batch, report = load_legacy_capture(path, start_time, frame_period)
+    # int64 columns, as HLKLD2450RemoteSensor.convert_batch_to_df()
+    df = pd.DataFrame(widen_targets(batch['targets']), columns=TARGET_COLUMNS)
+    df['timestamp'] = batch['timestamp']
+    return df, report
+
+
+def convert_legacy_capture(path, directory, sensor_name, start_time=None, frame_period=LEGACY_FRAME_PERIOD):
+    '''
+    Converts a legacy capture to a recording (see radar_recording.py), adding it to the recording in directory if
+    there is one. The frames have no sequence numbers.
+
+    Args:
+    path (str): the capture file.
+    directory (str): the recording directory.
+    sensor_name (str): the name to record the frames under.
+    start_time (float): the timestamp of the first frame, None to count back from the file's modification time.
+
+    Returns:
+    dict: the import report, see import_legacy_capture().
+    '''
+    batch, report = load_legacy_capture(path, start_time, frame_period)
+    recorder = RadarRecorder(directory, max_pending_records=max(len(batch['timestamp']), 1))
+    recorder.start()
+    recorder.record_batch(sensor_name, batch)
+    recorder.stop()
+    return report
@@ -0,0 +1,289 @@
+import os, queue, time
+from threading import Lock, Thread
+import numpy as np
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    # pyarrow is only needed for ParquetExporter
+    pa = None
+    pq = None
+try:
+    from hlkld2450_network_client.radar_frames import TARGET_COLUMNS, DISTANCE_RES_FIELD_INDICES, FRAME_SIZE, decode_frames
+    from hlkld2450_network_client.radar_recording import NO_SEQUENCE, RecordingReader
+except ImportError:
+    from radar_frames import TARGET_COLUMNS, DISTANCE_RES_FIELD_INDICES, FRAME_SIZE, decode_frames
+    from radar_recording import NO_SEQUENCE, RecordingReader
+
+DEFAULT_ROW_GROUP_ROWS = 1 << 16
+DEFAULT_FILE_ROWS = 1 << 22     # about 4 M rows, then the next file
+DEFAULT_MAX_ROW_GROUP_DELAY = 60    # seconds a row waits for its row group to fill before a smaller one is written
+DEFAULT_MAX_FILE_DURATION = 3600    # seconds a file stays open, so that a slow export still closes readable files
+DEFAULT_MAX_PENDING_ROWS = 1 << 20  # rows queued for the writer thread beyond this are dropped
+EXPORT_FILE_PREFIX = 'radar-'
+
+
+def export_schema(include_raw_frames=False):
+    '''
+    The schema of exported files: the timestamp, the sensor's name (dictionary encoded), the server's sequence number
+    (null if the server does not number its frames), then the targets as in get_long_queue_df() in int16, the
+    distance resolutions in uint16. With include_raw_frames, the raw 30-byte frames too.
+    '''
+    fields = [
+        pa.field('timestamp', pa.float64(), nullable=False),
+        pa.field('sensor', pa.dictionary(pa.int16(), pa.string()), nullable=False),
+        pa.field('sequence', pa.uint64()),
+    ]
+    for i, column_name in enumerate(TARGET_COLUMNS):
+        fields.append(pa.field(column_name, pa.uint16() if i in DISTANCE_RES_FIELD_INDICES else pa.int16(), nullable=False))
+    if include_raw_frames:
+        fields.append(pa.field('frame', pa.binary(FRAME_SIZE), nullable=False))
+    return pa.schema(fields, metadata={'timestamp': 'seconds since the epoch, client clock'})
+
+
+class ParquetExporter():
+    '''
+    Streams frames into rolling Parquet files in directory, with bounded memory however long the export runs.
+
+    export_batch() copies the valid frames of a batch and queues them, so that it can be a sensor's batch listener
+    (see HLKLD2450RemoteSensor.add_batch_listener()); export_recording() feeds frames from a recording. A writer thread
+    gathers the rows into row groups of row_group_rows, sorted by timestamp so that each row group's timestamp
+    statistics are tight and readers can skip the row groups outside a time range, and starts a new file every
+    file_rows rows. A file is readable once closed: when it is full, after max_file_duration, or on stop().
+
+    Memory holds at most max_pending_rows queued rows and one row group. Rows queued beyond that are dropped and counted.
+    '''
+    def __init__(self, directory, row_group_rows=DEFAULT_ROW_GROUP_ROWS, file_rows=DEFAULT_FILE_ROWS, compression='zstd',
+                 include_raw_frames=False, max_row_group_delay=DEFAULT_MAX_ROW_GROUP_DELAY, max_file_duration=DEFAULT_MAX_FILE_DURATION,
+                 max_pending_rows=DEFAULT_MAX_PENDING_ROWS):
+        if pa is None:
+            raise ImportError('ParquetExporter needs pyarrow (pip install pyarrow)')
+        self.directory = directory
+        self.row_group_rows = row_group_rows
+        self.file_rows = file_rows
+        self.compression = compression
+        self.include_raw_frames = include_raw_frames
+        self.max_row_group_delay = max_row_group_delay
+        self.max_file_duration = max_file_duration
+        self.max_pending_rows = max_pending_rows
+        self.schema = export_schema(include_raw_frames)
+        os.makedirs(directory, exist_ok=True)
+        # sensor name -> dictionary index, the dictionary growing as sensors appear
+        self.sensor_names = []
+        self.sensor_indices = {}
+        self.sensor_lock = Lock()
+        self.queue = queue.Queue()
+        self.pending_rows = 0
+        self.pending_lock = Lock()
+        self.thread = None
+        # the writer thread's state
+        self.parts = []     # column dicts of the row group being gathered
+        self.parts_rows = 0
+        self.parts_time = None  # when the row group's first rows were queued
+        self.writer = None
+        self.file_rows_written = 0
+        self.file_open_time = None
+        self.next_file_number = 0
+        # counters, see get_stats()
+        self.rows_written = 0
+        self.rows_dropped = 0
+        self.invalid_rows_skipped = 0
+        self.row_groups_written = 0
+        self.files_written = []
+
+    def sensor_index(self, name):
+        with self.sensor_lock:
+            index = self.sensor_indices.get(name)
+            if index is None:
+                index = len(self.sensor_names)
+                self.sensor_indices[name] = index
+                self.sensor_names.append(name)
+            return index
+
+    def export_batch(self, name, batch, first_sequence=None):
+        '''
+        Queues the valid frames of a batch. Has the signature of a batch listener, see HLKLD2450RemoteSensor.add_batch_listener().
+
+        Args:
+        name (str): the sensor's name.
+        batch (dict): 'timestamp', 'targets' and 'valid', and 'frames' if raw frames are exported. Copied, so views are fine.
+        first_sequence (int): the sequence number of the first frame, None if unknown.
+        '''
+        n = len(batch['timestamp'])
+        if first_sequence is None:
+            sequence = np.full(n, NO_SEQUENCE, dtype=np.uint64)
+        else:
+            sequence = np.arange(first_sequence, first_sequence + n, dtype=np.uint64)
+        self._queue_rows(batch, np.full(n, self.sensor_index(name), dtype=np.int16), sequence)
+
+    def export_records(self, records, sensor_names):
+        '''
+        Queues the valid frames of recording records, see radar_recording.RECORD_DTYPE.
+
+        Args:
+        records (np.ndarray): the records.
+        sensor_names (dict): the recording's sensor id -> name table.
+        '''
+        # the recording's sensor ids to this export's dictionary indices
+        sensor_ids = np.unique(records['sensor_id'])
+        index_of_id = np.zeros(int(sensor_ids.max()) + 1 if len(sensor_ids) else 1, dtype=np.int16)
+        for sensor_id in sensor_ids.tolist():
+            index_of_id[sensor_id] = self.sensor_index(sensor_names.get(sensor_id, str(sensor_id)))
+        batch = decode_frames(records['frame'])
+        batch['timestamp'] = records['timestamp']
+        batch['valid'] = batch['header_ok'] & batch['tail_ok']
+        if self.include_raw_frames:
+            batch['frames'] = np.ascontiguousarray(records['frame']).view(np.uint8).reshape(len(records), FRAME_SIZE)
+        self._queue_rows(batch, index_of_id[records['sensor_id']], records['sequence'])
+
+    def export_recording(self, directory, t_start=None, t_end=None, sensor=None, chunk_records=DEFAULT_ROW_GROUP_ROWS):
+        '''
+        Exports the frames of a recording in a time range (see RecordingReader.iter_records()), chunk_records at a time.
+        Waits for the writer when the queue is full instead of dropping rows. Returns the number of records read.
+        '''
+        reader = RecordingReader(directory)
+        n_records = 0
+        try:
+            for records in reader.iter_records(t_start, t_end, sensor):
+                for start in range(0, len(records), chunk_records):
+                    chunk = records[start:start + chunk_records]
+                    while not self._has_room(len(chunk)):
+                        time.sleep(0.01)
+                    self.export_records(chunk, reader.sensor_names)
+                    n_records += len(chunk)
+        finally:
+            reader.close()
+        return n_records
+
+    def _has_room(self, n_rows):
+        with self.pending_lock:
+            return self.pending_rows + n_rows <= self.max_pending_rows or self.pending_rows == 0
+
+    def _queue_rows(self, batch, sensor_index, sequence):
+        # copies the valid rows into the columns of the export, and queues them for the writer thread
+        valid = batch['valid']
+        n_valid = int(valid.sum())
+        with self.pending_lock:
+            self.invalid_rows_skipped += len(valid) - n_valid
+            if not n_valid:
+                return
+            if self.pending_rows + n_valid > self.max_pending_rows:
+                self.rows_dropped += n_valid
+                return
+            self.pending_rows += n_valid
+        all_valid = n_valid == len(valid)
+        rows = {
+            'timestamp': np.array(batch['timestamp'] if all_valid else batch['timestamp'][valid], dtype=np.float64),
+            'sensor': np.array(sensor_index if all_valid else sensor_index[valid], dtype=np.int16),
+            'sequence': np.array(sequence if all_valid else sequence[valid], dtype=np.uint64),
+            'targets': np.array(batch['targets'] if all_valid else batch['targets'][valid], dtype=np.int16),
+        }
+        if self.include_raw_frames:
+            rows['frame'] = np.array(batch['frames'] if all_valid else batch['frames'][valid], dtype=np.uint8)
+        self.queue.put((time.monotonic(), rows))
+
+    def start(self):
+        if self.thread is not None and self.thread.is_alive():
+            return
+        self.thread = Thread(target=self._run_writer, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        # writes the queued rows, then closes the file
+        if self.thread is None:
+            return
+        self.queue.put(None)
+        self.thread.join()
+        self.thread = None
+
+    def _run_writer(self):
+        while True:
+            try:
+                item = self.queue.get(timeout=1)
+            except queue.Empty:
+                item = False
+            if item is None:
+                break
+            if item:
+                queue_time, rows = item
+                if self.parts_time is None:
+                    self.parts_time = queue_time
+                self.parts.append(rows)
+                self.parts_rows += len(rows['timestamp'])
+                with self.pending_lock:
+                    self.pending_rows -= len(rows['timestamp'])
+            while self.parts_rows >= self.row_group_rows:
+                self._write_row_group(self.row_group_rows)
+            now = time.monotonic()
+            if self.parts_rows and now - self.parts_time >= self.max_row_group_delay:
+                self._write_row_group(self.parts_rows)
+            if self.writer is not None and now - self.file_open_time >= self.max_file_duration:
+                self._close_file()
+        if self.parts_rows:
+            self._write_row_group(self.parts_rows)
+        self._close_file()
+
+    def _take_rows(self, n_rows):
+        # the first n_rows gathered rows, as one column dict
+        rows = {name: np.concatenate([part[name] for part in self.parts]) for name in self.parts[0]}
+        taken = {name: column[:n_rows] for name, column in rows.items()}
+        remaining = len(rows['timestamp']) - n_rows
+        self.parts = [{name: column[n_rows:] for name, column in rows.items()}] if remaining else []
+        self.parts_rows = remaining
+        self.parts_time = time.monotonic() if remaining else None
+        return taken
+
+    def _write_row_group(self, n_rows):
+        rows = self._take_rows(n_rows)
+        order = np.argsort(rows['timestamp'], kind='stable')
+        targets = rows['targets'][order]
+        with self.sensor_lock:
+            sensor_names = pa.array(self.sensor_names, type=pa.string())
+        columns = [
+            pa.array(rows['timestamp'][order]),
+            pa.DictionaryArray.from_arrays(pa.array(rows['sensor'][order]), sensor_names),
+            pa.array(rows['sequence'][order], mask=rows['sequence'][order] == NO_SEQUENCE),
+        ]
+        for i in range(len(TARGET_COLUMNS)):
+            columns.append(pa.array(targets[:, i].view(np.uint16) if i in DISTANCE_RES_FIELD_INDICES else targets[:, i]))
+        if self.include_raw_frames:
+            frames = np.ascontiguousarray(rows['frame'][order])
+            columns.append(pa.FixedSizeBinaryArray.from_buffers(pa.binary(FRAME_SIZE), len(frames), [None, pa.py_buffer(frames)]))
+        table = pa.Table.from_arrays(columns, schema=self.schema)
+        if self.writer is None:
+            self._open_file()
+        self.writer.write_table(table, row_group_size=n_rows)
+        self.rows_written += n_rows
+        self.row_groups_written += 1
+        self.file_rows_written += n_rows
+        if self.file_rows_written >= self.file_rows:
+            self._close_file()
+
+    def _open_file(self):
+        # a new file, never one of an earlier export in the same directory
+        while True:
+            path = os.path.join(self.directory, f'{EXPORT_FILE_PREFIX}{self.next_file_number:06d}.parquet')
+            self.next_file_number += 1
+            if not os.path.exists(path):
+                break
+        self.writer = pq.ParquetWriter(path, self.schema, compression=self.compression, write_statistics=True)
+        self.file_rows_written = 0
+        self.file_open_time = time.monotonic()
+        self.files_written.append(path)
+
+    def _close_file(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+    def get_stats(self):
+        with self.pending_lock:
+            pending_rows = self.pending_rows
+        return {
+            'rows_written': self.rows_written,
+            'rows_dropped': self.rows_dropped,
+            'rows_pending': pending_rows + self.parts_rows,
+            'invalid_rows_skipped': self.invalid_rows_skipped,
+            'row_groups_written': self.row_groups_written,
+            'files_written': len(self.files_written),
+        }
@@ -0,0 +1,192 @@
+import heapq, itertools, time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Condition, Lock, Thread
+try:
+    from hlkld2450_network_client.hlkld2450 import HLKLD2450RemoteSensor
+except ImportError:
+    from hlkld2450 import HLKLD2450RemoteSensor
+
+
+class RadarFleet():
+    '''
+    Owns many HLKLD2450RemoteSensor instances and polls them from a fixed pool of worker threads,
+    instead of one thread per sensor. Thread count stays at max_workers + 1 however many sensors are added.
+
+    A scheduler thread keeps a heap of poll due times. Each due poll runs one HLKLD2450RemoteSensor.poll_once()
+    step on a worker, and the sensor is rescheduled when that step completes, so a sensor never has two polls
+    in flight. Initial polls are staggered over one loop_hold_time to avoid bursts.
+    '''
+    def __init__(self, max_workers=8, loop_hold_time=0.5):
+        self.max_workers = max_workers
+        self.loop_hold_time = loop_hold_time
+        self.sensors = {}   # sensor name -> sensor
+        self._schedule = []  # heap of (due time, tie breaker, sensor name)
+        self._schedule_counter = itertools.count()
+        self._schedule_condition = Condition()
+        self._n_submitted = 0   # polls handed to the workers and not started yet, counted under _schedule_condition
+        self.running = False
+        self.scheduler_thread = None
+        self.executor = None
+        # fleet-wide counters, see get_stats()
+        self.stats_lock = Lock()
+        self._polls = 0
+        self._frames = 0
+        self._total_lag = 0.0
+        self._max_lag = 0.0
+        self._stats_time = time.monotonic()
+
+    def add_sensor(self, sensor, name=None):
+        '''
+        Adds a sensor to the fleet. If the fleet is running, its first poll is scheduled within one loop_hold_time.
+
+        Args:
+        sensor (HLKLD2450RemoteSensor): the sensor.
+        name (str): a unique name for the sensor in the fleet, sensor.name by default.
+        '''
+        if name is None:
+            name = sensor.name
+        with self._schedule_condition:
+            if name in self.sensors:
+                raise ValueError(f'a sensor named {name} is already in the fleet')
+            self.sensors[name] = sensor
+            if self.running:
+                self._schedule_poll(name, time.monotonic() + self._stagger_offset(len(self.sensors) - 1))
+
+    def add_remote_sensor(self, hostname:str, port:int, name=None, **sensor_kwargs):
+        # creates an HLKLD2450RemoteSensor and adds it
+        sensor = HLKLD2450RemoteSensor(hostname, port, **sensor_kwargs)
+        self.add_sensor(sensor, name)
+        return sensor
+
+    def remove_sensor(self, name):
+        # the sensor is dropped from the schedule the next time it comes due
+        with self._schedule_condition:
+            sensor = self.sensors.pop(name)
+        sensor.client.close()
+        return sensor
+
+    def get_sensor(self, name):
+        return self.sensors[name]
+
+    def _stagger_offset(self, i):
+        # spreads the sensors' polls evenly over one loop_hold_time
+        n_sensors = max(len(self.sensors), 1)
+        return self.loop_hold_time * (i % n_sensors) / n_sensors
+
+    def _schedule_poll(self, name, due_time):
+        # must be called with _schedule_condition held
+        heapq.heappush(self._schedule, (due_time, next(self._schedule_counter), name))
+        self._schedule_condition.notify()
+
+    def start(self):
+        '''
+        Starts the scheduler thread and the worker pool.
+        '''
+        with self._schedule_condition:
+            if self.running:
+                return
+            self.running = True
+            self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='RadarFleet')
+            now = time.monotonic()
+            for i, name in enumerate(self.sensors):
+                self._schedule_poll(name, now + self._stagger_offset(i))
+        self.scheduler_thread = Thread(target=self._run_scheduler, daemon=True)
+        self.scheduler_thread.start()
+
+    def stop(self):
+        '''
+        Stops polling, waits for the polls in flight and closes the sensors' connections.
+        '''
+        with self._schedule_condition:
+            if not self.running:
+                return
+            self.running = False
+            self._schedule.clear()
+            self._schedule_condition.notify()
+        self.scheduler_thread.join()
+        self.executor.shutdown(wait=True)
+        self.executor = None
+        for sensor in list(self.sensors.values()):
+            sensor.client.close()
+
+    def _run_scheduler(self):
+        while True:
+            with self._schedule_condition:
+                while self.running and (not self._schedule or self._schedule[0][0] > time.monotonic()):
+                    timeout = self._schedule[0][0] - time.monotonic() if self._schedule else None
+                    self._schedule_condition.wait(timeout)
+                if not self.running:
+                    return
+                due_time, _, name = heapq.heappop(self._schedule)
+                sensor = self.sensors.get(name)
+                if sensor is not None:
+                    self._n_submitted += 1
+            if sensor is not None:
+                self.executor.submit(self._poll_sensor, name, sensor, due_time)
+
+    def _poll_sensor(self, name, sensor, due_time):
+        # runs on a worker: one poll step, then reschedule the sensor
+        with self._schedule_condition:
+            self._n_submitted -= 1
+        start_time = time.monotonic()
+        rows_before = sensor.data_buffer.total_written
+        try:
+            wait_time = sensor.poll_once(self.loop_hold_time)
+        except Exception as e:
+            print(f'An unusual exception occurred while polling {name}: {e}')
+            sensor._connected = False
+            wait_time = 1
+        end_time = time.monotonic()
+        lag = start_time - due_time
+        with self.stats_lock:
+            self._polls += 1
+            self._frames += sensor.data_buffer.total_written - rows_before
+            self._total_lag += lag
+            self._max_lag = max(self._max_lag, lag)
+        # keep the sensor's phase in the stagger, unless the poll itself took longer than the wait
+        next_due_time = max(due_time + wait_time, end_time) if wait_time > 0 else end_time
+        with self._schedule_condition:
+            if self.running and self.sensors.get(name) is sensor:
+                self._schedule_poll(name, next_due_time)
+
+    def get_stats(self, reset=True):
+        '''
+        Returns fleet-wide throughput and lag since the previous call (or since the fleet was created).
+
+        Args:
+        reset (bool): if True, the next call reports from now on.
+
+        Returns:
+        dict: n_sensors, n_connected (sensors in their read data step), polls_per_second, frames_per_second,
+            mean_lag and max_lag (seconds between a poll's due time and its start on a worker),
+            n_overdue (polls due but not yet started: still in the schedule, or waiting for a free worker) and
+            n_threads (the scheduler plus the worker threads the pool started so far).
+        '''
+        now = time.monotonic()
+        with self._schedule_condition:
+            n_overdue = sum(1 for due_time, _, _ in self._schedule if due_time <= now) + self._n_submitted
+            sensors = list(self.sensors.values())
+            # the pool starts its threads as work comes in, up to max_workers
+            executor = self.executor
+            n_threads = len(executor._threads) if executor is not None else 0
+            if self.scheduler_thread is not None and self.scheduler_thread.is_alive():
+                n_threads += 1
+        with self.stats_lock:
+            elapsed = max(now - self._stats_time, 1e-9)
+            stats = {
+                'n_sensors': len(sensors),
+                'n_connected': sum(1 for sensor in sensors if sensor._connected),
+                'polls_per_second': self._polls / elapsed,
+                'frames_per_second': self._frames / elapsed,
+                'mean_lag': self._total_lag / self._polls if self._polls else None,
+                'max_lag': self._max_lag,
+                'n_overdue': n_overdue,
+                'n_threads': n_threads,
+            }
+            if reset:
+                self._polls = 0
+                self._frames = 0
+                self._total_lag = 0.0
+                self._max_lag = 0.0
+                self._stats_time = now
+        return stats
@@ -0,0 +1,216 @@
+import numpy as np
+
+# HLK-LD2450 basic mode report frame (see docs 2.3): 4-byte header, 3 targets of 4 little-endian words, 2-byte tail
+REPORT_HEADER = bytes.fromhex('AA FF 03 00')
+REPORT_TAIL = bytes.fromhex('55 CC')
+FRAME_SIZE = 30
+N_TARGET_FIELDS = 12
+
+# the header and tail read as little-endian integers, for comparing whole columns at once
+REPORT_HEADER_WORD = int.from_bytes(REPORT_HEADER, 'little')
+REPORT_TAIL_WORD = int.from_bytes(REPORT_TAIL, 'little')
+
+# same column names and order as HLKLD2450RemoteSensor.convert_queue_to_df()
+TARGET_COLUMNS = [
+    'target1_x',
+    'target1_y',
+    'target1_speed',
+    'target1_distance_res',
+    'target2_x',
+    'target2_y',
+    'target2_speed',
+    'target2_distance_res',
+    'target3_x',
+    'target3_y',
+    'target3_speed',
+    'target3_distance_res',
+]
+# x, y and speed use the LD2450 sign-bit encoding, the distance resolution is unsigned
+DISTANCE_RES_FIELD_INDICES = [i for i in range(N_TARGET_FIELDS) if i % 4 == 3]
+
+# a single raw report frame
+FRAME_DTYPE = np.dtype([
+    ('header', '<u4'),
+    ('targets', '<u2', (N_TARGET_FIELDS,)),
+    ('tail', '<u2'),
+])
+# a single element of a 'get' payload, as packed by the server with struct format 'd30s'
+WIRE_FRAME_DTYPE = np.dtype([
+    ('timestamp', '<f8'),
+    ('frame', FRAME_DTYPE),
+])
+WIRE_FRAME_SIZE = WIRE_FRAME_DTYPE.itemsize
+FINAL_TIMESTAMP_SIZE = 8    # the server appends its serialization timestamp to every 'get' payload
+
+
+def decode_targets(raw_targets):
+    '''
+    Applies the LD2450 sign-bit encoding to raw target words, for any number of frames at once.
+    Matches serial_protocol.read_radar_data(): a set highest bit means a negative value.
+
+    Args:
+    raw_targets (np.ndarray): uint16 array of shape (n, 12), the raw target words.
+
+    Returns:
+    np.ndarray: int16 array of shape (n, 12). The unsigned distance resolution words are kept bit-for-bit,
+        use target_columns() to read them back as uint16.
+    '''
+    raw_targets = np.asarray(raw_targets, dtype=np.uint16)
+    magnitude = (raw_targets & 0x7FFF).view(np.int16)
+    targets = np.where(raw_targets >= 0x8000, -magnitude, magnitude)
+    targets[:, DISTANCE_RES_FIELD_INDICES] = raw_targets[:, DISTANCE_RES_FIELD_INDICES].view(np.int16)
+    return targets
+
+
+def target_columns(targets):
+    '''
+    Splits a decoded target matrix into named columns, without copying.
+
+    Args:
+    targets (np.ndarray): int16 array of shape (n, 12), as returned by decode_targets().
+
+    Returns:
+    dict: column name -> array view. The distance resolution columns are uint16, the others int16.
+    '''
+    columns = {}
+    for i, column_name in enumerate(TARGET_COLUMNS):
+        if i in DISTANCE_RES_FIELD_INDICES:
+            columns[column_name] = targets[:, i].view(np.uint16)
+        else:
+            columns[column_name] = targets[:, i]
+    return columns
+
+
+def widen_targets(targets):
+    '''
+    Converts a decoded target matrix to int64, reading the distance resolution words as unsigned.
+
+    Args:
+    targets (np.ndarray): int16 array of shape (n, 12), as returned by decode_targets().
+
+    Returns:
+    np.ndarray: int64 array of shape (n, 12), in TARGET_COLUMNS order.
+    '''
+    wide_targets = targets.astype(np.int64)
+    wide_targets[:, DISTANCE_RES_FIELD_INDICES] = targets[:, DISTANCE_RES_FIELD_INDICES].view(np.uint16)
+    return wide_targets
+
+
+def decode_frames(frames):
+    '''
+    Decodes raw 30-byte report frames in one vectorized pass.
+
+    Args:
+    frames (bytes-like or np.ndarray): concatenated frames, or a FRAME_DTYPE array.
+
+    Returns:
+    dict: 'targets' (int16 array of shape (n, 12)), 'header_ok' and 'tail_ok' (bool arrays of shape (n,)).
+    '''
+    if not isinstance(frames, np.ndarray) or frames.dtype != FRAME_DTYPE:
+        frames = np.frombuffer(frames, dtype=FRAME_DTYPE)
+    return {
+        'targets': decode_targets(frames['targets']),
+        'header_ok': frames['header'] == REPORT_HEADER_WORD,
+        'tail_ok': frames['tail'] == REPORT_TAIL_WORD,
+    }
+
+
+def get_payload_frame_count(payload_size):
+    # number of whole frames in a 'get' payload of the given size
+    return max(0, (payload_size - FINAL_TIMESTAMP_SIZE) // WIRE_FRAME_SIZE)
+
+
+def decode_get_payload(payload, receive_timestamp):
+    '''
+    Decodes a whole 'get' response payload in one pass, with no per-frame Python loop.
+    Frame timestamps are shifted from the server's clock to the client's, using the server's final
+    serialization timestamp and the client's receive timestamp (as in HLKLD2450RemoteSensor.deserialize_data()).
+
+    Args:
+    payload (bytes-like): the response to 'get': n times (double timestamp, 30-byte frame), then a final double timestamp.
+    receive_timestamp (float): the client time at which the payload was received.
+
+    Returns:
+    dict: 'timestamp' (float64 array), 'targets', 'header_ok' and 'tail_ok' as in decode_frames(), and 'frames',
+        a uint8 array of shape (n, 30) holding the raw frames. 'frames' is a view into payload, copy it before reusing the buffer.
+    float: the final timestamp, in client time.
+    '''
+    n = get_payload_frame_count(len(payload))
+    records = np.frombuffer(payload, dtype=WIRE_FRAME_DTYPE, count=n)
+    final_timestamp = float(np.frombuffer(payload, dtype='<f8', count=1, offset=n * WIRE_FRAME_SIZE)[0])
+    timestamp_additive_offset = receive_timestamp - final_timestamp
+    batch = decode_frames(records['frame'])
+    batch['timestamp'] = records['timestamp'] + timestamp_additive_offset
+    batch['frames'] = np.frombuffer(payload, dtype=np.uint8, count=n * WIRE_FRAME_SIZE).reshape(n, WIRE_FRAME_SIZE)[:, FINAL_TIMESTAMP_SIZE:]
+    return batch, final_timestamp + timestamp_additive_offset
+
+
+# compact 'get' payload, negotiated per connection (wire_protocol.FLAG_COMPACT). Encoded by the server's frame_protocol.encode_frames_compact():
+# a header with the base and final timestamps and the number of runs and escaped timestamps, then the escaped timestamps,
+# one millisecond time delta per frame, the lengths of alternating runs of non-empty and empty frames (non-empty first),
+# and the 24 target bytes of each non-empty frame. Frame headers and tails are not sent
+COMPACT_HEADER_DTYPE = np.dtype([
+    ('base_timestamp', '<f8'),
+    ('final_timestamp', '<f8'),
+    ('n_runs', '<u2'),
+    ('n_escapes', '<u2'),
+])
+COMPACT_HEADER_SIZE = COMPACT_HEADER_DTYPE.itemsize
+COMPACT_DELTA_ESCAPE = 0xFFFF   # the frame's timestamp is the next escaped timestamp
+TARGETS_SIZE = 2 * N_TARGET_FIELDS
+
+
+def get_compact_payload_min_size(frame_count):
+    # the size of a compact 'get' payload holding frame_count empty frames: a run of 0 non-empty frames, then a single empty run.
+    # Without frames, the payload has a single run of length 0
+    return COMPACT_HEADER_SIZE + 2 * frame_count + (4 if frame_count else 2)
+
+
+def decode_compact_get_payload(payload, receive_timestamp, frame_count):
+    '''
+    Decodes a compact 'get' response payload, as decode_get_payload(). The raw frames are rebuilt with their header and tail.
+
+    Args:
+    payload (bytes-like): the compact response to 'get'.
+    receive_timestamp (float): the client time at which the payload was received.
+    frame_count (int): the number of frames, from the response header.
+
+    Returns:
+    dict, float: as decode_get_payload(). 'frames' is a new array, not a view into payload.
+    '''
+    header = np.frombuffer(payload, dtype=COMPACT_HEADER_DTYPE, count=1)[0]
+    n_runs = int(header['n_runs'])
+    n_escapes = int(header['n_escapes'])
+    offset = COMPACT_HEADER_SIZE
+    escaped_timestamps = np.frombuffer(payload, dtype='<f8', count=n_escapes, offset=offset)
+    offset += 8 * n_escapes
+    deltas = np.frombuffer(payload, dtype='<u2', count=frame_count, offset=offset)
+    offset += 2 * frame_count
+    runs = np.frombuffer(payload, dtype='<u2', count=n_runs, offset=offset)
+    offset += 2 * n_runs
+    non_empty = np.repeat(np.arange(n_runs) % 2 == 0, runs)
+    n_non_empty = int(np.count_nonzero(non_empty))
+    if len(non_empty) != frame_count or len(payload) != offset + TARGETS_SIZE * n_non_empty:
+        raise ValueError(f'compact payload of {len(payload)} bytes does not hold {frame_count} frames')
+
+    # timestamps: running sums of the deltas, restarted at every escaped timestamp
+    escaped = deltas == COMPACT_DELTA_ESCAPE
+    if np.count_nonzero(escaped) != n_escapes:
+        raise ValueError('compact payload escapes do not match its header')
+    elapsed = np.cumsum(np.where(escaped, 0, deltas) / 1000)
+    segment = np.cumsum(escaped)
+    segment_starts = np.concatenate(([header['base_timestamp']], escaped_timestamps))
+    segment_elapsed = np.concatenate(([0.0], elapsed[escaped]))
+    timestamps = segment_starts[segment] + elapsed - segment_elapsed[segment]
+
+    frames = np.zeros((frame_count, FRAME_SIZE), dtype=np.uint8)
+    frames[:, :4] = np.frombuffer(REPORT_HEADER, dtype=np.uint8)
+    frames[:, FRAME_SIZE - 2:] = np.frombuffer(REPORT_TAIL, dtype=np.uint8)
+    frames[non_empty, 4:4 + TARGETS_SIZE] = np.frombuffer(payload, dtype=np.uint8, count=TARGETS_SIZE * n_non_empty, offset=offset).reshape(n_non_empty, TARGETS_SIZE)
+
+    final_timestamp = float(header['final_timestamp'])
+    timestamp_additive_offset = receive_timestamp - final_timestamp
+    batch = decode_frames(frames.view(FRAME_DTYPE)[:, 0])
+    batch['timestamp'] = timestamps + timestamp_additive_offset
+    batch['frames'] = frames
+    return batch, final_timestamp + timestamp_additive_offset
@@ -0,0 +1,75 @@
+from threading import Lock
+import numpy as np
+import pandas as pd
+try:
+    from hlkld2450_network_client.radar_frames import N_TARGET_FIELDS, TARGET_COLUMNS, widen_targets
+except ImportError:
+    from radar_frames import N_TARGET_FIELDS, TARGET_COLUMNS, widen_targets
+
+
+class IncrementalDataFrameMaterializer():
+    '''
+    Keeps the history of a RadarRingBuffer as cached, DataFrame-ready columns, so that building the
+    DataFrame only converts the rows written since the previous call and trims the rows evicted since then.
+
+    The cached columns hold up to capacity rows in a slightly larger array. New rows are appended at the end,
+    and the live rows are moved to the start of new arrays whenever the end is reached. Rows are never
+    written twice in the same arrays, so DataFrames returned by to_df() are not changed by later updates.
+    '''
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._size = capacity + max(capacity // 2, 1)
+        self._targets, self._timestamps, self._rows = self._allocate()
+        self._start = 0
+        self._stop = 0
+        self.next_row = 0   # absolute row number of the first row not yet converted
+        self.lock = Lock()  # held by the owner for a whole read-and-update cycle
+
+    def _allocate(self):
+        # empty columns: the targets, the timestamps and the absolute row number of each cached row
+        return (np.empty((self._size, N_TARGET_FIELDS), dtype=np.int64), np.empty(self._size, dtype=np.float64),
+                np.empty(self._size, dtype=np.int64))
+
+    def __len__(self):
+        return self._stop - self._start
+
+    def update(self, new_rows, start_row, oldest_row):
+        '''
+        Adds the rows written to the ring buffer since the previous call and drops the rows it no longer holds.
+
+        Args:
+        new_rows (dict): the ring buffer's rows from start_row on, as returned by RadarRingBuffer.read().
+        start_row (int): the absolute row number of the first row in new_rows.
+        oldest_row (int): the oldest row still held by the ring buffer.
+        '''
+        # trim rows that were overwritten or cleared in the ring buffer
+        self._start += int(np.searchsorted(self._rows[self._start:self._stop], oldest_row))
+        valid = new_rows['valid']
+        n_new = len(valid)
+        rows = np.arange(start_row, start_row + n_new, dtype=np.int64)[valid]
+        n_valid = len(rows)
+        if self._stop + n_valid > self._size:
+            # move the live rows to the start of new arrays, this happens at most once per capacity // 2 new rows.
+            # The old arrays are left as they are for the DataFrames built over them
+            n_live = self._stop - self._start
+            columns = self._allocate()
+            for column, old_column in zip(columns, (self._targets, self._timestamps, self._rows)):
+                column[:n_live] = old_column[self._start:self._stop]
+            self._targets, self._timestamps, self._rows = columns
+            self._start = 0
+            self._stop = n_live
+        self._targets[self._stop:self._stop + n_valid] = widen_targets(new_rows['targets'][valid])
+        self._timestamps[self._stop:self._stop + n_valid] = new_rows['timestamp'][valid]
+        self._rows[self._stop:self._stop + n_valid] = rows
+        self._stop += n_valid
+        self.next_row = start_row + n_new
+
+    def to_df(self):
+        '''
+        Returns the cached rows as a DataFrame with the same columns as HLKLD2450RemoteSensor.convert_queue_to_df().
+        The target columns share memory with the cache: later updates leave them unchanged, but changing the DataFrame
+        in place changes the cache, so treat it as read-only or rely on pandas copy-on-write.
+        '''
+        df = pd.DataFrame(self._targets[self._start:self._stop], columns=TARGET_COLUMNS, copy=False)
+        df['timestamp'] = self._timestamps[self._start:self._stop]
+        return df
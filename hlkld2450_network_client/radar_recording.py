@@ -0,0 +1,475 @@
+import json, mmap, os, queue, struct, time
+from threading import Lock, Thread
+import numpy as np
+try:
+    from hlkld2450_network_client.radar_frames import FRAME_DTYPE, FRAME_SIZE, decode_frames
+except ImportError:
+    from radar_frames import FRAME_DTYPE, FRAME_SIZE, decode_frames
+
+# a recording is a directory of append-only segment files, each with a sparse time index next to it, and a sensor table.
+# A segment is a header, then fixed-size records. Its index gets an entry every index_interval records: the block's first
+# record and its smallest and largest timestamps. Records are in arrival order, so timestamps are only roughly sorted
+# (sensors' batches interleave), which the min/max blocks allow for
+RECORDING_MAGIC = b'LD2450RC'
+RECORDING_VERSION = 1
+SEGMENT_HEADER_FORMAT = '<8sHHIQd'  # magic, version, record size, index interval, segment number, creation time
+SEGMENT_HEADER_SIZE = 64    # the header is padded with zeros
+RECORD_DTYPE = np.dtype([
+    ('timestamp', '<f8'),
+    ('sequence', '<u8'),    # the server's sequence number of the frame, NO_SEQUENCE if it does not number its frames
+    ('sensor_id', '<u2'),   # see the sensor table, RadarRecorder.sensor_id()
+    ('frame', FRAME_DTYPE),     # the raw 30-byte report frame
+])
+RECORD_SIZE = RECORD_DTYPE.itemsize     # 48 bytes
+INDEX_ENTRY_DTYPE = np.dtype([
+    ('first_record', '<u8'),
+    ('min_timestamp', '<f8'),
+    ('max_timestamp', '<f8'),
+])
+NO_SEQUENCE = 0xFFFFFFFFFFFFFFFF
+SEGMENT_SUFFIX = '.ldrec'
+INDEX_SUFFIX = '.ldidx'
+SENSOR_TABLE_FILE = 'sensors.json'
+DEFAULT_SEGMENT_RECORDS = 1 << 20   # 48 MiB segments
+DEFAULT_INDEX_INTERVAL = 1024
+DEFAULT_MAX_PENDING_RECORDS = 1 << 20   # records queued for the writer thread beyond this are dropped
+
+
+def segment_path(directory, segment_number):
+    return os.path.join(directory, f'segment-{segment_number:08d}{SEGMENT_SUFFIX}')
+
+
+def list_segment_numbers(directory):
+    # the numbers of the segments in a recording directory, in order
+    segment_numbers = []
+    for file_name in os.listdir(directory):
+        if file_name.startswith('segment-') and file_name.endswith(SEGMENT_SUFFIX):
+            try:
+                segment_numbers.append(int(file_name[len('segment-'):-len(SEGMENT_SUFFIX)]))
+            except ValueError:
+                pass
+    return sorted(segment_numbers)
+
+
+def pack_segment_header(segment_number, index_interval, creation_time):
+    header = struct.pack(SEGMENT_HEADER_FORMAT, RECORDING_MAGIC, RECORDING_VERSION, RECORD_SIZE, index_interval, segment_number, creation_time)
+    return header + bytes(SEGMENT_HEADER_SIZE - len(header))
+
+
+def make_records(timestamps, frames, sensor_id, first_sequence=None):
+    '''
+    Builds records from a batch of frames.
+
+    Args:
+    timestamps (np.ndarray): the frames' timestamps.
+    frames (np.ndarray or bytes-like): the raw frames, a uint8 array of shape (n, 30) or their concatenation.
+    sensor_id (int): the sensor's id in the recording.
+    first_sequence (int): the sequence number of the first frame, the others following. None if unknown.
+
+    Returns:
+    np.ndarray: a RECORD_DTYPE array, a copy of the batch.
+    '''
+    n = len(timestamps)
+    records = np.empty(n, dtype=RECORD_DTYPE)
+    records['timestamp'] = timestamps
+    if first_sequence is None:
+        records['sequence'] = NO_SEQUENCE
+    else:
+        records['sequence'] = np.arange(first_sequence, first_sequence + n, dtype=np.uint64)
+    records['sensor_id'] = sensor_id
+    if not isinstance(frames, np.ndarray):
+        frames = np.frombuffer(frames, dtype=np.uint8)
+    records['frame'] = np.ascontiguousarray(frames, dtype=np.uint8).reshape(n * FRAME_SIZE).view(FRAME_DTYPE)
+    return records
+
+
+def decode_records(records):
+    '''
+    Decodes records in one vectorized pass.
+
+    Returns:
+    dict: 'timestamp', 'sensor_id', 'sequence', 'targets' (int16 array of shape (n, 12)) and 'valid', as in the
+        sensors' data buffers.
+    '''
+    batch = decode_frames(records['frame'])
+    return {
+        'timestamp': records['timestamp'],
+        'sensor_id': records['sensor_id'],
+        'sequence': records['sequence'],
+        'targets': batch['targets'],
+        'valid': batch['header_ok'] & batch['tail_ok'],
+    }
+
+
+def load_sensor_table(directory):
+    # sensor id -> sensor name
+    try:
+        with open(os.path.join(directory, SENSOR_TABLE_FILE)) as f:
+            return {int(sensor_id): name for sensor_id, name in json.load(f).items()}
+    except FileNotFoundError:
+        return {}
+
+
+class RadarRecorder():
+    '''
+    Records frames to a directory, from a background thread: record_batch() only copies the batch into records and
+    queues them, so that it can be called from a sensor loop (see HLKLD2450RemoteSensor.add_batch_listener()).
+
+    The writer thread appends records to the current segment file, and an index entry every index_interval records.
+    A segment holds segment_records records, then the next one is started. Every run starts a new segment, so a
+    segment cut short by a crash is never appended to. Records queued beyond max_pending_records are dropped and
+    counted, rather than letting a slow disk hold the sensors' loops.
+    '''
+    def __init__(self, directory, segment_records=DEFAULT_SEGMENT_RECORDS, index_interval=DEFAULT_INDEX_INTERVAL, max_pending_records=DEFAULT_MAX_PENDING_RECORDS):
+        self.directory = directory
+        self.segment_records = segment_records
+        self.index_interval = index_interval
+        self.max_pending_records = max_pending_records
+        os.makedirs(directory, exist_ok=True)
+        # sensor name -> id, persisted in the sensor table
+        self.sensor_ids = {name: sensor_id for sensor_id, name in load_sensor_table(directory).items()}
+        self.sensor_ids_lock = Lock()
+        self.queue = queue.Queue()
+        self.pending_records = 0
+        self.pending_lock = Lock()
+        self.thread = None
+        # the segment being written, see _open_segment()
+        segment_numbers = list_segment_numbers(directory)
+        self.next_segment_number = segment_numbers[-1] + 1 if segment_numbers else 0
+        self.segment_file = None
+        self.index_file = None
+        self.segment_n_records = 0
+        self.block_min_timestamp = np.inf
+        self.block_max_timestamp = -np.inf
+        # counters, see get_stats()
+        self.records_written = 0
+        self.records_dropped = 0
+        self.segments_written = 0
+        self.write_calls = 0
+
+    def sensor_id(self, name):
+        # the sensor's id in this recording, a new one if the name is new
+        with self.sensor_ids_lock:
+            sensor_id = self.sensor_ids.get(name)
+            if sensor_id is None:
+                sensor_id = len(self.sensor_ids)
+                self.sensor_ids[name] = sensor_id
+                # written whole then renamed, so that a reader never sees half a table
+                table_path = os.path.join(self.directory, SENSOR_TABLE_FILE)
+                with open(table_path + '.tmp', 'w') as f:
+                    json.dump({str(sensor_id): name for name, sensor_id in self.sensor_ids.items()}, f)
+                os.replace(table_path + '.tmp', table_path)
+            return sensor_id
+
+    def record_batch(self, name, batch, first_sequence=None):
+        '''
+        Queues a batch of frames for writing. Has the signature of a batch listener, see HLKLD2450RemoteSensor.add_batch_listener().
+
+        Args:
+        name (str): the sensor's name.
+        batch (dict): at least 'timestamp' and 'frames' (uint8 array of shape (n, 30)). Copied, so views are fine.
+        first_sequence (int): the sequence number of the first frame, None if unknown.
+        '''
+        if len(batch['timestamp']):
+            self.record(make_records(batch['timestamp'], batch['frames'], self.sensor_id(name), first_sequence))
+
+    def record(self, records):
+        # queues a RECORD_DTYPE array for writing, the writer owns it from now on
+        with self.pending_lock:
+            if self.pending_records + len(records) > self.max_pending_records:
+                self.records_dropped += len(records)
+                return False
+            self.pending_records += len(records)
+        self.queue.put(records)
+        return True
+
+    def start(self):
+        if self.thread is not None and self.thread.is_alive():
+            return
+        self.thread = Thread(target=self._run_writer, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        # writes the queued records, then closes the files
+        if self.thread is None:
+            return
+        self.queue.put(None)
+        self.thread.join()
+        self.thread = None
+
+    def _run_writer(self):
+        running = True
+        while running:
+            records = [self.queue.get()]
+            # take everything queued meanwhile, to write it in one call
+            while True:
+                try:
+                    records.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if any(part is None for part in records):
+                # stop() was called: write what came before
+                running = False
+                records = records[:[part is None for part in records].index(True)]
+            if records:
+                records = records[0] if len(records) == 1 else np.concatenate(records)
+                self._write(records)
+                with self.pending_lock:
+                    self.pending_records -= len(records)
+        self._close_segment()
+
+    def _write(self, records):
+        # appends the records, starting new segments as they fill up, then flushes so that readers see them
+        start = 0
+        while start < len(records):
+            if self.segment_file is None or self.segment_n_records == self.segment_records:
+                self._open_segment()
+            stop = min(len(records), start + self.segment_records - self.segment_n_records)
+            self.segment_file.write(records[start:stop].tobytes())
+            self.write_calls += 1
+            self._index(records['timestamp'][start:stop])
+            self.segment_n_records += stop - start
+            self.records_written += stop - start
+            start = stop
+        self.segment_file.flush()
+        self.index_file.flush()
+
+    def _index(self, timestamps):
+        # adds an index entry for every block of index_interval records completed by these timestamps
+        position = self.segment_n_records
+        i = 0
+        while i < len(timestamps):
+            block_stop = (position // self.index_interval + 1) * self.index_interval
+            n = min(len(timestamps) - i, block_stop - position)
+            self.block_min_timestamp = min(self.block_min_timestamp, float(timestamps[i:i + n].min()))
+            self.block_max_timestamp = max(self.block_max_timestamp, float(timestamps[i:i + n].max()))
+            position += n
+            i += n
+            if position == block_stop:
+                entry = np.array([(block_stop - self.index_interval, self.block_min_timestamp, self.block_max_timestamp)], dtype=INDEX_ENTRY_DTYPE)
+                self.index_file.write(entry.tobytes())
+                self.block_min_timestamp = np.inf
+                self.block_max_timestamp = -np.inf
+
+    def _open_segment(self):
+        self._close_segment()
+        path = segment_path(self.directory, self.next_segment_number)
+        self.segment_file = open(path, 'xb')
+        self.segment_file.write(pack_segment_header(self.next_segment_number, self.index_interval, time.time()))
+        self.index_file = open(path[:-len(SEGMENT_SUFFIX)] + INDEX_SUFFIX, 'xb')
+        self.next_segment_number += 1
+        self.segments_written += 1
+        self.segment_n_records = 0
+        self.block_min_timestamp = np.inf
+        self.block_max_timestamp = -np.inf
+
+    def _close_segment(self):
+        # the last block of a segment is not indexed, readers index it themselves
+        if self.segment_file is not None:
+            self.segment_file.close()
+            self.index_file.close()
+            self.segment_file = None
+            self.index_file = None
+
+    def get_stats(self):
+        with self.pending_lock:
+            pending_records = self.pending_records
+        return {
+            'records_written': self.records_written,
+            'records_dropped': self.records_dropped,
+            'records_pending': pending_records,
+            'segments_written': self.segments_written,
+            'write_calls': self.write_calls,
+            'bytes_written': self.records_written * RECORD_SIZE,
+        }
+
+
+class RecordingSegment():
+    '''
+    A segment file mapped into memory, its records a zero-copy RECORD_DTYPE array. A segment still being written can be
+    opened: the records written so far are mapped, a partly written last record is left out.
+
+    seek() finds where the records in a time range are in O(log n), with the segment's index: the result is a range
+    of records that holds every record in the time range, and as few others as the index blocks allow.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.map = None
+        with open(path, 'rb') as f:
+            header = f.read(SEGMENT_HEADER_SIZE)
+            if len(header) < SEGMENT_HEADER_SIZE:
+                raise ValueError(f'{path}: segment header cut short')
+            magic, version, record_size, self.index_interval, self.segment_number, self.creation_time = struct.unpack_from(SEGMENT_HEADER_FORMAT, header)
+            if magic != RECORDING_MAGIC or version != RECORDING_VERSION or record_size != RECORD_SIZE:
+                raise ValueError(f'{path}: not a version {RECORDING_VERSION} recording segment')
+            n_records = (os.fstat(f.fileno()).st_size - SEGMENT_HEADER_SIZE) // RECORD_SIZE
+            if n_records:
+                self.map = mmap.mmap(f.fileno(), SEGMENT_HEADER_SIZE + n_records * RECORD_SIZE, access=mmap.ACCESS_READ)
+        if self.map is None:
+            self.records = np.zeros(0, dtype=RECORD_DTYPE)
+        else:
+            self.records = np.frombuffer(self.map, dtype=RECORD_DTYPE, count=n_records, offset=SEGMENT_HEADER_SIZE)
+        self._load_index(path[:-len(SEGMENT_SUFFIX)] + INDEX_SUFFIX)
+
+    def __len__(self):
+        return len(self.records)
+
+    def _load_index(self, index_path):
+        # the index blocks, and the unindexed last records as one more block
+        try:
+            index = np.fromfile(index_path, dtype=np.uint8)
+        except FileNotFoundError:
+            index = np.zeros(0, dtype=np.uint8)
+        index = index[:len(index) // INDEX_ENTRY_DTYPE.itemsize * INDEX_ENTRY_DTYPE.itemsize].view(INDEX_ENTRY_DTYPE)
+        # entries for blocks past the records mapped (written after the mapping was made) are left out
+        index = index[index['first_record'] + self.index_interval <= len(self.records)]
+        block_starts = index['first_record'].astype(np.int64)
+        min_timestamps = index['min_timestamp']
+        max_timestamps = index['max_timestamp']
+        indexed_records = len(index) * self.index_interval
+        if indexed_records < len(self.records):
+            tail = self.records['timestamp'][indexed_records:]
+            block_starts = np.append(block_starts, indexed_records)
+            min_timestamps = np.append(min_timestamps, tail.min())
+            max_timestamps = np.append(max_timestamps, tail.max())
+        self.block_starts = block_starts
+        self.block_stops = np.append(block_starts[1:], len(self.records)).astype(np.int64)
+        # the largest timestamp up to each block and the smallest from each block on are both sorted, unlike the
+        # blocks' own bounds, so that they can be searched
+        self.max_timestamp_so_far = np.maximum.accumulate(max_timestamps) if len(max_timestamps) else max_timestamps
+        self.min_timestamp_from = np.minimum.accumulate(min_timestamps[::-1])[::-1] if len(min_timestamps) else min_timestamps
+
+    def time_bounds(self):
+        # the smallest and largest timestamps in the segment, None if it is empty
+        if not len(self.block_starts):
+            return None
+        return float(self.min_timestamp_from[0]), float(self.max_timestamp_so_far[-1])
+
+    def seek(self, t_start=None, t_end=None):
+        '''
+        Finds the records with t_start <= timestamp < t_end (either bound None for no bound) with binary searches
+        in the index.
+
+        Returns:
+        int, int: a range [start, stop) of records holding all of them.
+        '''
+        start_block = 0
+        stop_block = len(self.block_starts)
+        if t_start is not None:
+            # the blocks before it only hold earlier records
+            start_block = int(np.searchsorted(self.max_timestamp_so_far, t_start, side='left'))
+        if t_end is not None:
+            # the blocks from it on only hold later records
+            stop_block = int(np.searchsorted(self.min_timestamp_from, t_end, side='left'))
+        if start_block >= stop_block:
+            return 0, 0
+        return int(self.block_starts[start_block]), int(self.block_stops[stop_block - 1])
+
+    def read(self, t_start=None, t_end=None, sensor_id=None):
+        '''
+        Returns the records with t_start <= timestamp < t_end, from sensor_id if given, in file order. A zero-copy view
+        of the segment when the range found by seek() holds only those, a copy otherwise.
+        '''
+        start, stop = self.seek(t_start, t_end)
+        records = self.records[start:stop]
+        mask = None
+        if t_start is not None:
+            mask = records['timestamp'] >= t_start
+        if t_end is not None:
+            mask = records['timestamp'] < t_end if mask is None else mask & (records['timestamp'] < t_end)
+        if sensor_id is not None:
+            mask = records['sensor_id'] == sensor_id if mask is None else mask & (records['sensor_id'] == sensor_id)
+        if mask is None or mask.all():
+            return records
+        return records[mask]
+
+    def close(self):
+        # the arrays returned by read() must not be used after this
+        self.records = np.zeros(0, dtype=RECORD_DTYPE)
+        if self.map is not None:
+            try:
+                self.map.close()
+            except BufferError:
+                # views of the map are still around, it is closed when they are gone
+                pass
+            self.map = None
+
+
+class RecordingReader():
+    '''
+    Reads a recording directory: its segments mapped into memory (see RecordingSegment) and its sensor table.
+    Segments written after the reader was made, and records appended to them, are seen after refresh().
+    '''
+    def __init__(self, directory):
+        self.directory = directory
+        self.segments = []
+        self.sensor_names = {}
+        self.refresh()
+
+    def refresh(self):
+        # maps the segments that are new or grew since the last refresh, sealed segments keep their maps.
+        # The maps replaced, and those of segments no longer in the directory, are closed
+        segments = {segment.segment_number: segment for segment in self.segments}
+        self.segments = []
+        for segment_number in list_segment_numbers(self.directory):
+            path = segment_path(self.directory, segment_number)
+            segment = segments.pop(segment_number, None)
+            if segment is None or (os.path.getsize(path) - SEGMENT_HEADER_SIZE) // RECORD_SIZE != len(segment):
+                try:
+                    new_segment = RecordingSegment(path)
+                except ValueError:
+                    # a segment whose header is not written yet
+                    if segment is not None:
+                        segment.close()
+                    continue
+                if segment is not None:
+                    segment.close()
+                segment = new_segment
+            self.segments.append(segment)
+        for segment in segments.values():
+            segment.close()
+        self.sensor_names = load_sensor_table(self.directory)
+
+    def __len__(self):
+        return sum(len(segment) for segment in self.segments)
+
+    def sensor_id(self, name):
+        # the id of the sensor with this name, None if it is not in the recording
+        for sensor_id, sensor_name in self.sensor_names.items():
+            if sensor_name == name:
+                return sensor_id
+        return None
+
+    def iter_records(self, t_start=None, t_end=None, sensor=None):
+        '''
+        Yields the records with t_start <= timestamp < t_end, segment by segment, see RecordingSegment.read().
+        Segments whose time bounds miss the range are skipped without being read.
+
+        Args:
+        t_start, t_end (float): the time range, either None for no bound.
+        sensor (str or int): a sensor name or id to read only its records, None for all sensors.
+        '''
+        sensor_id = self.sensor_id(sensor) if isinstance(sensor, str) else sensor
+        if isinstance(sensor, str) and sensor_id is None:
+            return
+        for segment in self.segments:
+            time_bounds = segment.time_bounds()
+            if time_bounds is None:
+                continue
+            if (t_start is not None and time_bounds[1] < t_start) or (t_end is not None and time_bounds[0] >= t_end):
+                continue
+            records = segment.read(t_start, t_end, sensor_id)
+            if len(records):
+                yield records
+
+    def read(self, t_start=None, t_end=None, sensor=None):
+        # the records of iter_records() in one array, a copy
+        parts = list(self.iter_records(t_start, t_end, sensor))
+        if not parts:
+            return np.zeros(0, dtype=RECORD_DTYPE)
+        return np.concatenate(parts)
+
+    def close(self):
+        for segment in self.segments:
+            segment.close()
+        self.segments = []
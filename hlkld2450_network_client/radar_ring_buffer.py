@@ -0,0 +1,280 @@
+import time
+from threading import Lock
+import numpy as np
+try:
+    from hlkld2450_network_client.radar_frames import FRAME_SIZE, N_TARGET_FIELDS
+except ImportError:
+    from radar_frames import FRAME_SIZE, N_TARGET_FIELDS
+
+
+class RadarRingBuffer():
+    '''
+    A fixed-capacity columnar ring buffer of radar frames: preallocated timestamp, decoded target and validity
+    columns, plus an optional raw frame column. About 33 bytes per frame, 63 with raw frames.
+
+    Rows are addressed by their absolute row number: the n-th row ever written is row n, and it lives at
+    index n % capacity until it is overwritten. Writers (extend, clear) must be serialized by the owner.
+    Readers do not need the writers' lock if they go through snapshot(), see RadarRingSnapshot.
+    '''
+    def __init__(self, capacity, store_raw_frames=True):
+        self.capacity = capacity
+        self.columns = {
+            'timestamp': np.zeros(capacity, dtype=np.float64),
+            'targets': np.zeros((capacity, N_TARGET_FIELDS), dtype=np.int16),
+            'valid': np.zeros(capacity, dtype=bool),
+        }
+        if store_raw_frames:
+            self.columns['frames'] = np.zeros((capacity, FRAME_SIZE), dtype=np.uint8)
+        self.total_written = 0  # absolute row number of the next row to be written
+        self.write_target = 0   # total_written once the write in progress is done, published before any row is overwritten
+        self.first_row = 0      # rows before this one were cleared
+        # snapshot read counters, see get_snapshot_stats()
+        self.snapshot_reads = 0
+        self.snapshot_torn_reads = 0
+        self.snapshot_rows_lost = 0
+
+    def __len__(self):
+        return self.total_written - self.oldest_row()
+
+    def oldest_row(self):
+        # absolute row number of the oldest row still held
+        return max(self.first_row, self.total_written - self.capacity)
+
+    def stores_raw_frames(self):
+        return 'frames' in self.columns
+
+    def nbytes(self):
+        return sum(column.nbytes for column in self.columns.values())
+
+    def extend(self, batch):
+        '''
+        Appends rows with bulk array copies, overwriting the oldest rows when full.
+
+        Args:
+        batch (dict): a column name -> array dict with the same number of rows in each array, for every column
+            of the buffer ('timestamp', 'targets', 'valid' and, if raw frames are stored, 'frames').
+
+        Returns:
+        int: the number of rows appended.
+        '''
+        n = len(batch['timestamp'])
+        # tell lock-free readers which rows are about to be overwritten before touching them
+        self.write_target = self.total_written + n
+        # a batch larger than the buffer only keeps its last rows
+        skip = max(0, n - self.capacity)
+        start_index = (self.total_written + skip) % self.capacity
+        n_first = min(n - skip, self.capacity - start_index)
+        for column_name, column in self.columns.items():
+            values = batch[column_name]
+            column[start_index:start_index + n_first] = values[skip:skip + n_first]
+            column[:n - skip - n_first] = values[skip + n_first:]
+        self.total_written += n
+        return n
+
+    def clear(self):
+        self.first_row = self.total_written
+
+    def _index_ranges(self, start_row, stop_row):
+        # the one or two index ranges holding absolute rows [start_row, stop_row), oldest first
+        start_row = max(start_row, self.oldest_row())
+        stop_row = min(stop_row, self.total_written)
+        return self._unchecked_index_ranges(start_row, stop_row)
+
+    def _unchecked_index_ranges(self, start_row, stop_row):
+        # as _index_ranges(), for rows that the caller already checked
+        if stop_row <= start_row:
+            return []
+        start_index = start_row % self.capacity
+        stop_index = start_index + stop_row - start_row
+        if stop_index <= self.capacity:
+            return [(start_index, stop_index)]
+        return [(start_index, self.capacity), (0, stop_index - self.capacity)]
+
+    def segments(self, start_row, stop_row):
+        '''
+        Returns views of the rows [start_row, stop_row) that are still held, without copying.
+        The views are only valid until the rows are overwritten.
+
+        Returns:
+        list: one or two column name -> array view dicts, oldest first.
+        '''
+        return [
+            {column_name: column[start_index:stop_index] for column_name, column in self.columns.items()}
+            for start_index, stop_index in self._index_ranges(start_row, stop_row)
+        ]
+
+    def read(self, start_row, stop_row):
+        '''
+        Returns a copy of the rows [start_row, stop_row) that are still held, oldest first.
+
+        Returns:
+        dict: column name -> array.
+        '''
+        return self._copy_segments(self.segments(start_row, stop_row))
+
+    def _copy_segments(self, segments, column_names=None):
+        # column_names limits the copy to these columns, all by default
+        if column_names is None:
+            column_names = list(self.columns)
+        if len(segments) == 1:
+            return {column_name: segments[0][column_name].copy() for column_name in column_names}
+        return {
+            column_name: np.concatenate([segment[column_name] for segment in segments]) if segments else self.columns[column_name][:0].copy()
+            for column_name in column_names
+        }
+
+    def read_last(self, n):
+        # a copy of the last n rows held
+        return self.read(self.total_written - n, self.total_written)
+
+    def snapshot(self, start_row=None, stop_row=None):
+        '''
+        Takes a snapshot of the rows [start_row, stop_row) in O(1), without copying and without the writers' lock.
+        By default, all the rows currently held.
+
+        Returns:
+        RadarRingSnapshot: the snapshot.
+        '''
+        # read total_written once: every row before it is completely written
+        total_written = self.total_written
+        oldest_row = max(self.first_row, total_written - self.capacity)
+        start_row = oldest_row if start_row is None else max(start_row, oldest_row)
+        stop_row = total_written if stop_row is None else min(stop_row, total_written)
+        return RadarRingSnapshot(self, start_row, max(start_row, stop_row))
+
+    def get_snapshot_stats(self):
+        '''
+        Returns the snapshot read counters: reads, torn reads (a writer overwrote some of the rows being read)
+        and the number of rows dropped from torn reads.
+        '''
+        return {
+            'snapshot_reads': self.snapshot_reads,
+            'snapshot_torn_reads': self.snapshot_torn_reads,
+            'snapshot_rows_lost': self.snapshot_rows_lost,
+        }
+
+
+class RadarRingSnapshot():
+    '''
+    A consistent, read-only view of a range of RadarRingBuffer rows, taken without blocking the writer.
+
+    Works like a seqlock: the writer publishes write_target before overwriting rows, and a reader checks it
+    after reading. Rows are overwritten oldest first, so a torn read only ever loses a prefix of the range,
+    and read() returns the intact suffix instead of retrying. The rows lost were evicted from the buffer anyway.
+    '''
+    def __init__(self, ring_buffer, start_row, stop_row):
+        self.ring_buffer = ring_buffer
+        self.start_row = start_row
+        self.stop_row = stop_row
+
+    def __len__(self):
+        return self.stop_row - self.start_row
+
+    def first_intact_row(self):
+        # rows before this one may have been overwritten since the snapshot was taken
+        return max(self.start_row, self.ring_buffer.write_target - self.ring_buffer.capacity)
+
+    def is_intact(self):
+        return self.first_intact_row() == self.start_row
+
+    def segments(self):
+        '''
+        Returns read-only views of the snapshot's rows, without copying: one or two column name -> array dicts,
+        oldest first. Check is_intact() after using them, the writer may overwrite the oldest rows at any time.
+        '''
+        segments = []
+        for start_index, stop_index in self.ring_buffer._unchecked_index_ranges(self.start_row, self.stop_row):
+            segment = {}
+            for column_name, column in self.ring_buffer.columns.items():
+                view = column[start_index:stop_index]
+                view.flags.writeable = False
+                segment[column_name] = view
+            segments.append(segment)
+        return segments
+
+    def time_range(self, t_start=None, t_end=None):
+        '''
+        Narrows the snapshot to the rows with t_start <= timestamp < t_end (either bound None for no bound), with a
+        binary search over each of its one or two segments: a sensor writes its rows with non-decreasing timestamps.
+
+        Returns:
+        RadarRingSnapshot: a snapshot of those rows, taken without copying.
+        '''
+        snapshot = self
+        while True:
+            segments = snapshot.segments()
+            bounds = []
+            for t, default_row in ((t_start, snapshot.start_row), (t_end, snapshot.stop_row)):
+                if t is None:
+                    bounds.append(default_row)
+                    continue
+                # the number of rows before t, segment after segment
+                row = snapshot.start_row
+                for segment in segments:
+                    n_before = int(np.searchsorted(segment['timestamp'], t, side='left'))
+                    row += n_before
+                    if n_before < len(segment['timestamp']):
+                        break
+                bounds.append(row)
+            if snapshot.is_intact():
+                return RadarRingSnapshot(self.ring_buffer, bounds[0], max(bounds))
+            # the writer overwrote the oldest rows while they were searched: search the rows left
+            snapshot = RadarRingSnapshot(self.ring_buffer, min(snapshot.first_intact_row(), snapshot.stop_row), snapshot.stop_row)
+
+    def read(self, column_names=None):
+        '''
+        Copies the snapshot's rows, dropping the oldest rows if the writer overwrote them during the copy.
+
+        Args:
+        column_names (list): the columns to copy, all by default.
+
+        Returns:
+        dict: column name -> array, as RadarRingBuffer.read().
+        int: the absolute row number of the first row returned.
+        '''
+        rows = self.ring_buffer._copy_segments(self.segments(), column_names)
+        first_intact_row = self.first_intact_row()
+        self.ring_buffer.snapshot_reads += 1
+        if first_intact_row > self.start_row:
+            n_lost = min(first_intact_row, self.stop_row) - self.start_row
+            self.ring_buffer.snapshot_torn_reads += 1
+            self.ring_buffer.snapshot_rows_lost += n_lost
+            rows = {column_name: column[n_lost:] for column_name, column in rows.items()}
+            return rows, self.start_row + n_lost
+        return rows, self.start_row
+
+
+class InstrumentedLock():
+    '''
+    A Lock that counts acquisitions, contended acquisitions and the total time spent waiting for it.
+    Used as a context manager, like Lock.
+    '''
+    def __init__(self):
+        self._lock = Lock()
+        self.acquisitions = 0
+        self.contended_acquisitions = 0
+        self.total_wait_time = 0.0
+        self.max_wait_time = 0.0
+
+    def __enter__(self):
+        if not self._lock.acquire(blocking=False):
+            t0 = time.perf_counter()
+            self._lock.acquire()
+            wait_time = time.perf_counter() - t0
+            # counters are only updated while holding the lock
+            self.contended_acquisitions += 1
+            self.total_wait_time += wait_time
+            self.max_wait_time = max(self.max_wait_time, wait_time)
+        self.acquisitions += 1
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._lock.release()
+
+    def get_stats(self):
+        return {
+            'acquisitions': self.acquisitions,
+            'contended_acquisitions': self.contended_acquisitions,
+            'total_wait_time': self.total_wait_time,
+            'max_wait_time': self.max_wait_time,
+        }
@@ -0,0 +1,85 @@
+from threading import Lock
+try:
+    from hlkld2450_network_client.wire_protocol import format_get_since_request
+except ImportError:
+    from wire_protocol import format_get_since_request
+
+
+class SequenceCursor():
+    '''
+    A client's position in a server's frame sequence, for 'get since' reads (see wire_protocol.py).
+
+    The server numbers its frames from 0 at every boot, and keeps them until they are overwritten, whoever reads them.
+    The cursor is the sequence number of the next frame the client wants, with the boot id it belongs to. It only moves
+    once a response was decoded and stored, so a response lost with its connection is simply asked for again, and
+    reconnecting does not lose or repeat anything.
+
+    Loss accounting:
+    - a response starting after the cursor means the frames in between were overwritten before they were read: a gap;
+    - a new boot id means the server restarted: the frames the new boot overwrote before the first read are lost too.
+      Frames the old boot stored after the last read cannot be counted, the server restart itself is counted.
+    The first response after the cursor was created or reset only sets the position, nothing before it counts as lost.
+    '''
+    def __init__(self):
+        self.lock = Lock()
+        self.boot_id = 0    # 0 until the first response: no position yet
+        self.next_sequence = 0
+        # counters, see get_stats()
+        self.frames_received = 0
+        self.frames_lost = 0
+        self.gaps = 0
+        self.server_restarts = 0
+
+    def get_request(self):
+        # the request string for the frames after the cursor
+        with self.lock:
+            return format_get_since_request(self.next_sequence, self.boot_id)
+
+    def advance(self, boot_id, first_sequence, frame_count):
+        '''
+        Moves the cursor past a stored response.
+
+        Args:
+        boot_id (int): the boot id of the response.
+        first_sequence (int): the sequence number of the response's first frame.
+        frame_count (int): the number of frames in the response.
+
+        Returns:
+        int: the number of frames lost just before this response.
+        '''
+        with self.lock:
+            if self.boot_id == 0:
+                n_lost = 0
+            elif boot_id != self.boot_id:
+                self.server_restarts += 1
+                n_lost = first_sequence
+            else:
+                n_lost = max(0, first_sequence - self.next_sequence)
+            if n_lost:
+                self.gaps += 1
+                self.frames_lost += n_lost
+            self.boot_id = boot_id
+            self.next_sequence = first_sequence + frame_count
+            self.frames_received += frame_count
+            return n_lost
+
+    def reset(self):
+        # forgets the position, the next response sets it again. The counters are kept
+        with self.lock:
+            self.boot_id = 0
+            self.next_sequence = 0
+
+    def get_stats(self):
+        '''
+        Returns the cursor position (boot_id, next_sequence) and the loss counters: frames_received, frames_lost,
+        gaps (runs of lost frames) and server_restarts.
+        '''
+        with self.lock:
+            return {
+                'boot_id': self.boot_id,
+                'next_sequence': self.next_sequence,
+                'frames_received': self.frames_received,
+                'frames_lost': self.frames_lost,
+                'gaps': self.gaps,
+                'server_restarts': self.server_restarts,
+            }
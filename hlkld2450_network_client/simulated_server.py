@@ -0,0 +1,483 @@
+import asyncio, math, os, random, struct, sys, time
+from threading import Event, Thread
+try:
+    from hlkld2450_network_client.radar_frames import REPORT_HEADER, REPORT_TAIL
+    from hlkld2450_network_client.wire_protocol import PROTOCOL_MAGIC, HEADER_SIZE, STATS_REQUEST
+except ImportError:
+    from radar_frames import REPORT_HEADER, REPORT_TAIL
+    from wire_protocol import PROTOCOL_MAGIC, HEADER_SIZE, STATS_REQUEST
+
+# a CPython stand-in for the ESP32's WifiSensorServer (_hlkld2450_esp32_upython_server_fs/upython_sensor_server.py),
+# speaking the same close-delimited and framed protocols, so that clients can be load-tested without hardware.
+# The frame store, request parsing, read positions and payload encodings are the server's own modules
+SERVER_FS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '_hlkld2450_esp32_upython_server_fs')
+if SERVER_FS_DIR not in sys.path:
+    sys.path.append(SERVER_FS_DIR)
+from frame_store import FrameStore
+from frame_protocol import (MSG_ERROR, FLAG_COMPACT, REQUEST_HELLO, REQUEST_ERROR, REQUEST_GET, REQUEST_GET_SINCE,
+                            REQUEST_STATS, ClientCursor, parse_request, unpack_request_header, parse_framed_request,
+                            negotiate_hello, pack_response_header, client_read_start, since_read_start,
+                            since_response_prefix, encode_frames, pack_stats_payload)
+
+SIMULATED_FRAME_RATE = 10.0     # frames per second, as the LD2450 in basic reporting mode
+SIMULATED_QUEUE_SIZE = 340  # frames held by the server, as in main.py
+SIMULATED_DISTANCE_RESOLUTION = 360
+RECEIVE_SIZE = 1024     # a close-delimited request is the first bytes received, as on the server
+
+
+def encode_target_word(value):
+    # the LD2450 sign-bit encoding of x, y and speed: the highest bit set for a negative value
+    magnitude = min(abs(int(round(value))), 0x7FFF)
+    return magnitude | 0x8000 if value < 0 else magnitude
+
+
+def make_report_frame(targets):
+    '''
+    Builds a 30-byte LD2450 report frame.
+
+    Args:
+    targets (list): up to 3 (x, y, speed) tuples, x and y in mm, speed in cm/s. Missing targets are sent as zeros.
+
+    Returns:
+    bytes: the frame.
+    '''
+    words = []
+    for x, y, speed in targets[:3]:
+        words.extend((encode_target_word(x), encode_target_word(y), encode_target_word(speed), SIMULATED_DISTANCE_RESOLUTION))
+    words.extend([0] * (12 - len(words)))
+    return REPORT_HEADER + struct.pack('<12H', *words) + REPORT_TAIL
+
+
+def walk_trajectory(start, end, duration, pause=0.0, phase=0.0):
+    '''
+    A target walking from start to end in duration seconds, then gone for pause seconds, over and over.
+
+    Returns:
+    callable: time in seconds -> (x, y) in mm, or None while the target is gone.
+    '''
+    def position(t):
+        t = (t + phase) % (duration + pause)
+        if t >= duration:
+            return None
+        fraction = t / duration
+        return start[0] + (end[0] - start[0]) * fraction, start[1] + (end[1] - start[1]) * fraction
+    return position
+
+
+def circle_trajectory(center, radius, period, phase=0.0):
+    '''
+    A target going around a circle once every period seconds.
+
+    Returns:
+    callable: time in seconds -> (x, y) in mm.
+    '''
+    def position(t):
+        angle = 2 * math.pi * (t + phase) / period
+        return center[0] + radius * math.cos(angle), center[1] + radius * math.sin(angle)
+    return position
+
+
+def random_trajectories(rng):
+    # one to three targets, different for every server of a farm
+    trajectories = [walk_trajectory((rng.uniform(-3000, -1000), rng.uniform(500, 2000)),
+                                    (rng.uniform(1000, 3000), rng.uniform(3000, 6000)),
+                                    rng.uniform(4, 12), pause=rng.uniform(0, 5), phase=rng.uniform(0, 10))]
+    for i in range(rng.randint(0, 2)):
+        trajectories.append(circle_trajectory((rng.uniform(-1000, 1000), rng.uniform(2000, 4000)), rng.uniform(300, 1500),
+                                              rng.uniform(5, 20), phase=rng.uniform(0, 20)))
+    return trajectories
+
+
+class SyntheticRadar():
+    '''
+    Generates LD2450 report frames at frame_rate from target trajectories. Frame k is due frame k / frame_rate seconds
+    after start_time, and is only computed when asked for (see frames_due()), so an idle server costs nothing.
+
+    A frame is corrupted with probability corruption_rate, as line noise on the radar's UART would: a flipped header or
+    tail byte, or a frame cut short.
+    '''
+    def __init__(self, trajectories, frame_rate=SIMULATED_FRAME_RATE, corruption_rate=0.0, seed=None):
+        self.trajectories = trajectories
+        self.frame_rate = frame_rate
+        self.corruption_rate = corruption_rate
+        self.rng = random.Random(seed)
+        self.start_time = None
+        self.frames_due_so_far = 0
+
+    def start(self, now):
+        self.start_time = now
+        self.frames_due_so_far = 0
+
+    def frame_time(self, k):
+        return self.start_time + k / self.frame_rate
+
+    def targets_at(self, t):
+        # (x, y, speed) of every target present at t seconds since the start, speed along the distance to the radar
+        targets = []
+        dt = 1 / self.frame_rate
+        for trajectory in self.trajectories:
+            position = trajectory(t)
+            if position is None:
+                continue
+            previous_position = trajectory(t - dt)
+            speed = 0
+            if previous_position is not None:
+                # mm per frame to cm/s, positive moving away from the radar
+                speed = (math.hypot(*position) - math.hypot(*previous_position)) / dt / 10
+            targets.append((position[0], position[1], speed))
+        return targets
+
+    def make_frame(self, k):
+        frame = make_report_frame(self.targets_at(k / self.frame_rate))
+        if self.corruption_rate and self.rng.random() < self.corruption_rate:
+            kind = self.rng.randrange(3)
+            if kind == 0:
+                frame = frame[:self.rng.randint(1, len(frame) - 1)]
+            else:
+                position = self.rng.randint(0, 3) if kind == 1 else self.rng.randint(28, 29)
+                frame = frame[:position] + bytes([frame[position] ^ 0x10]) + frame[position + 1:]
+            return frame, True
+        return frame, False
+
+    def frames_due(self, now, max_frames=None):
+        '''
+        Returns the frames due since the previous call, at most the max_frames most recent ones: the older ones would be
+        overwritten in the server's queue anyway.
+
+        Returns:
+        int: the number of frames due but skipped.
+        list: (radar time, frame, corrupted) tuples.
+        '''
+        n_due = int((now - self.start_time) * self.frame_rate) + 1
+        first = self.frames_due_so_far
+        if max_frames is not None:
+            first = max(first, n_due - max_frames)
+        n_skipped = first - self.frames_due_so_far
+        self.frames_due_so_far = max(n_due, self.frames_due_so_far)
+        return n_skipped, [(self.frame_time(k),) + self.make_frame(k) for k in range(first, n_due)]
+
+
+class SimulatedSensorServer():
+    '''
+    A CPython WifiSensorServer on an asyncio event loop, fed by a SyntheticRadar: 'echo', 'clear', 'get', 'get since',
+    'stats' and 'reset' over the close-delimited protocol (one connection per request) and the framed one (see
+    wire_protocol.py), with sequence numbers and compact payloads.
+
+    As on the server, every client reads from its own cursor: one per framed connection, one per IP address for
+    close-delimited clients. Corrupted frames are dropped before they are stored and numbered, as the server's UART
+    reader does, unless store_corrupted is set (as servers before the resynchronizing reader did).
+    'reset' restarts the simulated server: a new boot id, an empty queue, sequence numbers from 0.
+    The frames are held in the server's FrameStore and served with the server's frame_protocol module.
+
+    Args:
+    radar (SyntheticRadar): the frame source.
+    queue_size (int): frames held for the clients.
+    network_delay, network_jitter (float): every response waits network_delay plus up to network_jitter seconds.
+    clock_drift_ppm, clock_offset (float): the server clock runs clock_drift_ppm faster than the host's, and
+        clock_offset seconds ahead, in frame timestamps and serialization timestamps.
+    '''
+    def __init__(self, radar, queue_size=SIMULATED_QUEUE_SIZE, network_delay=0.0, network_jitter=0.0, clock_drift_ppm=0.0,
+                 clock_offset=0.0, store_corrupted=False, seed=None):
+        self.radar = radar
+        self.queue_size = queue_size
+        self.network_delay = network_delay
+        self.network_jitter = network_jitter
+        self.clock_drift = clock_drift_ppm * 1e-6
+        self.clock_offset = clock_offset
+        self.store_corrupted = store_corrupted
+        self.rng = random.Random(seed)
+        self.server = None
+        self.port = None
+        self.start_time = None
+        self.address_cursors = {}
+        # counters, see get_stats()
+        self.requests = 0
+        self.connections_accepted = 0
+        self.bytes_sent = 0
+        self.corrupted_frames = 0
+        self.frames_missed = 0
+        self.boot()
+
+    def boot(self):
+        # the state a server starts with
+        self.boot_id = struct.unpack('<I', os.urandom(4))[0] or 1
+        self.frame_store = FrameStore(self.queue_size)
+        self.address_cursors.clear()
+
+    def server_time(self, now):
+        # the host time now on the server's clock
+        return now + self.clock_offset + (now - self.start_time) * self.clock_drift
+
+    async def start(self, host='127.0.0.1', port=0):
+        now = time.time()
+        self.start_time = now
+        self.radar.start(now)
+        self.server = await asyncio.start_server(self.handle_connection, host, port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self.port
+
+    async def stop(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+
+    def ingest(self):
+        # stores the frames the radar produced since the last request
+        n_skipped, frames = self.radar.frames_due(time.time(), self.queue_size)
+        if n_skipped:
+            # frames that newer ones would have pushed out of the frame store before any request: numbered without
+            # being computed, as if stored and evicted together with the frames held
+            self.frame_store.evicted += len(self.frame_store) + n_skipped
+            self.frame_store.clear()
+            self.frame_store.written += n_skipped
+        for radar_time, frame, corrupted in frames:
+            if corrupted:
+                self.corrupted_frames += 1
+                if not self.store_corrupted:
+                    continue
+            # frames cut short are padded with zeros by the frame store
+            self.frame_store.append(self.server_time(radar_time), frame)
+
+    def get_payload(self, sequence, n_frames, compact=False):
+        # a 'get' payload, see the server's get_payload(). Returns it with its flags
+        chunks, flags = encode_frames(self.frame_store, sequence, n_frames, self.server_time(time.time()), compact)
+        return b''.join(chunks), flags
+
+    def get_client_payload(self, cursor, compact=False):
+        # the frames after a client's cursor, see the server's get_client_payload()
+        next_sequence = self.frame_store.next_sequence()
+        sequence, n_missed = client_read_start(cursor, self.frame_store.first_sequence(), next_sequence)
+        self.frames_missed += n_missed
+        payload, flags = self.get_payload(sequence, next_sequence - sequence, compact)
+        return payload, flags, next_sequence - sequence
+
+    def get_since_payload(self, boot_id, sequence, compact=False):
+        # see the server's get_since_payload()
+        next_sequence = self.frame_store.next_sequence()
+        sequence, n_missed = since_read_start(boot_id, sequence, self.boot_id, self.frame_store.first_sequence(), next_sequence)
+        self.frames_missed += n_missed
+        payload, flags = self.get_payload(sequence, next_sequence - sequence, compact)
+        return since_response_prefix(self.boot_id, sequence, next_sequence) + payload, flags, next_sequence - sequence
+
+    def pack_stats(self):
+        # the server's 'stats' payload, with the counters a simulated server has (the corrupted frames dropped stand for
+        # the UART reader's resyncs), and an empty main loop time histogram
+        counters = [
+            self.boot_id, int((time.time() - self.start_time) * 1000), self.frame_store.written, self.corrupted_frames,
+            0, self.frames_missed, 0, self.connections_accepted, 0, 0, 0,
+        ]
+        counters = [counter & 0xFFFFFFFF for counter in counters]
+        counters.extend([self.bytes_sent & 0xFFFFFFFFFFFFFFFF, 0, 0, 0])
+        return pack_stats_payload(counters, (), [0])
+
+    def process_request(self, input_data, cursor):
+        '''
+        Processes a legacy request string, as the server's process_request().
+
+        Returns:
+        bytes: the response.
+        '''
+        self.ingest()
+        request, argument = parse_request(input_data)
+        if request == REQUEST_GET:
+            return self.get_client_payload(cursor)[0]
+        if request == REQUEST_GET_SINCE:
+            return self.get_since_payload(*argument)[0]
+        if request == REQUEST_STATS:
+            return self.pack_stats()
+        if input_data == '':
+            return b'IMA'
+        if input_data == 'clear':
+            cursor.next_sequence = self.frame_store.next_sequence()
+        return input_data.upper().encode()
+
+    async def send(self, writer, data):
+        delay = self.network_delay + (self.rng.uniform(0, self.network_jitter) if self.network_jitter else 0)
+        if delay:
+            await asyncio.sleep(delay)
+        writer.write(data)
+        await writer.drain()
+        self.bytes_sent += len(data)
+
+    async def handle_connection(self, reader, writer):
+        self.connections_accepted += 1
+        try:
+            received_bytes = await reader.read(RECEIVE_SIZE)
+            if received_bytes[:2] == PROTOCOL_MAGIC:
+                await self.serve_framed(reader, writer, received_bytes)
+            elif received_bytes:
+                await self.serve_close_delimited(writer, received_bytes)
+        except (ConnectionError, asyncio.IncompleteReadError, UnicodeError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve_close_delimited(self, writer, received_bytes):
+        # the first bytes received are the whole request, the response ends when the connection closes
+        self.requests += 1
+        input_data = received_bytes.decode()     # an undecodable request closes the connection, as on the server
+        address = writer.get_extra_info('peername')[0]
+        cursor = self.address_cursors.get(address)
+        if cursor is None:
+            cursor = self.address_cursors[address] = ClientCursor(time.time())
+        await self.send(writer, self.process_request(input_data, cursor))
+        if input_data == 'reset':
+            self.boot()
+
+    async def serve_framed(self, reader, writer, received_bytes):
+        # framed messages until the client closes the connection, answered one after the other
+        buffer = bytearray(received_bytes)
+        cursor = ClientCursor(time.time())
+        negotiated_flags = 0
+        while True:
+            while len(buffer) < HEADER_SIZE:
+                buffer.extend(await reader.readexactly(HEADER_SIZE - len(buffer)))
+            request_header = unpack_request_header(bytes(buffer[:HEADER_SIZE]))
+            if request_header is None:
+                return
+            version, msg_type, flags, payload_len = request_header
+            while len(buffer) < HEADER_SIZE + payload_len:
+                buffer.extend(await reader.readexactly(HEADER_SIZE + payload_len - len(buffer)))
+            payload = bytes(buffer[HEADER_SIZE:HEADER_SIZE + payload_len])
+            del buffer[:HEADER_SIZE + payload_len]
+            self.requests += 1
+            response_flags = 0
+            frame_count = 0
+            input_data = None
+            request, argument = parse_framed_request(version, msg_type, payload)
+            if request == REQUEST_HELLO:
+                version, negotiated_flags = negotiate_hello(version, flags)
+                response_flags = negotiated_flags
+                response = b''
+            elif request == REQUEST_ERROR:
+                msg_type = MSG_ERROR
+                response = argument
+            elif request == REQUEST_GET:
+                self.ingest()
+                response, response_flags, frame_count = self.get_client_payload(cursor, negotiated_flags & FLAG_COMPACT)
+            elif request == REQUEST_GET_SINCE:
+                self.ingest()
+                response, response_flags, frame_count = self.get_since_payload(*argument, negotiated_flags & FLAG_COMPACT)
+            else:
+                input_data = argument if request != REQUEST_STATS else STATS_REQUEST
+                response = self.process_request(input_data, cursor)
+            await self.send(writer, pack_response_header(version, msg_type, response_flags, frame_count, len(response)) + response)
+            if input_data == 'reset':
+                # the server restarts: its connections are gone
+                self.boot()
+                return
+
+    def get_stats(self):
+        '''
+        Returns the server's counters: requests, connections_accepted, bytes_sent, frames_stored (since the last reset),
+        corrupted_frames (dropped before they were stored, or stored with store_corrupted) and frames_missed (frames
+        clients asked for that were evicted before they read them, as the server's 'stats').
+        '''
+        self.ingest()
+        return {
+            'requests': self.requests,
+            'connections_accepted': self.connections_accepted,
+            'bytes_sent': self.bytes_sent,
+            'frames_stored': self.frame_store.written,
+            'corrupted_frames': self.corrupted_frames,
+            'frames_missed': self.frames_missed,
+        }
+
+
+class SimulatedServerFarm():
+    '''
+    Runs n_servers SimulatedSensorServer instances on localhost ports, all on one asyncio event loop in a background
+    thread, so that hundreds of them fit in one process. Each server has its own random trajectories and clock error.
+
+    Args:
+    n_servers (int): the number of servers.
+    base_port (int): the port of the first server, the others follow. 0 for free ports chosen by the system.
+    frame_rate, corruption_rate: see SyntheticRadar.
+    clock_drift_ppm (float): each server's clock drift is drawn uniformly in [-clock_drift_ppm, clock_drift_ppm].
+    server_kwargs: passed on to SimulatedSensorServer (queue_size, network_delay, network_jitter, store_corrupted...).
+    '''
+    def __init__(self, n_servers, host='127.0.0.1', base_port=0, frame_rate=SIMULATED_FRAME_RATE, corruption_rate=0.0,
+                 clock_drift_ppm=0.0, seed=None, **server_kwargs):
+        self.host = host
+        self.base_port = base_port
+        rng = random.Random(seed)
+        self.servers = []
+        for i in range(n_servers):
+            radar = SyntheticRadar(random_trajectories(rng), frame_rate, corruption_rate, seed=rng.random())
+            self.servers.append(SimulatedSensorServer(radar, clock_drift_ppm=rng.uniform(-clock_drift_ppm, clock_drift_ppm),
+                                                      seed=rng.random(), **server_kwargs))
+        self.loop = None
+        self.thread = None
+        self.ports = []
+
+    def start(self):
+        '''
+        Starts the servers and returns once they all listen.
+
+        Returns:
+        list: the servers' ports.
+        '''
+        started = Event()
+        errors = []
+
+        def run():
+            self.loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self.loop)
+            try:
+                self.ports = self.loop.run_until_complete(self._start_servers())
+            except Exception as e:
+                errors.append(e)
+                started.set()
+                return
+            started.set()
+            self.loop.run_forever()
+
+        self.thread = Thread(target=run, daemon=True)
+        self.thread.start()
+        started.wait()
+        if errors:
+            raise errors[0]
+        return self.ports
+
+    async def _start_servers(self):
+        ports = []
+        for i, server in enumerate(self.servers):
+            ports.append(await server.start(self.host, self.base_port + i if self.base_port else 0))
+        return ports
+
+    async def _stop_servers(self):
+        for server in self.servers:
+            await server.stop()
+
+    def stop(self):
+        if self.loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self._stop_servers(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+        self.loop = None
+
+    def addresses(self):
+        # (host, port) of every server
+        return [(self.host, port) for port in self.ports]
+
+    def get_stats(self):
+        '''
+        Returns the servers' counters summed over the farm, see SimulatedSensorServer.get_stats().
+        '''
+        if self.loop is not None:
+            # read on the farm's own loop, so that no request is handled meanwhile
+            all_stats = asyncio.run_coroutine_threadsafe(self._collect_stats(), self.loop).result()
+        else:
+            all_stats = [server.get_stats() for server in self.servers]
+        total = {}
+        for stats in all_stats:
+            for key, value in stats.items():
+                total[key] = total.get(key, 0) + value
+        total['n_servers'] = len(self.servers)
+        return total
+
+    async def _collect_stats(self):
+        return [server.get_stats() for server in self.servers]
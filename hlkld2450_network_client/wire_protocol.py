@@ -0,0 +1,219 @@
+import struct
+try:
+    from hlkld2450_network_client.radar_frames import (
+        WIRE_FRAME_SIZE, FINAL_TIMESTAMP_SIZE, decode_get_payload, decode_compact_get_payload, get_compact_payload_min_size
+    )
+except ImportError:
+    from radar_frames import (
+        WIRE_FRAME_SIZE, FINAL_TIMESTAMP_SIZE, decode_get_payload, decode_compact_get_payload, get_compact_payload_min_size
+    )
+
+# framed protocol between WifiClient and WifiSensorServer (upython_sensor_server.py holds the server's copy of these constants).
+# every message, in both directions, is a 12-byte header followed by payload_len bytes of payload:
+#   magic (2s) version (B) message type (B) flags (B) reserved (B) frame count (H) payload length (I), little-endian
+PROTOCOL_MAGIC = b'LD'
+PROTOCOL_VERSION = 1
+HEADER_FORMAT = '<2sBBBBHI'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+# message types. A response has the type of its request with RESPONSE_BIT set.
+# request headers only contain bytes below 0x80, so that servers without the framed protocol can still decode them as text
+MSG_HELLO = 0x01    # opens a framed connection, the response carries the server's protocol version
+MSG_ECHO = 0x02     # the payload is a legacy request string, the response payload is what the legacy protocol answers
+MSG_CLEAR = 0x03
+MSG_GET = 0x04      # the response payload is a 'get' payload in the encoding given by the flags, its frame count is in the header
+MSG_RESET = 0x05
+MSG_GET_SINCE = 0x06    # the payload is SINCE_REQUEST_FORMAT, the response payload a SINCE_RESPONSE_FORMAT prefix then a 'get' payload
+MSG_STATS = 0x07    # the response payload is the server's telemetry counters, see decode_stats_response()
+MSG_ERROR = 0x7F    # response only: the payload is an error message
+RESPONSE_BIT = 0x80
+
+# header flags. In HELLO, the encodings the client accepts, answered with those the server agrees to.
+# In a GET response, the encoding of the payload: the server may still send a legacy payload on a compact connection
+FLAG_COMPACT = 0x01     # see radar_frames.decode_compact_get_payload()
+FLAG_SEQUENCE = 0x02    # HELLO only: the server answers MSG_GET_SINCE
+FLAG_STATS = 0x04   # HELLO only: the server answers MSG_STATS
+
+# 'get since' reads frames by sequence number without removing them from the server, see sequence_cursor.py.
+# request: boot id (I) sequence number (Q), also sent as the text 'get since <sequence number> <boot id>'.
+# response prefix: boot id (I) sequence number of the first frame sent (Q) sequence number of the server's next frame (Q)
+SINCE_REQUEST_FORMAT = '<IQ'
+SINCE_RESPONSE_FORMAT = '<IQQ'
+SINCE_RESPONSE_SIZE = struct.calcsize(SINCE_RESPONSE_FORMAT)
+GET_SINCE_PREFIX = 'get since '
+
+# 'stats' response payload: STATS_FORMAT, one counter per STATS_FIELDS name, then the server's main loop time histogram:
+# the number of bucket bounds (B), the bounds in ms (H each) and one count per bucket (I each), the last bucket for
+# iterations slower than every bound. Counters are since the server booted, and wrap around at their size
+STATS_REQUEST = 'stats'
+STATS_FORMAT = '<IIIIIIIIIIIQHII'
+STATS_SIZE = struct.calcsize(STATS_FORMAT)
+STATS_FIELDS = (
+    'boot_id', 'uptime_ms', 'frames_read', 'resyncs', 'skipped_bytes', 'frames_missed', 'poll_timeouts',
+    'connections_accepted', 'connections_refused', 'connections_timed_out', 'slow_clients_dropped', 'bytes_sent',
+    'wifi_reconnects', 'free_heap', 'max_loop_time_ms',
+)
+
+# legacy request strings with their own message type, any other string is sent as MSG_ECHO
+COMMAND_MESSAGE_TYPES = {
+    'clear': MSG_CLEAR,
+    'get': MSG_GET,
+    'reset': MSG_RESET,
+}
+
+
+class WireProtocolError(Exception):
+    # the peer sent something that is not a valid framed message
+    pass
+
+
+def pack_header(msg_type, payload_len=0, frame_count=0, flags=0, version=PROTOCOL_VERSION):
+    return struct.pack(HEADER_FORMAT, PROTOCOL_MAGIC, version, msg_type, flags, 0, frame_count, payload_len)
+
+
+def unpack_header(header):
+    '''
+    Unpacks and checks a message header.
+
+    Args:
+    header (bytes-like): HEADER_SIZE bytes.
+
+    Returns:
+    tuple: (version, message type, flags, frame count, payload length).
+    '''
+    magic, version, msg_type, flags, reserved, frame_count, payload_len = struct.unpack(HEADER_FORMAT, header)
+    if magic != PROTOCOL_MAGIC:
+        raise WireProtocolError(f'bad magic {bytes(magic)!r}')
+    return version, msg_type, flags, frame_count, payload_len
+
+
+def format_get_since_request(sequence, boot_id=0):
+    # the text request for the frames from sequence on. boot_id 0 means no known position: the server sends every frame it holds
+    return f'{GET_SINCE_PREFIX}{sequence} {boot_id}'
+
+
+def parse_get_since_request(client_message:str):
+    # (boot id, sequence number) of a format_get_since_request() string, or None
+    if not client_message.startswith(GET_SINCE_PREFIX):
+        return None
+    try:
+        sequence, boot_id = (int(part) for part in client_message[len(GET_SINCE_PREFIX):].split())
+    except ValueError:
+        return None
+    return boot_id, sequence
+
+
+def pack_request(client_message:str, negotiated_flags=0):
+    '''
+    Frames a legacy request string ('get', 'clear', 'echo'...).
+    A 'get since' request is a MSG_GET_SINCE if the server agreed to FLAG_SEQUENCE, otherwise it goes as text in a MSG_ECHO,
+    which a server without sequence numbers echoes back (see is_echo()). The same goes for 'stats' and FLAG_STATS.
+
+    Returns:
+    bytes: the header and payload to send.
+    int: the request's message type.
+    '''
+    get_since_request = parse_get_since_request(client_message)
+    if get_since_request is not None and negotiated_flags & FLAG_SEQUENCE:
+        payload = struct.pack(SINCE_REQUEST_FORMAT, *get_since_request)
+        return pack_header(MSG_GET_SINCE, len(payload)) + payload, MSG_GET_SINCE
+    if client_message == STATS_REQUEST and negotiated_flags & FLAG_STATS:
+        return pack_header(MSG_STATS), MSG_STATS
+    msg_type = COMMAND_MESSAGE_TYPES.get(client_message, MSG_ECHO)
+    payload = client_message.encode() if msg_type == MSG_ECHO else b''
+    return pack_header(msg_type, len(payload)) + payload, msg_type
+
+
+def is_echo(client_message:str, response):
+    # True if the response is the server echoing the request, which is how a server answers requests it does not know
+    echo = client_message.upper().encode()
+    # the length first: response may be a large memoryview
+    return response is not None and len(response) == len(echo) and bytes(response) == echo
+
+
+def check_response_header(header, request_type):
+    '''
+    Checks a response header against the request it answers, before its payload is received.
+
+    Args:
+    header (bytes-like): HEADER_SIZE bytes.
+    request_type (int): the message type of the request.
+
+    Returns:
+    int: the payload length.
+    int: the message type of the response, request_type | RESPONSE_BIT or MSG_ERROR | RESPONSE_BIT.
+    int: the flags.
+    int: the frame count.
+    '''
+    version, msg_type, flags, frame_count, payload_len = unpack_header(header)
+    if version != PROTOCOL_VERSION:
+        raise WireProtocolError(f'unsupported protocol version {version}')
+    if msg_type == MSG_ERROR | RESPONSE_BIT:
+        return payload_len, msg_type, flags, frame_count
+    if msg_type != request_type | RESPONSE_BIT:
+        raise WireProtocolError(f'response type {msg_type:#x} does not match request type {request_type:#x}')
+    # the frame count makes a short or padded 'get' payload detectable before it is decoded
+    if msg_type in (MSG_GET | RESPONSE_BIT, MSG_GET_SINCE | RESPONSE_BIT):
+        get_payload_len = payload_len - SINCE_RESPONSE_SIZE if msg_type == MSG_GET_SINCE | RESPONSE_BIT else payload_len
+        if flags & FLAG_COMPACT:
+            size_ok = get_payload_len >= get_compact_payload_min_size(frame_count)
+        else:
+            size_ok = get_payload_len == get_payload_size(frame_count)
+        if not size_ok:
+            raise WireProtocolError(f'payload of {payload_len} bytes does not hold {frame_count} frames')
+    return payload_len, msg_type, flags, frame_count
+
+
+def get_payload_size(frame_count):
+    # the size of a 'get' payload holding frame_count frames
+    return frame_count * WIRE_FRAME_SIZE + FINAL_TIMESTAMP_SIZE
+
+
+def decode_get_response(payload, receive_timestamp, flags=0, frame_count=None):
+    '''
+    Decodes a 'get' response payload in the encoding given by its header flags, see radar_frames.decode_get_payload().
+    A legacy payload (flags 0) does not need its frame count, so responses of the close-delimited protocol decode too.
+    '''
+    if flags & FLAG_COMPACT:
+        return decode_compact_get_payload(payload, receive_timestamp, frame_count)
+    return decode_get_payload(payload, receive_timestamp)
+
+
+def decode_get_since_response(payload, receive_timestamp, flags=0, frame_count=None):
+    '''
+    Decodes a 'get since' response payload: its prefix, then the 'get' payload, see decode_get_response().
+
+    Returns:
+    tuple: the batch and final timestamp, as decode_get_response().
+    tuple: (boot id, sequence number of the first frame in the batch, sequence number of the server's next frame).
+    '''
+    if len(payload) < SINCE_RESPONSE_SIZE:
+        raise WireProtocolError(f'get since response of {len(payload)} bytes')
+    position = struct.unpack_from(SINCE_RESPONSE_FORMAT, payload)
+    get_payload = payload[SINCE_RESPONSE_SIZE:]
+    if not flags & FLAG_COMPACT and (len(get_payload) - FINAL_TIMESTAMP_SIZE) % WIRE_FRAME_SIZE:
+        # also catches a server echoing the request
+        raise WireProtocolError(f'get since response of {len(payload)} bytes')
+    return decode_get_response(get_payload, receive_timestamp, flags, frame_count), position
+
+
+def decode_stats_response(payload):
+    '''
+    Decodes a 'stats' response payload.
+
+    Returns:
+    dict: the STATS_FIELDS counters, loop_time_buckets_ms (the upper bounds of the main loop time histogram's buckets)
+          and loop_time_histogram (the number of main loop iterations per bucket, one more than there are bounds).
+    '''
+    if len(payload) < STATS_SIZE + 1:
+        # also catches a server echoing the request
+        raise WireProtocolError(f'stats response of {len(payload)} bytes')
+    stats = dict(zip(STATS_FIELDS, struct.unpack_from(STATS_FORMAT, payload)))
+    n_buckets = payload[STATS_SIZE]
+    histogram_format = f'<{n_buckets}H{n_buckets + 1}I'
+    if len(payload) != STATS_SIZE + 1 + struct.calcsize(histogram_format):
+        raise WireProtocolError(f'stats response of {len(payload)} bytes with {n_buckets} histogram buckets')
+    histogram = struct.unpack_from(histogram_format, payload, STATS_SIZE + 1)
+    stats['loop_time_buckets_ms'] = list(histogram[:n_buckets])
+    stats['loop_time_histogram'] = list(histogram[n_buckets:])
+    return stats